@@ -1,42 +1,45 @@
 import argparse
 import json
 import os
-from pyserini.search.lucene import LuceneSearcher
+import numpy as np
 
-def main():
-    parser = argparse.ArgumentParser(description='Integrated Retrieval Script (BM25, TF-IDF, Binary)')
-    
-    # 共同參數
-    parser.add_argument('--index', type=str, required=True, help='Path to the pyserini index')
-    parser.add_argument('--queries', type=str, required=True, help='Path to queries.tsv (format: id \t query)')
-    parser.add_argument('--output', type=str, required=True, help='Output path for run.json')
-    parser.add_argument('--k', type=int, default=100, help='Top-k documents to retrieve')
-    parser.add_argument('--threads', type=int, default=10, help='Number of threads for batch retrieval')
-    
-    # 方法選擇 Flag
-    parser.add_argument('--method', type=str, required=True, choices=['bm25', 'tfidf', 'binary'], 
-                        help='Retrieval method: bm25, tfidf, or binary')
+METHODS = ['bm25', 'tfidf', 'binary']
 
-    # BM25 專屬參數 (如果選 binary 會自動被覆蓋為 0)
-    parser.add_argument('--k1', type=float, default=1.2, help='BM25 k1 parameter (default: 1.2)')
-    parser.add_argument('--b', type=float, default=0.75, help='BM25 b parameter (default: 0.75)')
 
-    args = parser.parse_args()
+def parse_method(spec, default_k1, default_b):
+    """
+    解析方法設定，例如 "bm25"、"tfidf"、"bm25:k1=0.9,b=0.4"。
 
-    # 1. 初始化 Searcher
-    print(f"Loading index from: {args.index}")
-    searcher = LuceneSearcher(args.index)
+    Returns:
+        {"name", "label", "k1", "b"}；label 用於輸出檔名與 log
+    """
+    name, _, params = spec.partition(':')
+    if name not in METHODS:
+        raise ValueError(f"Unknown method '{name}' (choose from {', '.join(METHODS)})")
+    method = {'name': name, 'label': name, 'k1': default_k1, 'b': default_b}
+    if params:
+        if name != 'bm25':
+            raise ValueError(f"Only bm25 takes parameters: '{spec}'")
+        for item in params.split(','):
+            key, _, value = item.partition('=')
+            if key not in ('k1', 'b') or not value:
+                raise ValueError(f"Invalid BM25 parameter '{item}' in '{spec}'")
+            method[key] = float(value)
+        method['label'] = f"bm25-k1_{method['k1']:g}-b_{method['b']:g}"
+    return method
 
-    # 2. 根據 Method 設定演算法邏輯
-    if args.method == 'bm25':
-        print(f">>> Method: BM25 (k1={args.k1}, b={args.b})")
-        searcher.set_bm25(args.k1, args.b)
+
+def set_similarity(searcher, method):
+    """切換 searcher 的相似度函數（同一個已開啟的索引可以重複切換）；失敗時回傳 False"""
+    if method['name'] == 'bm25':
+        print(f">>> Method: BM25 (k1={method['k1']}, b={method['b']})")
+        searcher.set_bm25(method['k1'], method['b'])
         
-    elif args.method == 'binary':
+    elif method['name'] == 'binary':
         print(">>> Method: Binary Retrieval (Simulated via BM25 k1=0, b=0)")
         searcher.set_bm25(k1=0.0, b=0.0)
         
-    elif args.method == 'tfidf':
+    elif method['name'] == 'tfidf':
         print(">>> Method: TF-IDF (ClassicSimilarity)")
         try:
             from jnius import autoclass
@@ -45,18 +48,15 @@ def main():
         except Exception as e:
             print(f"Error setting TF-IDF similarity: {e}")
             print("Please ensure 'jnius' is installed and Pyjnius environment is correct.")
-            return
+            return False
+    return True
 
-    # 3. 讀取 Queries
-    print(f"Reading queries from: {args.queries}")
+
+def read_queries(path):
+    """讀取 queries.tsv（格式：id \t query），回傳 (qids, texts)"""
     qids = []
     texts = []
-    
-    if not os.path.exists(args.queries):
-        print(f"Error: Query file not found at {args.queries}")
-        return
-
-    with open(args.queries, 'r', encoding='utf-8') as f:
+    with open(path, 'r', encoding='utf-8') as f:
         for line in f:
             line = line.strip()
             if not line: continue
@@ -67,14 +67,12 @@ def main():
                     texts.append(parts[1])
             except ValueError:
                 print(f"Skipping invalid line: {line}")
+    return qids, texts
 
-    print(f"Total queries loaded: {len(qids)}")
 
-    # 4. 執行批量檢索
-    print(f"Starting retrieval with {args.threads} threads (Top-{args.k})...")
-    hits_dict = searcher.batch_search(texts, qids, k=args.k, threads=args.threads)
-
-    # 5. 整理並儲存結果
+def run_batch(searcher, qids, texts, k, threads):
+    """執行批量檢索，回傳 {qid: {docid: score}}（依分數遞減）"""
+    hits_dict = searcher.batch_search(texts, qids, k=k, threads=threads)
     run_results = {}
     for qid in qids:
         if qid in hits_dict:
@@ -83,10 +81,199 @@ def main():
             run_results[qid] = {hit.docid: float(hit.score) for hit in hits}
         else:
             run_results[qid] = {}
+    return run_results
+
+
+def _flatten_run(run, qid_index):
+    """run -> (query 編號, docid, 名次, 分數) 四個平行陣列"""
+    queries, docids, ranks, scores = [], [], [], []
+    for qid, hits in run.items():
+        q = qid_index[qid]
+        for rank, (docid, score) in enumerate(sorted(hits.items(), key=lambda item: -item[1])):
+            queries.append(q)
+            docids.append(docid)
+            ranks.append(rank)
+            scores.append(score)
+    return (
+        np.array(queries, dtype=np.int64),
+        np.array(docids, dtype=object),
+        np.array(ranks, dtype=np.float64),
+        np.array(scores, dtype=np.float64),
+    )
+
+
+def _normalize(scores, groups, norm):
+    """在每個 group（方法 x 查詢）內正規化分數：minmax 或 zscore；none 不處理"""
+    if norm == 'none' or not len(scores):
+        return scores
+    num_groups = int(groups.max()) + 1
+    if norm == 'minmax':
+        low = np.full(num_groups, np.inf)
+        high = np.full(num_groups, -np.inf)
+        np.minimum.at(low, groups, scores)
+        np.maximum.at(high, groups, scores)
+        span = (high - low)[groups]
+        # 同一組只有一個分數（或分數都相同）時視為 1
+        return np.where(span > 0, (scores - low[groups]) / np.where(span > 0, span, 1.0), 1.0)
+    if norm == 'zscore':
+        counts = np.bincount(groups, minlength=num_groups)
+        mean = np.bincount(groups, weights=scores, minlength=num_groups) / np.maximum(counts, 1)
+        var = np.bincount(groups, weights=(scores - mean[groups]) ** 2, minlength=num_groups) / np.maximum(counts, 1)
+        std = np.sqrt(var)[groups]
+        return np.where(std > 0, (scores - mean[groups]) / np.where(std > 0, std, 1.0), 0.0)
+    raise ValueError(f"Unknown normalization: {norm}")
+
+
+def fuse_runs(runs, fusion='rrf', k=100, rrf_k=60, norm='minmax'):
+    """
+    融合多個 run（所有查詢一次以 NumPy 向量化計算）。
+
+    Args:
+        runs: [{qid: {docid: score}}, ...]
+        fusion: rrf（sum 1 / (rrf_k + rank)）或 combsum（正規化後的分數加總）
+        k: 每個查詢保留的筆數
+        rrf_k: RRF 常數
+        norm: combsum 的分數正規化方式（minmax / zscore / none）
+
+    Returns:
+        {qid: {docid: fused_score}}
+    """
+    qids = sorted({qid for run in runs for qid in run})
+    qid_index = {qid: i for i, qid in enumerate(qids)}
+    parts = [_flatten_run(run, qid_index) for run in runs]
+    queries = np.concatenate([p[0] for p in parts])
+    docids = np.concatenate([p[1] for p in parts])
+    ranks = np.concatenate([p[2] for p in parts])
+    scores = np.concatenate([p[3] for p in parts])
+    fused_run = {qid: {} for qid in qids}
+    if not len(queries):
+        return fused_run
+
+    if fusion == 'rrf':
+        contributions = 1.0 / (rrf_k + ranks + 1)
+    elif fusion == 'combsum':
+        method_ids = np.concatenate([np.full(len(p[0]), i, dtype=np.int64) for i, p in enumerate(parts)])
+        contributions = _normalize(scores, method_ids * len(qids) + queries, norm)
+    else:
+        raise ValueError(f"Unknown fusion: {fusion}")
+
+    # 相同 (查詢, docid) 的貢獻加總
+    doc_vocab, doc_codes = np.unique(docids.astype(str), return_inverse=True)
+    pair_keys = queries * len(doc_vocab) + doc_codes
+    pairs, pair_index = np.unique(pair_keys, return_inverse=True)
+    fused = np.bincount(pair_index, weights=contributions)
+    pair_queries = pairs // len(doc_vocab)
+    pair_docs = pairs % len(doc_vocab)
+
+    # 依 (查詢, 分數遞減) 排序後，每個查詢取前 k 筆
+    order = np.lexsort((-fused, pair_queries))
+    pair_queries, pair_docs, fused = pair_queries[order], pair_docs[order], fused[order]
+    starts = np.searchsorted(pair_queries, np.arange(len(qids)))
+    positions = np.arange(len(pair_queries)) - starts[pair_queries]
+    keep = positions < k
+    for q, d, score in zip(pair_queries[keep], pair_docs[keep], fused[keep]):
+        fused_run[qids[q]][str(doc_vocab[d])] = float(score)
+    return fused_run
+
+
+def write_run(path, run):
+    print(f"Saving results to: {path}")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(run, f, indent=2)
+
+
+def method_output_path(output, label):
+    """run.json -> run.<label>.json"""
+    stem, ext = os.path.splitext(output)
+    return f"{stem}.{label}{ext or '.json'}"
+
+
+def run_multi(args, searcher, qids, texts):
+    """同一個 searcher 依序執行多個方法，輸出各方法的 run 與融合後的 run"""
+    try:
+        methods = [parse_method(spec, args.k1, args.b) for spec in args.methods]
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    labels = [method['label'] for method in methods]
+    if len(set(labels)) != len(labels):
+        print(f"Error: duplicate methods in {labels}")
+        return
+
+    runs = []
+    for method in methods:
+        if not set_similarity(searcher, method):
+            return
+        print(f"Starting retrieval with {args.threads} threads (Top-{args.k})...")
+        run = run_batch(searcher, qids, texts, args.k, args.threads)
+        write_run(method_output_path(args.output, method['label']), run)
+        runs.append(run)
+
+    print(f">>> Fusion: {args.fusion.upper()} over {', '.join(labels)}"
+          + (f" (score normalization: {args.norm})" if args.fusion == 'combsum' else f" (k={args.rrf_k})"))
+    write_run(args.output, fuse_runs(runs, fusion=args.fusion, k=args.k, rrf_k=args.rrf_k, norm=args.norm))
+    print(f"Done. Methods {', '.join(labels)} and {args.fusion} fusion execution complete.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integrated Retrieval Script (BM25, TF-IDF, Binary)')
+    
+    # 共同參數
+    parser.add_argument('--index', type=str, required=True, help='Path to the pyserini index')
+    parser.add_argument('--queries', type=str, required=True, help='Path to queries.tsv (format: id \t query)')
+    parser.add_argument('--output', type=str, required=True, help='Output path for run.json')
+    parser.add_argument('--k', type=int, default=100, help='Top-k documents to retrieve')
+    parser.add_argument('--threads', type=int, default=10, help='Number of threads for batch retrieval')
+    
+    # 方法選擇 Flag（--method 執行單一方法；--methods 在同一個索引上執行多個方法並融合）
+    method_group = parser.add_mutually_exclusive_group(required=True)
+    method_group.add_argument('--method', type=str, choices=METHODS, 
+                        help='Retrieval method: bm25, tfidf, or binary')
+    method_group.add_argument('--methods', type=str, nargs='+',
+                        help='Several methods on one index, e.g. bm25 tfidf bm25:k1=0.9,b=0.4. '
+                             'Each run is written to <output>.<method>.json and the fused run to --output')
+
+    # 融合參數（只用於 --methods）
+    parser.add_argument('--fusion', type=str, default='rrf', choices=['rrf', 'combsum'],
+                        help='Fusion of the --methods runs (default: rrf)')
+    parser.add_argument('--rrf-k', type=int, default=60, help='RRF constant (default: 60)')
+    parser.add_argument('--norm', type=str, default='minmax', choices=['minmax', 'zscore', 'none'],
+                        help='Per-query score normalization for combsum (default: minmax)')
+
+    # BM25 專屬參數 (如果選 binary 會自動被覆蓋為 0)
+    parser.add_argument('--k1', type=float, default=1.2, help='BM25 k1 parameter (default: 1.2)')
+    parser.add_argument('--b', type=float, default=0.75, help='BM25 b parameter (default: 0.75)')
+
+    args = parser.parse_args()
+
+    # 1. 初始化 Searcher（多個方法共用同一個已開啟的索引與 JVM）
+    # 在這裡才匯入 pyserini：只用到融合函式（fuse_runs）時不需要 Java
+    from pyserini.search.lucene import LuceneSearcher
+    print(f"Loading index from: {args.index}")
+    searcher = LuceneSearcher(args.index)
+
+    # 2. 讀取 Queries
+    print(f"Reading queries from: {args.queries}")
+    if not os.path.exists(args.queries):
+        print(f"Error: Query file not found at {args.queries}")
+        return
+    qids, texts = read_queries(args.queries)
+    print(f"Total queries loaded: {len(qids)}")
+
+    if args.methods:
+        run_multi(args, searcher, qids, texts)
+        return
+
+    # 3. 根據 Method 設定演算法邏輯
+    if not set_similarity(searcher, parse_method(args.method, args.k1, args.b)):
+        return
+
+    # 4. 執行批量檢索
+    print(f"Starting retrieval with {args.threads} threads (Top-{args.k})...")
+    run_results = run_batch(searcher, qids, texts, args.k, args.threads)
 
-    print(f"Saving results to: {args.output}")
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(run_results, f, indent=2)
+    # 5. 儲存結果
+    write_run(args.output, run_results)
 
     print(f"Done. Method '{args.method}' execution complete.")
 
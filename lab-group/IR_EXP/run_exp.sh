@@ -13,6 +13,17 @@ python retrieve.py \
   --threads 30 \
   --k 100
 
+# Alternative: run several methods on one index and fuse them
+# (per-method runs: run.<method>.json, fused run: run.json)
+# python retrieve.py \
+#   --index $index_path \
+#   --queries $query_path \
+#   --output run.json \
+#   --methods bm25 tfidf binary \
+#   --fusion rrf \
+#   --threads 30 \
+#   --k 100
+
 # 2. Evaluation
 
 python evaluate.py \
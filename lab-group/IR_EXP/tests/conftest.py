@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 測試直接匯入 IR_EXP/ 下的 retrieve.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,59 @@
+import pytest
+
+from retrieve import fuse_runs, parse_method
+
+RUN_A = {"q1": {"d1": 12.0, "d2": 10.0, "d3": 3.0}, "q2": {"d9": 1.0}}
+RUN_B = {"q1": {"d2": 0.9, "d4": 0.5}, "q3": {"d1": 2.0, "d2": 2.0}}
+
+
+def _rrf(ranks, rrf_k=60):
+    return sum(1.0 / (rrf_k + rank) for rank in ranks)
+
+
+def test_rrf_sums_reciprocal_ranks():
+    fused = fuse_runs([RUN_A, RUN_B], fusion="rrf", k=10)
+    assert set(fused) == {"q1", "q2", "q3"}
+    assert fused["q1"] == pytest.approx({
+        "d2": _rrf([2, 1]),
+        "d1": _rrf([1]),
+        "d4": _rrf([2]),
+        "d3": _rrf([3]),
+    })
+    assert list(fused["q1"]) == ["d2", "d1", "d4", "d3"]
+    assert fused["q2"] == pytest.approx({"d9": _rrf([1])})
+
+
+def test_k_limits_each_query():
+    fused = fuse_runs([RUN_A, RUN_B], fusion="rrf", k=2)
+    assert list(fused["q1"]) == ["d2", "d1"]
+    assert len(fused["q3"]) == 2
+
+
+def test_combsum_minmax():
+    fused = fuse_runs([RUN_A, RUN_B], fusion="combsum", k=10, norm="minmax")
+    # RUN_A/q1：(12, 10, 3) -> (1, 7/9, 0)；RUN_B/q1：(0.9, 0.5) -> (1, 0)
+    assert fused["q1"] == pytest.approx({"d1": 1.0, "d2": 7 / 9 + 1.0, "d3": 0.0, "d4": 0.0})
+    # 只有一個分數（或分數都相同）時視為 1
+    assert fused["q2"] == pytest.approx({"d9": 1.0})
+    assert fused["q3"] == pytest.approx({"d1": 1.0, "d2": 1.0})
+
+
+def test_combsum_zscore():
+    fused = fuse_runs([{"q": {"a": 3.0, "b": 1.0}}, {"q": {"a": 5.0, "b": 5.0}}], fusion="combsum", norm="zscore")
+    assert fused["q"] == pytest.approx({"a": 1.0, "b": -1.0})
+
+
+def test_empty_and_unknown_fusion():
+    assert fuse_runs([{}, {"q": {}}]) == {"q": {}}
+    with pytest.raises(ValueError):
+        fuse_runs([RUN_A], fusion="max")
+
+
+def test_parse_method():
+    assert parse_method("tfidf", 1.2, 0.75) == {"name": "tfidf", "label": "tfidf", "k1": 1.2, "b": 0.75}
+    assert parse_method("bm25:k1=0.9,b=0.4", 1.2, 0.75) == {
+        "name": "bm25", "label": "bm25-k1_0.9-b_0.4", "k1": 0.9, "b": 0.4
+    }
+    for spec in ("dense", "tfidf:k1=1", "bm25:k3=1", "bm25:k1="):
+        with pytest.raises(ValueError):
+            parse_method(spec, 1.2, 0.75)
@@ -1,6 +1,8 @@
+import json
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from models.schemas import SimpleChatRequest, SimpleChatResponse
-from services.chat_service import generate_response
+from services.chat_service import generate_response, stream_response, get_cache_stats
 
 router = APIRouter()
 
@@ -42,7 +44,8 @@ async def chat(request: SimpleChatRequest):
             conversation_history=history,
             ptkb_list=request.ptkb_list or [],
             conversation_id=request.conversation_id,
-            selected_doc_ids=request.selected_doc_ids or [] # <-- 這一行是讓 NotebookLM 勾選功能生效的關鍵
+            selected_doc_ids=request.selected_doc_ids or [], # <-- 這一行是讓 NotebookLM 勾選功能生效的關鍵
+            include_timings=bool(request.include_timings)
         )
         
         print("[INFO] /api/chat: Response generated successfully")
@@ -54,3 +57,67 @@ async def chat(request: SimpleChatRequest):
     except Exception as e:
         print(f"[ERROR] /api/chat: Error processing request: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def _format_sse(event: str, data: dict) -> str:
+    """將事件格式化為 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: SimpleChatRequest):
+    """
+    串流版對話端點 (Server-Sent Events)
+    
+    事件順序：
+        sources -> token (多次) -> done
+    生成失敗時會送出 error 事件，之後仍會送出 done。
+    
+    Args:
+        request: SimpleChatRequest (與 /chat 相同)
+        
+    Returns:
+        text/event-stream 串流回應
+        
+    Raises:
+        HTTPException: 400 if query is invalid
+    """
+    if not request.query or not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query cannot be empty")
+    
+    print(f"[INFO] /api/chat/stream: Received query: {request.query}")
+    
+    history = [
+        {"role": msg.role, "content": msg.content}
+        for msg in (request.history or [])
+    ]
+    
+    async def event_stream():
+        events = stream_response(
+            query=request.query,
+            conversation_history=history,
+            ptkb_list=request.ptkb_list or [],
+            conversation_id=request.conversation_id,
+            selected_doc_ids=request.selected_doc_ids or [],
+            include_timings=bool(request.include_timings)
+        )
+        try:
+            async for event, data in events:
+                yield _format_sse(event, data)
+            print("[INFO] /api/chat/stream: Stream completed")
+        except Exception as e:
+            print(f"[ERROR] /api/chat/stream: Error processing request: {e}")
+            yield _format_sse("error", {"detail": str(e)})
+        finally:
+            # client 斷線時 event_stream 被關閉：同時關閉 stream_response，Gemini 串流隨之釋放
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 避免反向代理緩衝整段回應
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/chat/cache/stats")
+async def chat_cache_stats():
+    """回傳 chat pipeline 快取（查詢改寫等）的命中 / 未命中次數"""
+    return get_cache_stats()
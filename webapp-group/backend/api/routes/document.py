@@ -1,31 +1,55 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import asyncio
+from typing import Optional
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query
 from services.document import DocumentService
 
 # 建立 Router
 router = APIRouter()
 document_service = DocumentService()
 
-@router.post("/upload", summary="上傳文件", description="上傳文件以進行索引")
+@router.post("/upload", summary="上傳文件", description="上傳文件，於背景進行解析與索引")
 async def upload_document(file: UploadFile = File(...)):
     try:
+        # 存檔後立即回傳 job id，解析與索引在背景執行
         result = await document_service.process_upload(file)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         # 在實際生產環境中，建議使用 logger 紀錄錯誤，而不是直接 print
         print(f"Upload error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/status/{doc_id}", summary="查詢文件處理進度")
+async def document_status(doc_id: str):
+    """回傳背景 ingestion 的進度（頁數、chunk 數、索引狀態）"""
+    status = document_service.get_status(doc_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return status
+
 @router.get("/list", summary="列出已索引文件")
-async def list_documents():
-    """回傳所有已索引的文件列表"""
-    return document_service.list_documents()
+async def list_documents(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    sort: str = Query("created_at", description="created_at / updated_at / filename / size / chunks / status"),
+    order: str = Query("asc", pattern="^(asc|desc)$")
+):
+    """回傳文件列表（支援分頁與排序；未指定 limit 時回傳全部）"""
+    try:
+        return await asyncio.to_thread(document_service.list_documents, offset, limit, sort, order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/delete/{doc_id}", summary="刪除文件")
 async def delete_document(doc_id: str):
     """刪除指定文件及其索引"""
     try:
-        document_service.delete_document(doc_id)
+        # 刪除後會重建索引，放到 worker thread 避免卡住其他請求
+        await asyncio.to_thread(document_service.delete_document, doc_id)
         return {"status": "deleted", "id": doc_id}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Delete document failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
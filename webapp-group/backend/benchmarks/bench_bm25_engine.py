@@ -0,0 +1,154 @@
+"""
+BM25 引擎效能測試：NumPy 引擎（services/bm25_engine.py）與 Lucene（Pyserini）的延遲及排序一致性。
+
+以合成語料（Zipf 分佈的字詞）或既有的 JSONL 目錄建立兩種索引，執行同一組查詢並回報：
+    - 建索引時間、冷啟動載入時間
+    - 每次查詢的延遲（p50 / p95），含與不含 doc_id 過濾
+    - 與 Lucene 結果的 overlap@k 與 top-1 一致率（未安裝 Pyserini / Java 時只量測 NumPy 引擎）
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_bm25_engine.py --docs 200 --chunks-per-doc 50
+    python benchmarks/bench_bm25_engine.py --jsonl-dir data/jsonl --queries 500
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.bm25_engine import BM25Engine, lucene_available  # noqa: E402
+
+
+def _make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    return sorted(words)
+
+
+def synthetic_corpus(out_dir: str, docs: int, chunks_per_doc: int, seed: int = 0):
+    """寫出 docs 份 JSONL 文件，字詞頻率服從 Zipf 分佈"""
+    rng = random.Random(seed)
+    vocab = _make_vocabulary(20000, rng)
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocab))))
+    for d in range(docs):
+        doc_id = f"bench-{d:05d}"
+        with open(os.path.join(out_dir, f"{doc_id}.json"), "w", encoding="utf-8") as f:
+            for c in range(chunks_per_doc):
+                text = " ".join(rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(40, 90)))
+                f.write(json.dumps({"id": f"{doc_id}#{c}", "contents": text}) + "\n")
+
+
+
+def sample_queries(jsonl_dir: str, count: int, seed: int = 0):
+    """從語料中隨機取 chunk，再取其中 2～4 個字當作查詢"""
+    rng = random.Random(seed)
+    files = sorted(f for f in os.listdir(jsonl_dir) if f.endswith(".json"))
+    queries = []
+    while len(queries) < count:
+        with open(os.path.join(jsonl_dir, rng.choice(files)), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        if not lines:
+            continue
+        words = json.loads(rng.choice(lines)).get("contents", "").split()
+        if len(words) >= 4:
+            queries.append(" ".join(rng.sample(words, rng.randint(2, 4))))
+    return queries
+
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def build_lucene(jsonl_dir: str, index_dir: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([
+        sys.executable, "-m", "pyserini.index.lucene",
+        "--collection", "JsonCollection",
+        "--input", jsonl_dir,
+        "--index", index_dir,
+        "--generator", "DefaultLuceneDocumentGenerator",
+        "--threads", "1"
+    ], check=True, capture_output=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy BM25 engine against Lucene")
+    parser.add_argument("--jsonl-dir", help="既有的 JSONL 目錄（未指定時產生合成語料）")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--chunks-per-doc", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=13, help="取回筆數（與 chat_service.NUM_PASSAGES 相同）")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    jsonl_dir = args.jsonl_dir
+    if not jsonl_dir:
+        jsonl_dir = os.path.join(tmp_dir, "jsonl")
+        os.makedirs(jsonl_dir)
+        synthetic_corpus(jsonl_dir, args.docs, args.chunks_per_doc)
+        print(f"[INFO] Generated synthetic corpus in {jsonl_dir}")
+    doc_ids = sorted(f[:-len(".json")] for f in os.listdir(jsonl_dir) if f.endswith(".json"))
+    queries = sample_queries(jsonl_dir, args.queries)
+    rng = random.Random(1)
+    filters = [rng.sample(doc_ids, max(1, len(doc_ids) // 10)) for _ in queries]
+
+    engine = BM25Engine(root=os.path.join(tmp_dir, "bm25"))
+    started = time.perf_counter()
+    engine.sync(jsonl_dir)
+    print(f"[INFO] NumPy engine built in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    cold = BM25Engine(root=engine.root)
+    cold.search(queries[0], None, args.k)
+    print(f"[INFO] NumPy engine cold load + first query: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    numpy_results, numpy_times, numpy_filtered = [], [], []
+    for query, selected in zip(queries, filters):
+        started = time.perf_counter()
+        numpy_results.append(engine.search(query, None, args.k))
+        numpy_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        engine.search(query, selected, args.k)
+        numpy_filtered.append(time.perf_counter() - started)
+    print(f"{'engine':>8}  {'p50 ms':>8}  {'p95 ms':>8}  {'filtered p50':>12}  {'filtered p95':>12}")
+    print(f"{'numpy':>8}  {_percentiles(numpy_times)[0]:>8.2f}  {_percentiles(numpy_times)[1]:>8.2f}  "
+          f"{_percentiles(numpy_filtered)[0]:>12.2f}  {_percentiles(numpy_filtered)[1]:>12.2f}")
+
+    if not lucene_available():
+        print("[WARNING] Pyserini not available. Skipping the Lucene comparison.")
+        return
+
+    from pyserini.search.lucene import LuceneSearcher
+
+    index_dir = os.path.join(tmp_dir, "lucene-index")
+    print(f"[INFO] Lucene index built in {build_lucene(jsonl_dir, index_dir):.2f}s")
+    searcher = LuceneSearcher(index_dir)
+    searcher.set_bm25(engine.k1, engine.b)
+
+    lucene_times, overlaps, top1 = [], [], 0
+    for query, expected in zip(queries, numpy_results):
+        started = time.perf_counter()
+        hits = searcher.search(query, k=args.k)
+        lucene_times.append(time.perf_counter() - started)
+        lucene_ids = [hit.docid for hit in hits]
+        numpy_ids = [chunk_id for chunk_id, _ in expected]
+        if lucene_ids or numpy_ids:
+            overlaps.append(len(set(lucene_ids) & set(numpy_ids)) / max(len(lucene_ids), len(numpy_ids)))
+        top1 += bool(lucene_ids and numpy_ids and lucene_ids[0] == numpy_ids[0])
+    print(f"{'lucene':>8}  {_percentiles(lucene_times)[0]:>8.2f}  {_percentiles(lucene_times)[1]:>8.2f}")
+    print(f"[INFO] overlap@{args.k}: {statistics.mean(overlaps):.3f}, top-1 agreement: {top1 / len(queries):.3f}")
+
+
+if __name__ == "__main__":
+    main()
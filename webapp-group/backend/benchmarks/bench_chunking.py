@@ -0,0 +1,226 @@
+"""
+分塊效能測試：以數 MB 的文字檔比較舊版 _chunk_text、先算好句子邊界的版本與串流分塊器（services/chunking.py）。
+
+三者都走上傳時的路徑「讀檔 -> 分塊 -> 寫出 JSONL」，量測時間與記憶體峰值（tracemalloc），
+並確認輸出完全相同。
+
+先算邊界的版本一次掃描全文、記錄所有句子結束符號的位置，每個視窗以 bisect 取切分點；
+每個結束符號都要在 Python 中處理一次，而逐視窗偷看只讀切分點後的 LOOK_AHEAD 個字，
+所以串流分塊器保留逐視窗偷看（兩者都是線性時間）。
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_chunking.py --mb 8
+    python benchmarks/bench_chunking.py --file path/to/text.txt --chunk-size 500 --overlap 100
+"""
+import argparse
+import json
+from bisect import bisect_left
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.chunking import LOOK_AHEAD, SENTENCE_ENDINGS, iter_text_chunks, iter_text_file  # noqa: E402
+
+EN_WORDS = (
+    "retrieval index query document passage ranking lucene analyzer token score "
+    "semantic vector corpus relevance feedback cluster summary answer context model"
+).split()
+ZH_WORDS = ["檢索", "索引", "查詢", "文件", "段落", "排序", "分詞", "語意", "向量", "摘要", "回答", "模型"]
+
+
+def legacy_chunk_text(text: str, chunk_size: int = 500, overlap: int = 100):
+    """舊版 DocumentService._chunk_text（每個視窗複製偷看範圍，並對每個結束符號各搜尋一次）"""
+    if not text:
+        return []
+
+    chunks = []
+    start = 0
+    text_len = len(text)
+
+    while start < text_len:
+        end = min(start + chunk_size, text_len)
+
+        if end < text_len:
+            look_ahead_buffer = text[end:min(end + 50, text_len)]
+            sentence_endings = ["。", "！", "？", ".", "!", "?", "\n"]
+
+            found_cut_point = False
+            for char in sentence_endings:
+                if char in look_ahead_buffer:
+                    end += (look_ahead_buffer.index(char) + 1)
+                    found_cut_point = True
+                    break
+
+            if not found_cut_point and " " in look_ahead_buffer:
+                end += (look_ahead_buffer.index(" ") + 1)
+
+        chunk = text[start:end]
+        if chunk.strip():
+            chunks.append(chunk.strip())
+
+        start += (chunk_size - overlap)
+        if start >= end:
+            start = end
+
+    return chunks
+
+
+def precomputed_chunk_text(text: str, chunk_size: int = 500, overlap: int = 100):
+    """
+    先以 str.find 一次找出所有句子結束符號的位置，每個視窗只在偷看範圍內的位置中
+    選優先順序最高（SENTENCE_ENDINGS 中較前面）的符號；輸出與 legacy_chunk_text 相同
+    """
+    rank_of = {char: rank for rank, char in enumerate(SENTENCE_ENDINGS)}
+    boundaries = []
+    for char in SENTENCE_ENDINGS:
+        i = text.find(char)
+        while i >= 0:
+            boundaries.append(i)
+            i = text.find(char, i + 1)
+    boundaries.sort()
+
+    chunks = []
+    start = 0
+    cursor = 0
+    text_len = len(text)
+    while start < text_len:
+        end = min(start + chunk_size, text_len)
+        if end < text_len:
+            limit = min(end + LOOK_AHEAD, text_len)
+            cursor = bisect_left(boundaries, end, cursor)
+            cut, cut_rank = -1, len(SENTENCE_ENDINGS)
+            i = cursor
+            while i < len(boundaries) and boundaries[i] < limit:
+                rank = rank_of[text[boundaries[i]]]
+                if rank < cut_rank:
+                    cut, cut_rank = boundaries[i], rank
+                i += 1
+            if cut >= 0:
+                end = cut + 1
+            else:
+                space = text.find(" ", end, limit)
+                if space >= 0:
+                    end = space + 1
+
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+
+        start += (chunk_size - overlap)
+        if start >= end:
+            start = end
+
+    return chunks
+
+
+def synthetic_text(kind: str, num_chars: int, seed: int = 0) -> str:
+    """產生英文（en）、中文（zh）或中英混合（mixed）的段落文字"""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    while size < num_chars:
+        if kind == "en" or (kind == "mixed" and rng.random() < 0.5):
+            sentence = " ".join(rng.choice(EN_WORDS) for _ in range(rng.randint(6, 30))) + rng.choice([". ", "? ", "! "])
+        else:
+            sentence = "".join(rng.choice(ZH_WORDS) for _ in range(rng.randint(5, 40))) + rng.choice(["。", "？", "！"])
+        if rng.random() < 0.1:
+            sentence += "\n"
+        parts.append(sentence)
+        size += len(sentence)
+    return "".join(parts)[:num_chars]
+
+
+def _write_jsonl(chunks, out) -> int:
+    count = 0
+    for idx, chunk in enumerate(chunks):
+        out.write(json.dumps({"id": f"bench#{idx}", "contents": chunk}, ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def legacy_pipeline(path: str, chunk_size: int, overlap: int, out) -> int:
+    """舊版：整個檔案讀進記憶體，切出完整的 chunk list 後才寫出"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        text = f.read()
+    chunks = legacy_chunk_text(text, chunk_size, overlap)
+    return _write_jsonl(chunks, out)
+
+
+def precomputed_pipeline(path: str, chunk_size: int, overlap: int, out) -> int:
+    """先算邊界版：與舊版相同讀入整個檔案，只有切分點的找法不同"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        text = f.read()
+    return _write_jsonl(precomputed_chunk_text(text, chunk_size, overlap), out)
+
+
+def streaming_pipeline(path: str, chunk_size: int, overlap: int, out) -> int:
+    """串流版：逐段讀檔，每產生一個 chunk 就寫出"""
+    return _write_jsonl(iter_text_chunks(iter_text_file(path), chunk_size, overlap), out)
+
+
+def _measure(pipeline, path: str, args):
+    """回傳 (最佳秒數, 記憶體峰值 MB, chunk 數)；峰值另外跑一次（tracemalloc 會拖慢執行）"""
+    with open(os.devnull, "w", encoding="utf-8") as out:
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            count = pipeline(path, args.chunk_size, args.overlap, out)
+            best = min(best, time.perf_counter() - started)
+        tracemalloc.start()
+        pipeline(path, args.chunk_size, args.overlap, out)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak / 1e6, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark legacy, precomputed-boundary and streaming text chunking")
+    parser.add_argument("--file", help="要測試的 UTF-8 文字檔（未指定時產生合成文字）")
+    parser.add_argument("--mb", type=float, default=4, help="合成文字的大小（百萬字元）")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--overlap", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3, help="每種分塊器重複幾次取最佳值")
+    args = parser.parse_args()
+
+    if args.file:
+        paths = [(os.path.basename(args.file), args.file)]
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        paths = []
+        for kind in ("en", "zh", "mixed"):
+            path = os.path.join(tmp_dir, f"{kind}.txt")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write(synthetic_text(kind, int(args.mb * 1_000_000)))
+            paths.append((kind, path))
+        print(f"[INFO] Generated synthetic texts in {tmp_dir}")
+
+    print(
+        f"{'text':>8}  {'MB':>6}  {'chunks':>7}  {'legacy s':>8}  {'bounds s':>8}  {'stream s':>8}  "
+        f"{'legacy peak MB':>14}  {'stream peak MB':>14}"
+    )
+    for name, path in paths:
+        legacy_time, legacy_peak, count = _measure(legacy_pipeline, path, args)
+        bounds_time, _, _ = _measure(precomputed_pipeline, path, args)
+        stream_time, stream_peak, _ = _measure(streaming_pipeline, path, args)
+
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+        expected = legacy_chunk_text(text, args.chunk_size, args.overlap)
+        if precomputed_chunk_text(text, args.chunk_size, args.overlap) != expected:
+            print(f"[ERROR] Precomputed-boundary chunker output differs from the legacy chunker for '{name}'")
+        if list(iter_text_chunks(iter_text_file(path), args.chunk_size, args.overlap)) != expected:
+            print(f"[ERROR] Streaming chunker output differs from the legacy chunker for '{name}'")
+        print(
+            f"{name:>8}  {os.path.getsize(path) / 1e6:>6.1f}  {count:>7}  {legacy_time:>8.3f}  {bounds_time:>8.3f}  {stream_time:>8.3f}  "
+            f"{legacy_peak:>14.1f}  {stream_peak:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Dense 向量索引效能測試（services/dense_index.py）：10k / 100k / 1M 個 chunk 的暴力搜尋吞吐量。
+
+以隨機的單位向量建立索引（每份文件 --chunks-per-doc 列），量測：
+    - 單一查詢延遲（掃描所有文件 / 只掃描 10% 文件的 doc_id 過濾）
+    - 批次查詢吞吐量（一次矩陣乘法處理 --batch 個查詢）
+    - HashingEncoder 的編碼速度（chunks/s）
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_dense_index.py
+    python benchmarks/bench_dense_index.py --sizes 10000,100000 --dtype float16 --dim 768
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.dense_index import DenseIndex, HashingEncoder, DENSE_BLOCK_ROWS  # noqa: E402
+
+WORDS = (
+    "retrieval index query document passage ranking lucene analyzer token score "
+    "semantic vector corpus relevance feedback cluster summary answer context model"
+).split()
+
+
+def build_index(root: str, num_chunks: int, dim: int, dtype: str, chunks_per_doc: int, seed: int = 0) -> DenseIndex:
+    """寫入 num_chunks 個隨機單位向量（不經過編碼器，只測試檢索）"""
+    rng = np.random.default_rng(seed)
+    index = DenseIndex(root=root, encoder=HashingEncoder(dim), dtype=dtype, block_rows=DENSE_BLOCK_ROWS)
+    for doc, start in enumerate(range(0, num_chunks, chunks_per_doc)):
+        rows = min(chunks_per_doc, num_chunks - start)
+        vectors = rng.standard_normal((rows, dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index._save(f"bench-{doc:06d}", vectors)
+    return index
+
+
+def _timed(fn, repeat: int) -> float:
+    """回傳最佳秒數"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_encoder(dim: int, count: int = 2000) -> float:
+    rng = random.Random(0)
+    texts = [" ".join(rng.choice(WORDS) for _ in range(80)) for _ in range(count)]
+    encoder = HashingEncoder(dim)
+    started = time.perf_counter()
+    encoder.encode(texts)
+    return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark brute-force dense chunk retrieval")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="以逗號分隔的 chunk 數")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--dtype", choices=["float16", "int8"], default="int8")
+    parser.add_argument("--chunks-per-doc", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=13)
+    parser.add_argument("--batch", type=int, default=32, help="批次查詢的查詢數")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"[INFO] HashingEncoder({args.dim}): {bench_encoder(args.dim):.0f} chunks/s")
+    print(
+        f"{'chunks':>9}  {'MB':>7}  {'1 query ms':>10}  {'filtered ms':>11}  "
+        f"{'batch ms':>9}  {'queries/s':>9}  {'chunks/s (M)':>12}"
+    )
+    rng = np.random.default_rng(1)
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as root:
+            index = build_index(root, size, args.dim, args.dtype, args.chunks_per_doc)
+            doc_ids = index.stored_doc_ids()
+            selected = doc_ids[::10]
+            queries = rng.standard_normal((args.batch, args.dim), dtype=np.float32)
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            index.search_vectors(queries[:1], None, args.k)   # 預熱 page cache
+
+            single = _timed(lambda: index.search_vectors(queries[:1], None, args.k), args.repeat)
+            filtered = _timed(lambda: index.search_vectors(queries[:1], selected, args.k), args.repeat)
+            batch = _timed(lambda: index.search_vectors(queries, None, args.k), args.repeat)
+            size_mb = sum(os.path.getsize(os.path.join(root, f)) for f in os.listdir(root)) / 1e6
+            print(
+                f"{size:>9}  {size_mb:>7.1f}  {single * 1000:>10.2f}  {filtered * 1000:>11.2f}  "
+                f"{batch * 1000:>9.2f}  {args.batch / batch:>9.1f}  {size * args.batch / batch / 1e6:>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+PDF 解析效能測試：以合成的多頁 PDF 量測 1..N 個 worker 的 pages/sec。
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_pdf_extract.py --pages 300 --max-workers 4
+    python benchmarks/bench_pdf_extract.py --pdf path/to/report.pdf
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.pdf_extract import extract_pdf_text  # noqa: E402
+
+WORDS = (
+    "retrieval index query document passage ranking lucene analyzer token score "
+    "semantic vector corpus relevance feedback cluster summary answer context model"
+).split()
+
+
+def _escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, num_pages: int, lines_per_page: int = 45, seed: int = 0) -> None:
+    """產生每頁數十行英文文字的 PDF（Helvetica，直接寫 PDF 物件，不需額外套件）"""
+    rng = random.Random(seed)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages，等 Kids 決定後再填
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for _ in range(num_pages):
+        lines = [" ".join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines_per_page)]
+        body = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({_escape_pdf_text(line)}) Tj T*" for line in lines) + " ET"
+        stream = body.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % num_pages
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for i, obj in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % i + obj + b"\nendobj\n")
+        xref_at = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel PDF text extraction")
+    parser.add_argument("--pdf", help="要測試的 PDF（未指定時產生合成 PDF）")
+    parser.add_argument("--pages", type=int, default=300, help="合成 PDF 的頁數")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3, help="每個 worker 數重複幾次取最佳值")
+    args = parser.parse_args()
+
+    if args.pdf:
+        pdf_path = args.pdf
+    else:
+        pdf_path = os.path.join(tempfile.mkdtemp(), "synthetic.pdf")
+        write_synthetic_pdf(pdf_path, args.pages)
+        print(f"[INFO] Generated synthetic PDF with {args.pages} pages: {pdf_path}")
+
+    baseline_text = None
+    baseline_rate = None
+    print(f"{'workers':>7}  {'seconds':>8}  {'pages/sec':>9}  {'speedup':>7}")
+    for workers in range(1, args.max_workers + 1):
+        pages = [0]
+        on_page = lambda done, total: pages.__setitem__(0, total)
+        # 先跑一次暖機（process pool 在服務中是常駐的，不計入啟動時間）
+        text = extract_pdf_text(pdf_path, workers=workers, on_page=on_page)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            extract_pdf_text(pdf_path, workers=workers)
+            best = min(best, time.perf_counter() - started)
+
+        if baseline_text is None:
+            baseline_text = text
+        elif text != baseline_text:
+            print(f"[ERROR] Output with {workers} workers differs from single-worker output")
+        rate = pages[0] / best
+        baseline_rate = baseline_rate or rate
+        print(f"{workers:>7}  {best:>8.2f}  {rate:>9.1f}  {rate / baseline_rate:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -104,6 +104,24 @@ def format_summarize_prompt(context: str, utterance: str, passages_text: str) ->
 
 Please carefully read the user's question and the passages, then summarize only the information from the passages that is relevant for answering the question."""
 
+SYSTEM_PROMPT_SUMMARIZE_GENERIC = """
+You are an expert extractive summarization assistant.
+Your task is to synthesize the key information from the following passages so the summary can be reused for different questions about the same passages.
+
+- Keep the main facts, definitions, numbers and named entities.
+- Extract objective, verifiable facts.
+- Avoid speculation.
+- The summary must be a factual, concise, and coherent paragraph under 250 words.
+- Your entire response must follow the format: 'summary: <your answer>'
+"""
+
+def format_generic_summarize_prompt(passages_text: str) -> str:
+    """Format the question-independent summarization prompt."""
+    return f"""**Passages to Summarize:**
+{passages_text}
+
+Please carefully read the passages, then summarize the key information they contain."""
+
 def parse_summary_response(response_text: str) -> str:
     """Parse the summary response."""
     text = response_text.strip()
@@ -1,7 +1,10 @@
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 # 修改重點 1: 同時匯入 chat、document 和 notebook
 from api.routes import chat, document, notebook
+from services.metrics import render_metrics, CONTENT_TYPE_LATEST
 
 app = FastAPI(
     title="NotebookLM Chatbot API",
@@ -28,6 +31,11 @@ app.include_router(document.router, prefix="/api/document", tags=["document"])
 # 修改重點 3: 新增 Notebook 路由 -> /api/notebook/generate, /api/notebook/edit
 app.include_router(notebook.router, prefix="/api/notebook", tags=["notebook"])
 
+@app.on_event("startup")
+async def migrate_index_layout():
+    # 舊版單一索引 -> 每個 analyzer 一個子索引；在背景執行，不延遲啟動
+    asyncio.create_task(asyncio.to_thread(document.document_service.ensure_index_layout))
+
 @app.get("/")
 async def root():
     return {"message": "NotebookLM Chatbot API is running"}
@@ -36,6 +44,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus 格式：各階段耗時、Gemini 請求耗時 / 重試次數 / prompt 與輸出大小
+    return Response(content=render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
     # 讓你可以直接用 python main.py 執行
@@ -12,6 +12,8 @@ class SimpleChatRequest(BaseModel):
     ptkb_list: Optional[List[str]] = []
     # [新增] 接收前端傳來的：使用者勾選的檔案 ID 列表
     selected_doc_ids: Optional[List[str]] = [] 
+    # 為 True 時在回應中附上各階段耗時（毫秒）
+    include_timings: Optional[bool] = False
 
 class SimpleChatResponse(BaseModel):
     answer: str
@@ -20,6 +22,8 @@ class SimpleChatResponse(BaseModel):
     new_ptkb: Optional[str] = None
     # [新增] 回傳引用來源 (讓前端知道我們參考了哪些檔案內容)
     sources: Optional[List[Dict[str, Any]]] = []
+    # include_timings 時才有值：{"rewrite": 812.4, "search": 35.1, ..., "total": 2411.0}
+    timings: Optional[Dict[str, float]] = None
 
 # --- 以下保留給未來擴充使用 (可以不用動) ---
 class Citation(BaseModel):
@@ -0,0 +1,585 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
+
+from services.searcher_pool import INDEX_ROOT
+from services.text_analysis import analyze
+
+# [可選] NumPy：沒有安裝時停用程式內 BM25 引擎（只能使用 Lucene）
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError as e:
+    print(f"[WARNING] NumPy not available: {e}")
+    NUMPY_AVAILABLE = False
+    np = None
+
+# ================= 設定區 =================
+# 程式內 BM25 引擎的索引位置：
+#   part-<id>/             不可變的 part：一批文件的 term-frequency CSC 矩陣（.npy，以 mmap 載入）
+#   manifest-<id>.json     目前的 part 列表與已刪除（尚未 compaction）的 doc_id
+#   CURRENT                目前使用的 manifest 名稱
+BM25_INDEX_DIR = os.path.join(INDEX_ROOT, "bm25")
+
+# 檢索後端：auto（Pyserini 可用時用 Lucene，否則用 NumPy 引擎）/ lucene / numpy
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "auto").lower()
+LUCENE_BACKEND = "lucene"
+NUMPY_BACKEND = "numpy"
+
+# BM25 參數（與 lab-group/IR_EXP/retrieve.py 及 Lucene 預設值相同）
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Lucene 以一個 byte 儲存文件長度（SmallFloat.intToByte4）：小於此值的長度精確保存
+_EXACT_NORM_LENGTHS = 24
+
+
+@lru_cache(maxsize=1)
+def lucene_available() -> bool:
+    """Pyserini 的 LuceneSearcher 是否可以匯入（需要 Java）"""
+    try:
+        from pyserini.search.lucene import LuceneSearcher  # noqa: F401
+        return True
+    except (ImportError, Exception):
+        return False
+
+
+def search_backend() -> Optional[str]:
+    """
+    回傳目前使用的檢索後端。
+
+    Returns:
+        "lucene" 或 "numpy"；選擇的後端無法使用（Pyserini / NumPy 未安裝）時為 None（停用 RAG 檢索）
+    """
+    if SEARCH_BACKEND == NUMPY_BACKEND:
+        return NUMPY_BACKEND if NUMPY_AVAILABLE else None
+    if lucene_available():
+        return LUCENE_BACKEND
+    return None if SEARCH_BACKEND == LUCENE_BACKEND or not NUMPY_AVAILABLE else NUMPY_BACKEND
+
+
+def _lucene_doc_length(lengths: "np.ndarray") -> "np.ndarray":
+    """
+    模擬 Lucene 的 norm 編碼：長度 >= 24 時只保留 4 個有效位元。
+    BM25 分數因此與 Lucene 一致，排序差異只剩 analyzer 的差別。
+    """
+    lengths = lengths.astype(np.int64)
+    excess = np.maximum(lengths - _EXACT_NORM_LENGTHS, 0)
+    bits = np.frexp(excess.astype(np.float64))[1]
+    shift = np.maximum(bits - 4, 0)
+    quantized = _EXACT_NORM_LENGTHS + ((excess >> shift) << shift)
+    return np.where(lengths < _EXACT_NORM_LENGTHS, lengths, quantized)
+
+
+def _build_part(
+    vocab: "np.ndarray",
+    rows: "np.ndarray",
+    cols: "np.ndarray",
+    tf: "np.ndarray",
+    chunk_ids: "np.ndarray",
+    doc_ids: "np.ndarray",
+    doc_ptr: "np.ndarray",
+    chunk_len: "np.ndarray",
+    indexed_at: "np.ndarray"
+) -> Dict[str, "np.ndarray"]:
+    """
+    由 COO 形式的 postings 建立 part 的陣列（CSC：依 term 分組，同一 term 內依 chunk 排序）。
+    沒有任何 posting 的 term 會從字典移除。
+    """
+    counts = np.bincount(cols, minlength=len(vocab))
+    used = counts > 0
+    if not used.all():
+        cols = (np.cumsum(used) - 1)[cols]
+        vocab, counts = vocab[used], counts[used]
+    order = np.lexsort((rows, cols))
+    chunk_doc = np.repeat(np.arange(len(doc_ids)), np.diff(doc_ptr))
+    return {
+        "vocab": vocab,
+        "indptr": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        "rows": rows[order].astype(np.int32),
+        "tf": tf[order].astype(np.float32),
+        "chunk_ids": chunk_ids,
+        "norm_len": _lucene_doc_length(chunk_len).astype(np.float32),
+        "doc_ids": doc_ids,
+        "doc_ptr": doc_ptr.astype(np.int64),
+        # 每份文件的統計值：N（有 term 的 chunk 數）與總 term 數，刪除文件時不必掃描 chunk
+        "doc_nonempty": np.bincount(chunk_doc, weights=chunk_len > 0, minlength=len(doc_ids)).astype(np.int64),
+        "doc_terms": np.bincount(chunk_doc, weights=chunk_len, minlength=len(doc_ids)).astype(np.int64),
+        "indexed_at": indexed_at.astype(np.float64),
+    }
+
+
+class _Part:
+    """一個 part 目錄的唯讀檢視（陣列以 mmap 載入，開啟只需數毫秒）"""
+
+    def __init__(self, path: str):
+        self.name = os.path.basename(path)
+
+        def load(name: str) -> "np.ndarray":
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        self.vocab = load("vocab")              # 排序過的 term
+        self.indptr = load("indptr")            # CSC：第 t 個 term 的 postings 為 [indptr[t], indptr[t + 1])
+        self.rows = load("rows")                # postings 的 chunk 編號（part 內）
+        self.tf = load("tf")                    # postings 的 term frequency
+        self.chunk_ids = load("chunk_ids")      # chunk 編號 -> "doc_id#chunk_index"
+        self.norm_len = load("norm_len")        # chunk 長度（Lucene norm 編碼後）
+        self.doc_ids = load("doc_ids")          # part 內的文件（依寫入順序）
+        self.doc_ptr = load("doc_ptr")          # 第 i 份文件的 chunks 為 [doc_ptr[i], doc_ptr[i + 1])
+        self.doc_nonempty = load("doc_nonempty")
+        self.doc_terms = load("doc_terms")
+        self.indexed_at = load("indexed_at")    # 文件寫入索引的時間（sync 用來判斷 JSONL 是否較新）
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_ids)
+
+    def postings(self, terms: List[str]) -> Dict[str, Tuple["np.ndarray", "np.ndarray"]]:
+        """查詢 term -> (chunk 編號, tf)；字典中沒有的 term 略過"""
+        if not terms or not len(self.vocab):
+            return {}
+        query_terms = np.array(terms)
+        positions = np.searchsorted(self.vocab, query_terms)
+        found = {}
+        for term, pos in zip(terms, positions):
+            if pos < len(self.vocab) and self.vocab[pos] == term:
+                start, end = self.indptr[pos], self.indptr[pos + 1]
+                found[term] = (self.rows[start:end], self.tf[start:end])
+        return found
+
+    def doc_mask(self, doc_ids) -> "np.ndarray":
+        """part 內每份文件是否屬於 doc_ids"""
+        if not doc_ids or not len(self.doc_ids):
+            return np.zeros(len(self.doc_ids), dtype=bool)
+        return np.isin(self.doc_ids, np.array(sorted(doc_ids)))
+
+    def chunk_mask(self, doc_mask: "np.ndarray") -> "np.ndarray":
+        """文件遮罩展開成 chunk 遮罩（同一文件的 chunks 在 part 中連續存放）"""
+        return np.repeat(doc_mask, np.diff(self.doc_ptr))
+
+
+class _Snapshot:
+    """一個 manifest 的檢視：part 列表、各 part 仍有效的 chunk，以及整個索引的 BM25 統計值"""
+
+    def __init__(self, name: str, parts: List[_Part], deleted: List[Set[str]]):
+        self.name = name
+        self.parts = parts
+        self.live: List[Optional[np.ndarray]] = []   # 各 part 的有效 chunk 遮罩；沒有刪除時為 None
+        field_docs = 0
+        total_terms = 0
+        for part, part_deleted in zip(parts, deleted):
+            live_docs = ~part.doc_mask(part_deleted)
+            self.live.append(None if live_docs.all() else part.chunk_mask(live_docs))
+            field_docs += int(part.doc_nonempty[live_docs].sum())
+            total_terms += int(part.doc_terms[live_docs].sum())
+        # N 與 avgdl 只計入至少有一個 term 的 chunk（Lucene 的 docCount）
+        self.field_docs = max(field_docs, 1)
+        self.avgdl = max(total_terms / self.field_docs, 1e-9)
+
+
+class BM25Engine:
+    """
+    不需要 Java 的 BM25 檢索引擎（NumPy 向量化計分）。
+
+    - 上傳時把文件的 chunks 分詞成一個新的 part（term-frequency CSC 矩陣），耗時只與新文件大小有關
+    - 大小相近的 part 依序合併（對數合併），part 數維持在 O(log N)，每個 posting 只會被重寫 O(log N) 次
+    - 刪除只把 doc_id 記在 manifest 中該 part 的 deleted 列表，檢索時遮罩掉；空間由 compact() 回收
+    - 查詢時對每個 part 只取查詢 term 的 postings，以整個索引的 N、df、avgdl 計算 BM25，
+      再以 doc_id 遮罩過濾、argpartition 取 top-k
+
+    分數公式與 Lucene BM25Similarity 相同：idf * tf / (tf + k1 * (1 - b + b * dl / avgdl))。
+    寫入（add / delete / sync / compact）由呼叫端序列化；檢索可在多個 thread 同時進行。
+    切換 manifest 後，上一個 manifest 的檔案保留到下一次切換，正在載入舊 manifest 的檢索不會讀不到檔案。
+    """
+
+    def __init__(self, root: str = BM25_INDEX_DIR, k1: float = BM25_K1, b: float = BM25_B):
+        self.root = root
+        self.current_path = os.path.join(root, "CURRENT")
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._snapshot: Optional[_Snapshot] = None
+        # 已載入的 part（寫入端與檢索端都會增刪，一律在 _parts_lock 內存取；
+        # _current_snapshot 持有 _lock 時也會呼叫 _part，所以使用另一個 lock）
+        self._parts: Dict[str, _Part] = {}
+        self._parts_lock = threading.Lock()
+
+    # ----------------------------------------------------------
+    # manifest 與 part
+    # ----------------------------------------------------------
+    def _current_name(self) -> Optional[str]:
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as fh:
+                return fh.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _read_manifest(self, name: Optional[str]) -> List[Dict]:
+        """讀取 manifest 的 part 列表；沒有索引（或舊版格式）時回傳空列表"""
+        if name is None or not name.startswith("manifest-"):
+            return []
+        with open(os.path.join(self.root, name), "r", encoding="utf-8") as fh:
+            return json.load(fh)["parts"]
+
+    def _part(self, name: str) -> _Part:
+        with self._parts_lock:
+            part = self._parts.get(name)
+        if part is None:
+            # mmap 載入在 lock 外進行；兩個 thread 同時載入時沿用先放進去的那一個
+            part = _Part(os.path.join(self.root, name))
+            with self._parts_lock:
+                part = self._parts.setdefault(name, part)
+        return part
+
+    def _write_part(self, arrays: Dict[str, "np.ndarray"]) -> Dict:
+        name = f"part-{uuid.uuid4().hex[:12]}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path)
+        for key, value in arrays.items():
+            np.save(os.path.join(path, f"{key}.npy"), value)
+        return {
+            "name": name,
+            "docs": len(arrays["doc_ids"]),
+            "postings": len(arrays["rows"]),
+            "deleted": [],
+        }
+
+    def _commit(self, parts: List[Dict]) -> None:
+        """
+        寫出新的 manifest 並切換 CURRENT；所有文件都刪除時清除索引。
+
+        只移除新舊兩個 manifest 都沒有用到的檔案：剛讀到舊 CURRENT 的檢索仍可載入舊 manifest。
+        """
+        parts = [info for info in parts if len(info["deleted"]) < info["docs"]]
+        if not parts:
+            self.clear()
+            return
+        previous = self._current_name()
+        name = f"manifest-{uuid.uuid4().hex[:12]}.json"
+        with open(os.path.join(self.root, name), "w", encoding="utf-8") as fh:
+            json.dump({"parts": parts}, fh)
+
+        # 以「寫入暫存檔 + os.replace」切換，檢索端不會看到寫到一半的索引
+        tmp_path = f"{self.current_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            fh.write(name)
+        os.replace(tmp_path, self.current_path)
+
+        keep = {name}
+        keep.update(info["name"] for info in parts)
+        if previous is not None and previous.startswith("manifest-"):
+            keep.add(previous)
+            try:
+                keep.update(info["name"] for info in self._read_manifest(previous))
+            except (OSError, ValueError):
+                pass
+        self._remove_stale(keep)
+
+    def _remove_stale(self, keep: Set[str]) -> None:
+        """移除不在 keep 中的 part / manifest 與舊版格式的檔案（仍被 mmap 使用的檔案在 POSIX 上會等到關閉時才釋放）"""
+        for name in os.listdir(self.root):
+            if name in keep or not name.startswith(("part-", "manifest-", "merged-", "segments")):
+                continue
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+            with self._parts_lock:
+                self._parts.pop(name, None)
+
+    def _live_documents(self, parts: List[Dict]) -> Dict[str, Tuple[int, float]]:
+        """有效文件 -> (所在 part 的位置, 寫入索引的時間)"""
+        docs = {}
+        for i, info in enumerate(parts):
+            part = self._part(info["name"])
+            deleted = set(info["deleted"])
+            for doc_id, indexed_at in zip(part.doc_ids.tolist(), part.indexed_at.tolist()):
+                if doc_id not in deleted:
+                    docs[doc_id] = (i, indexed_at)
+        return docs
+
+    def _mark_deleted(self, parts: List[Dict], doc_ids: Set[str]) -> List[Dict]:
+        """把 doc_ids 記在所在 part 的 deleted 列表（回傳新的 part 列表，不修改傳入的 manifest）"""
+        live = self._live_documents(parts)
+        parts = [dict(info) for info in parts]
+        for doc_id in doc_ids:
+            if doc_id in live:
+                info = parts[live[doc_id][0]]
+                info["deleted"] = sorted(set(info["deleted"]) | {doc_id})
+        return parts
+
+    # ----------------------------------------------------------
+    # 寫入
+    # ----------------------------------------------------------
+    def _analyze_documents(self, documents: List[Tuple[str, str]]) -> Dict[str, "np.ndarray"]:
+        """把多份文件的 JSONL 分詞成一個 part 的陣列"""
+        term_ids: Dict[str, int] = {}
+        chunk_ids: List[str] = []
+        doc_ptr = [0]
+        rows: List[int] = []
+        cols: List[int] = []
+        tf: List[int] = []
+        chunk_len: List[int] = []
+        indexed_at: List[float] = []
+        for doc_id, jsonl_path in documents:
+            # 讀取前記錄時間：之後才修改的 JSONL 在 sync 時會被視為過期
+            indexed_at.append(time.time())
+            with open(jsonl_path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    if not line.strip():
+                        continue
+                    rec = json.loads(line)
+                    row = len(chunk_ids)
+                    chunk_ids.append(rec["id"])
+                    counts = Counter(analyze(rec.get("contents", "") or ""))
+                    for term, count in counts.items():
+                        rows.append(row)
+                        cols.append(term_ids.setdefault(term, len(term_ids)))
+                        tf.append(count)
+                    chunk_len.append(sum(counts.values()))
+            doc_ptr.append(len(chunk_ids))
+
+        # 字典依字串排序，檢索時可用 searchsorted 查找
+        vocab = np.array(list(term_ids), dtype=str)
+        order = np.argsort(vocab)
+        remap = np.empty(len(vocab), dtype=np.int64)
+        remap[order] = np.arange(len(vocab))
+        return _build_part(
+            vocab[order],
+            np.array(rows, dtype=np.int64),
+            remap[np.array(cols, dtype=np.int64)],
+            np.array(tf, dtype=np.float32),
+            np.array(chunk_ids, dtype=str),
+            np.array([doc_id for doc_id, _ in documents], dtype=str),
+            np.array(doc_ptr, dtype=np.int64),
+            np.array(chunk_len, dtype=np.int64),
+            np.array(indexed_at, dtype=np.float64)
+        )
+
+    def _merge_parts(self, infos: List[Dict]) -> Dict[str, "np.ndarray"]:
+        """把多個 part 合併成一個（依原順序串接），同時丟掉已刪除文件的 chunks"""
+        parts = [self._part(info["name"]) for info in infos]
+        vocab, inverse = np.unique(np.concatenate([part.vocab for part in parts]), return_inverse=True)
+        inverse = inverse.ravel()
+        rows, cols, tfs, chunk_ids, doc_ids, doc_sizes, chunk_len, indexed_at = [], [], [], [], [], [], [], []
+        row_offset = 0
+        term_offset = 0
+        for part, info in zip(parts, infos):
+            live_docs = ~part.doc_mask(info["deleted"])
+            live_chunks = part.chunk_mask(live_docs)
+            new_row = np.cumsum(live_chunks) - 1 + row_offset
+            part_rows = np.asarray(part.rows)
+            part_cols = np.repeat(np.arange(len(part.vocab)), np.diff(part.indptr))
+            keep = live_chunks[part_rows]
+            rows.append(new_row[part_rows[keep]])
+            cols.append(inverse[term_offset + part_cols[keep]])
+            tfs.append(np.asarray(part.tf)[keep])
+            chunk_ids.append(np.asarray(part.chunk_ids)[live_chunks])
+            doc_ids.append(np.asarray(part.doc_ids)[live_docs])
+            doc_sizes.append(np.diff(part.doc_ptr)[live_docs])
+            # norm_len 已量化，無法還原 chunk 長度，因此從 postings 重新加總
+            part_len = np.bincount(part_rows, weights=part.tf, minlength=part.num_chunks).astype(np.int64)
+            chunk_len.append(part_len[live_chunks])
+            indexed_at.append(np.asarray(part.indexed_at)[live_docs])
+            row_offset += int(live_chunks.sum())
+            term_offset += len(part.vocab)
+        return _build_part(
+            vocab,
+            np.concatenate(rows),
+            np.concatenate(cols),
+            np.concatenate(tfs),
+            np.concatenate(chunk_ids),
+            np.concatenate(doc_ids),
+            np.concatenate([[0], np.cumsum(np.concatenate(doc_sizes))]).astype(np.int64),
+            np.concatenate(chunk_len),
+            np.concatenate(indexed_at)
+        )
+
+    def _add_part(self, parts: List[Dict], documents: List[Tuple[str, str]]) -> List[Dict]:
+        """
+        新文件寫成一個 part 附加在最後，再依對數合併規則合併：
+        最後一個 part 的 postings 不少於前一個時兩者合併（與二進位計數器的進位相同）。
+        """
+        parts = parts + [self._write_part(self._analyze_documents(documents))]
+        while len(parts) > 1 and parts[-2]["postings"] <= parts[-1]["postings"]:
+            parts[-2:] = [self._write_part(self._merge_parts(parts[-2:]))]
+        return parts
+
+    def add_document(self, doc_id: str, jsonl_path: str) -> int:
+        """把文件寫成新的 part（文件已在索引中時取代舊內容），回傳 chunk 數"""
+        os.makedirs(self.root, exist_ok=True)
+        parts = self._mark_deleted(self._read_manifest(self._current_name()), {doc_id})
+        parts = self._add_part(parts, [(doc_id, jsonl_path)])
+        self._commit(parts)
+        count = self._part(parts[-1]["name"]).chunk_mask(self._part(parts[-1]["name"]).doc_mask([doc_id])).sum()
+        print(f"[INFO] BM25 engine added {doc_id} ({count} chunks, {len(parts)} parts)")
+        return int(count)
+
+    def delete_document(self, doc_id: str) -> bool:
+        """把文件標記為已刪除；文件不在索引中時回傳 False"""
+        parts = self._read_manifest(self._current_name())
+        if doc_id not in self._live_documents(parts):
+            return False
+        self._commit(self._mark_deleted(parts, {doc_id}))
+        return True
+
+    def compact(self) -> bool:
+        """把所有 part 合併成一個並丟掉已刪除的文件；沒有需要回收的空間時回傳 False"""
+        parts = self._read_manifest(self._current_name())
+        deleted = sum(len(info["deleted"]) for info in parts)
+        if not deleted and len(parts) <= 1:
+            return False
+        self._commit([self._write_part(self._merge_parts(parts))])
+        print(f"[INFO] BM25 engine compacted {len(parts)} parts ({deleted} deleted documents)")
+        return True
+
+    def sync(self, jsonl_dir: str) -> bool:
+        """
+        讓索引與 JSONL 目錄一致：補建缺少或過期（JSONL 較新）的文件、刪除已不存在的文件。
+
+        Returns:
+            是否有變動
+        """
+        jsonl_files = {
+            fname[:-len(".json")]: os.path.join(jsonl_dir, fname)
+            for fname in (os.listdir(jsonl_dir) if os.path.isdir(jsonl_dir) else [])
+            if fname.endswith(".json")
+        }
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            parts = self._read_manifest(self._current_name())
+            live = self._live_documents(parts)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] BM25 engine index is unreadable, rebuilding: {e}")
+            parts, live = [], {}
+        stale = {
+            doc_id for doc_id, (_, indexed_at) in live.items()
+            if doc_id not in jsonl_files or indexed_at < os.path.getmtime(jsonl_files[doc_id])
+        }
+        missing = sorted(doc_id for doc_id in jsonl_files if doc_id not in live or doc_id in stale)
+        if not stale and not missing:
+            # 舊版格式（segments/、merged-*）沒有 manifest：有 JSONL 時上面會全部重建
+            if not jsonl_files and os.listdir(self.root):
+                self.clear()
+                return True
+            return False
+        parts = self._mark_deleted(parts, stale)
+        if missing:
+            parts = self._add_part(parts, [(doc_id, jsonl_files[doc_id]) for doc_id in missing])
+        self._commit(parts)
+        print(f"[INFO] BM25 engine synced: {len(missing)} indexed, {len(stale - set(missing))} removed")
+        return True
+
+    def clear(self) -> None:
+        """刪除整個引擎索引"""
+        with self._parts_lock:
+            self._parts.clear()
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+            print("[INFO] Removed BM25 engine index")
+
+    # ----------------------------------------------------------
+    # 檢索
+    # ----------------------------------------------------------
+    def has_index(self) -> bool:
+        name = self._current_name()
+        return name is not None and name.startswith("manifest-")
+
+    def _current_snapshot(self) -> Optional[_Snapshot]:
+        """
+        CURRENT 改變時重新載入（只 mmap .npy，不讀入整個矩陣；沒有變動的 part 沿用）。
+        載入途中 manifest 又被切換時重新讀取 CURRENT。
+        """
+        error = None
+        for _ in range(3):
+            name = self._current_name()
+            if name is None or not name.startswith("manifest-"):
+                return None
+            with self._lock:
+                if self._snapshot is not None and self._snapshot.name == name:
+                    return self._snapshot
+                try:
+                    infos = self._read_manifest(name)
+                    parts = [self._part(info["name"]) for info in infos]
+                    self._snapshot = _Snapshot(name, parts, [set(info["deleted"]) for info in infos])
+                    return self._snapshot
+                except (OSError, ValueError) as e:
+                    error = e
+        print(f"[WARNING] Failed to load BM25 engine index: {error}")
+        return None
+
+    def search(self, query: str, selected_doc_ids: Optional[List[str]] = None, k: int = 10) -> List[Tuple[str, float]]:
+        """
+        BM25 檢索。
+
+        Args:
+            query: 查詢文字（與文件使用相同的 analyzer）
+            selected_doc_ids: 只在這些文件中檢索；None 表示所有文件
+            k: 回傳筆數
+
+        Returns:
+            [(chunk_id, score), ...]，依分數遞減（同分時依索引順序）
+        """
+        snapshot = self._current_snapshot()
+        if snapshot is None or k <= 0:
+            return []
+        query_tf = Counter(analyze(query))
+        if not query_tf:
+            return []
+        terms = list(query_tf)
+
+        # 第一輪：取出各 part 中查詢 term 的有效 postings，並累計整個索引的 df
+        df = Counter()
+        hits = []
+        for part, live in zip(snapshot.parts, snapshot.live):
+            postings = part.postings(terms)
+            if live is not None:
+                postings = {term: (rows[live[rows]], tf[live[rows]]) for term, (rows, tf) in postings.items()}
+            for term, (rows, _) in postings.items():
+                df[term] += len(rows)
+            hits.append(postings)
+
+        # 第二輪：BM25 計分，每個 part 先取 top-k，再合併所有 part 的候選
+        idf = {
+            term: float(np.log1p((snapshot.field_docs - df[term] + 0.5) / (df[term] + 0.5)))
+            for term in df
+        }
+        selected = set(selected_doc_ids) if selected_doc_ids is not None else None
+        cand_scores, cand_parts, cand_rows = [], [], []
+        for part_index, (part, postings) in enumerate(zip(snapshot.parts, hits)):
+            if not postings:
+                continue
+            scores = np.zeros(part.num_chunks, dtype=np.float32)
+            for term, (rows, tf) in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * part.norm_len[rows] / snapshot.avgdl)
+                # 同一個 term 的 postings 中每個 chunk 只出現一次，可直接以索引累加
+                scores[rows] += (query_tf[term] * idf[term] * tf / (tf + norm)).astype(np.float32)
+            if selected is not None:
+                scores[~part.chunk_mask(part.doc_mask(selected))] = 0
+            candidates = np.flatnonzero(scores > 0)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            cand_scores.append(scores[candidates])
+            cand_parts.append(np.full(len(candidates), part_index))
+            cand_rows.append(candidates)
+        if not cand_scores:
+            return []
+
+        scores = np.concatenate(cand_scores)
+        part_ids = np.concatenate(cand_parts)
+        rows = np.concatenate(cand_rows)
+        order = np.lexsort((rows, part_ids, -scores))[:k]
+        return [
+            (str(snapshot.parts[part_ids[i]].chunk_ids[rows[i]]), float(scores[i]))
+            for i in order
+        ]
+
+
+bm25_engine = BM25Engine()
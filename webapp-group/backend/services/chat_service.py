@@ -1,9 +1,11 @@
+import asyncio
+import contextvars
+import time
 import uuid
 import os
-import json
 import re
-from typing import Dict, List, Optional
-from services.gemini_client import call_gemini
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from services.gemini_client import call_gemini, stream_gemini
 from services.ptkb_service import (
     extract_new_ptkb,
     get_relevant_ptkbs,
@@ -19,15 +21,25 @@ from config.prompts import (
     # Passage Summarization
     SYSTEM_PROMPT_SUMMARIZE,
     format_summarize_prompt,
+    SYSTEM_PROMPT_SUMMARIZE_GENERIC,
+    format_generic_summarize_prompt,
     parse_summary_response
 )
+from concurrent.futures import ThreadPoolExecutor
+from services.searcher_pool import SearcherPool, INDEX_PATH, analyzer_for_language, read_index_generation, DEFAULT_ANALYZER
+from services.lucene_query import build_filtered_query
+from services.cache import TTLCache, make_cache_key
+from services.chunk_store import chunk_store
+from services.bm25_engine import bm25_engine, search_backend, NUMPY_BACKEND, SEARCH_BACKEND
+from services.dense_index import get_dense_index
+from services.metrics import collect_timings, record_stage, track_stage
 # [可選] 匯入 Pyserini - 如果未安裝或配置不正確，將使用備用方案
 try:
     from pyserini.search.lucene import LuceneSearcher
     PYSERINI_AVAILABLE = True
 except (ImportError, Exception) as e:
     print(f"[WARNING] Pyserini not available: {e}")
-    print("[INFO] RAG search functionality will be disabled. Install Java and configure pyserini to enable it.")
+    print("[INFO] RAG search will use the in-process NumPy BM25 engine unless SEARCH_BACKEND=lucene.")
     PYSERINI_AVAILABLE = False
     LuceneSearcher = None
 
@@ -36,10 +48,56 @@ except (ImportError, Exception) as e:
 # ==========================================================
 RESPONSE_LIMIT = 1000      # Maximum words in response (increased from 250 to allow longer responses)
 NUM_PASSAGES = 13          # BM25 檢索後使用的 passage 總數
-NUM_DIRECT_PASSAGES = 4    # 直接注入 prompt 的 passage 數量
-SUMMARY_CHUNK_SIZE = 5     # 剩餘 passage 分塊摘要的大小
+SUMMARY_CHUNK_SIZE = 5     # 放不進 token 預算的 passage 分塊摘要的大小
+SUMMARY_MAX_TOKENS = 350   # 每段摘要的輸出上限（也是打包時為每段摘要預留的 token）
 SCORE_THRESHOLD = 0        # 分數門檻（0 = 不過濾）
 
+# ==========================================================
+# Context token 預算：RAG prompt（passages + 問題 + 指示文字）的估計 token 上限
+#   依排名放入 passages，只有放不下的才送去摘要
+# ==========================================================
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+# 排名最前的幾個 passage 一定直接放入（預算很小時也不會全部變成摘要）
+MIN_DIRECT_PASSAGES = int(os.getenv("MIN_DIRECT_PASSAGES", "3"))
+PROMPT_OVERHEAD_TOKENS = 150   # prompt 模板與指示文字
+PASSAGE_OVERHEAD_TOKENS = 12   # 每個 passage 的 "[Source: filename]: " 標頭
+# CJK 字元（中文、日文假名、韓文）的 token 密度遠高於英文，估計時分開計算
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7a3]")
+
+# ==========================================================
+# LLM4CS 改寫快取（key = 對話上下文 + 問題）
+# ==========================================================
+REWRITE_CACHE_ENABLED = os.getenv("REWRITE_CACHE_ENABLED", "true").lower() == "true"
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "512"))
+REWRITE_CACHE_TTL = float(os.getenv("REWRITE_CACHE_TTL", "3600"))  # 秒
+# 開啟後改寫使用 temperature 0，讓快取內容可重現
+REWRITE_DETERMINISTIC = os.getenv("REWRITE_DETERMINISTIC", "false").lower() == "true"
+
+rewrite_cache = TTLCache("rewrite", maxsize=REWRITE_CACHE_SIZE, ttl=REWRITE_CACHE_TTL)
+
+# ==========================================================
+# Passage 摘要快取
+#   query  : key = 有序 chunk ids + 使用者問題（預設）
+#   chunks : key = 有序 chunk ids，摘要改用與問題無關的 prompt，可跨問題重用
+#   off    : 不快取
+# ==========================================================
+SUMMARY_CACHE_MODE = os.getenv("SUMMARY_CACHE_MODE", "query").lower()
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "3600"))  # 秒
+
+summary_cache = TTLCache("summary", maxsize=SUMMARY_CACHE_SIZE, ttl=SUMMARY_CACHE_TTL)
+
+# ==========================================================
+# 檢索結果快取（key = 正規化查詢 + analyzer + 勾選文件 + 索引世代）
+#   上傳 / 刪除會遞增索引世代，舊世代的結果不會再命中，並在偵測到世代改變時清空
+# ==========================================================
+RETRIEVAL_CACHE_ENABLED = os.getenv("RETRIEVAL_CACHE_ENABLED", "true").lower() == "true"
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))  # 秒
+
+retrieval_cache = TTLCache("retrieval", maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+_retrieval_cache_generation: Optional[int] = None
+
 # ==========================================================
 # Query Normalization (查詢正規化)
 # ==========================================================
@@ -101,9 +159,23 @@ def normalize_search_query(query: str) -> str:
     
     return normalized_query if normalized_query else query
 
-# 設定索引路徑
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-INDEX_PATH = os.path.join(BASE_DIR, "data", "indexes", "lucene-index")
+def _open_searcher(index_path: str, analyzer: str):
+    """開啟子索引，並設定與建立該子索引時相同的 analyzer"""
+    with track_stage("chat", "searcher_load"):
+        searcher = LuceneSearcher(index_path)
+        if analyzer != DEFAULT_ANALYZER:
+            searcher.set_language(analyzer)
+    return searcher
+
+# 長駐 Searcher 池：只在索引世代改變時重新開啟索引（見 services/searcher_pool.py）
+searcher_pool = SearcherPool(INDEX_PATH, _open_searcher) if PYSERINI_AVAILABLE else None
+
+# 各子索引 shard / 查詢變體的檢索同時在 worker thread 上執行（預設隨 CPU 核心數增加）
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", str(max(4, os.cpu_count() or 1))))
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="lucene-search")
+RRF_K = 60                 # 合併多個子索引結果時的 Reciprocal Rank Fusion 常數
+DENSE_LABEL = "dense"      # dense 檢索結果在 RRF 中的名稱（DENSE_ENCODER 啟用時與 BM25 結果一起融合）
+
 LANGUAGE_REGEX = {
     "zh": re.compile(r"[\u4e00-\u9fff]"),
     "ja": re.compile(r"[\u3040-\u30ff]"),
@@ -117,11 +189,18 @@ LANGUAGE_REGEX = {
     "en": re.compile(r"[a-zA-Z]"),
 }
 
-def _detect_query_language(query: str) -> str:
+def _query_analyzers(query: str, available: List[str]) -> List[str]:
+    """
+    依查詢中出現的文字決定要查詢哪些子索引。
+    查詢語言在語料中沒有對應子索引時（例如語料只有中文、查詢是英文），查詢全部子索引。
+    """
+    analyzers = []
     for language, pattern in LANGUAGE_REGEX.items():
         if pattern.search(query or ""):
-            return language
-    return "en"
+            analyzer = analyzer_for_language(language)
+            if analyzer in available and analyzer not in analyzers:
+                analyzers.append(analyzer)
+    return analyzers or list(available)
 
 # ==========================================================
 # [LLM4CS] Query Rewriting（來自 reference/llm4cs/chat_promptor.py）
@@ -129,6 +208,7 @@ def _detect_query_language(query: str) -> str:
 async def llm4cs_rewrite_query(context: str, current_question: str) -> str:
     """
     使用 LLM4CS 風格的 prompt 將對話查詢改寫為獨立的檢索查詢。
+    相同 (context, current_question) 的改寫結果會存入 rewrite_cache，命中時不呼叫 Gemini。
     
     Args:
         context: 對話歷史上下文
@@ -137,30 +217,46 @@ async def llm4cs_rewrite_query(context: str, current_question: str) -> str:
     Returns:
         改寫後的查詢字串
     """
+    cache_key = make_cache_key(context, current_question)
+    if REWRITE_CACHE_ENABLED:
+        hit, cached_query = rewrite_cache.get(cache_key)
+        if hit:
+            print(f"[INFO] LLM4CS Rewrite (cached): '{current_question}' -> '{cached_query}'")
+            return cached_query
+    
     prompt = format_llm4cs_rewrite_prompt(context, current_question)
+    # LLM4CS 使用較高 temperature；快取開啟且要求可重現時改用 0
+    temperature = 0.0 if (REWRITE_CACHE_ENABLED and REWRITE_DETERMINISTIC) else 0.7
     
     try:
         response = await call_gemini(
             system_prompt=SYSTEM_PROMPT_LLM4CS_REWRITE,
             user_prompt=prompt,
-            temperature=0.7,  # LLM4CS 使用較高 temperature
+            temperature=temperature,
             max_tokens=256
         )
         
         # 解析回應
         rewritten_query = parse_llm4cs_rewrite_response(response, original_query=current_question)
         print(f"[INFO] LLM4CS Rewrite: '{current_question}' -> '{rewritten_query}'")
+        if REWRITE_CACHE_ENABLED:
+            rewrite_cache.set(cache_key, rewritten_query)
         return rewritten_query
         
     except Exception as e:
         print(f"[ERROR] LLM4CS rewrite failed: {e}")
-        return current_question  # 失敗時使用原始查詢
+        return current_question  # 失敗時使用原始查詢（不寫入快取）
 
 
 # ==========================================================
 # [Passage Summarization] 摘要分塊邏輯（來自 reference/put_response.py）
 # ==========================================================
-async def summarize_passages(passages: List[str], context: str, utterance: str) -> str:
+async def summarize_passages(
+    passages: List[str],
+    context: str,
+    utterance: str,
+    chunk_ids: Optional[List[str]] = None
+) -> str:
     """
     將多個 passages 摘要為一段文字。
     
@@ -168,6 +264,7 @@ async def summarize_passages(passages: List[str], context: str, utterance: str)
         passages: 待摘要的 passage 列表
         context: 對話歷史上下文
         utterance: 當前使用者問題
+        chunk_ids: passages 對應的 chunk id（doc_id#idx）；提供時依 SUMMARY_CACHE_MODE 使用摘要快取
         
     Returns:
         摘要後的文字
@@ -175,62 +272,119 @@ async def summarize_passages(passages: List[str], context: str, utterance: str)
     if not passages:
         return ""
     
+    cache_key = None
+    generic = SUMMARY_CACHE_MODE == "chunks"
+    if SUMMARY_CACHE_MODE in ("query", "chunks") and chunk_ids and all(chunk_ids):
+        cache_key = make_cache_key(chunk_ids) if generic else make_cache_key(chunk_ids, utterance)
+        hit, cached_summary = summary_cache.get(cache_key)
+        if hit:
+            print(f"[INFO] Summary cache hit for {len(passages)} passages")
+            return cached_summary
+    else:
+        generic = False
+    
     # 格式化 passages
     formatted_passages = "\n\n".join(
         f"Passage {i+1}:\n{text}" for i, text in enumerate(passages)
     )
     
-    prompt = format_summarize_prompt(context, utterance, formatted_passages)
+    if generic:
+        system_prompt = SYSTEM_PROMPT_SUMMARIZE_GENERIC
+        prompt = format_generic_summarize_prompt(formatted_passages)
+    else:
+        system_prompt = SYSTEM_PROMPT_SUMMARIZE
+        prompt = format_summarize_prompt(context, utterance, formatted_passages)
     
     try:
         response = await call_gemini(
-            system_prompt=SYSTEM_PROMPT_SUMMARIZE,
+            system_prompt=system_prompt,
             user_prompt=prompt,
             temperature=0.1,
-            max_tokens=350
+            max_tokens=SUMMARY_MAX_TOKENS
         )
         
         summary = parse_summary_response(response)
         print(f"[INFO] Summarized {len(passages)} passages into {len(summary.split())} words")
+        if cache_key is not None and summary:
+            summary_cache.set(cache_key, summary)
         return summary
         
     except Exception as e:
         print(f"[ERROR] Passage summarization failed: {e}")
-        # 失敗時返回原始 passages 的連接
+        # 失敗時返回原始 passages 的連接（不寫入快取）
         return " ".join(passages[:2])  # 只取前兩個作為 fallback
 
 
+def estimate_tokens(text: str) -> int:
+    """
+    估計文字的 token 數（不呼叫 API）：CJK 字元每字約 1 token，其餘約每 4 個字元 1 token。
+    估計值偏保守，只用於 prompt 打包。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _summary_reserve(count: int) -> int:
+    """count 個 passage 分塊摘要後最多佔用的 token"""
+    return -(-count // SUMMARY_CHUNK_SIZE) * SUMMARY_MAX_TOKENS
+
+
+def pack_passages(
+    passages: List[Dict],
+    budget: int,
+    min_direct: int = MIN_DIRECT_PASSAGES
+) -> Tuple[List[Dict], List[Dict]]:
+    """
+    依排名把 passages 放進 token 預算，其餘留給摘要。
+    
+    前 min_direct 個 passage 一定直接放入；之後放入第 i 個 passage 的條件：前 i 個 passage 的 token
+    加上剩餘 passage 摘要的預留量不超過 budget；遇到第一個放不下的就停止，之後的 passage 全部摘要（維持排名順序）。
+    
+    Args:
+        passages: 依排名排序的 passage 列表 [{"id": ..., "text": ..., "filename": ...}, ...]
+        budget: passages（含摘要）可使用的 token 數
+        min_direct: 不論預算一定直接放入的 passage 數
+        
+    Returns:
+        (direct, overflow)：直接注入 prompt 的 passages 與需要摘要的 passages
+    """
+    used = 0
+    for i, passage in enumerate(passages):
+        cost = estimate_tokens(passage.get("text", "")) + PASSAGE_OVERHEAD_TOKENS
+        if i >= min_direct and used + cost + _summary_reserve(len(passages) - i - 1) > budget:
+            return passages[:i], passages[i:]
+        used += cost
+    return passages, []
+
+
 async def process_passages_with_summary(
     passages: List[Dict], 
     context: str, 
-    utterance: str
-) -> List[str]:
+    utterance: str,
+    budget: int = CONTEXT_TOKEN_BUDGET
+) -> Tuple[List[Dict], List[str]]:
     """
-    處理 passages：前 NUM_DIRECT_PASSAGES 個直接使用，
-    剩餘的按 SUMMARY_CHUNK_SIZE 分塊摘要。
+    處理 passages：依排名放入 token 預算的直接使用，
+    放不下的按 SUMMARY_CHUNK_SIZE 分塊摘要（全部放得下時不呼叫摘要）。
     
     Args:
-        passages: 檢索到的 passage 列表 [{"text": ..., "filename": ...}, ...]
+        passages: 檢索到的 passage 列表 [{"id": ..., "text": ..., "filename": ...}, ...]
         context: 對話歷史上下文
         utterance: 當前使用者問題
+        budget: passages（含摘要）可使用的 token 數
         
     Returns:
-        處理後的 passage 文字列表
+        (直接使用的 passages, 摘要文字列表)
     """
     if not passages:
-        return []
-    
-    # 提取文字
-    passage_texts = [p.get("text", "") for p in passages]
-    
-    # 前 NUM_DIRECT_PASSAGES 個直接使用
-    direct_passages = passage_texts[:NUM_DIRECT_PASSAGES]
+        return [], []
     
-    # 剩餘的需要摘要
-    passages_to_summarize = passage_texts[NUM_DIRECT_PASSAGES:]
+    direct_passages, passages_to_summarize = pack_passages(passages, budget)
     
     if not passages_to_summarize:
-        return direct_passages
+        return direct_passages, []
     
     # 分塊摘要
     summaries = []
@@ -243,31 +397,295 @@ async def process_passages_with_summary(
         chunks.insert(0, passages_to_summarize[start_index:i])
         i = start_index
     
-    # 對每個 chunk 進行摘要
-    for chunk in chunks:
-        try:
-            summary = await summarize_passages(chunk, context, utterance)
-            if summary:
-                summaries.append(summary)
-        except Exception as e:
-            print(f"[WARNING] Chunk summarization failed: {e}")
+    # 各 chunk 的摘要互不相依，同時送出；結果依原順序組合
+    with track_stage("chat", "summarization"):
+        results = await asyncio.gather(
+            *(
+                summarize_passages(
+                    [p.get("text", "") for p in chunk],
+                    context,
+                    utterance,
+                    chunk_ids=[p.get("id") for p in chunk]
+                )
+                for chunk in chunks
+            ),
+            return_exceptions=True
+        )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"[WARNING] Chunk summarization failed: {result}")
             # 失敗時跳過此 chunk
+            continue
+        if result:
+            summaries.append(result)
     
-    # 組合：直接 passages + 摘要
-    return direct_passages + summaries
+    return direct_passages, summaries
+
+# ==========================================================
+# BM25 檢索（每個 analyzer 一個子索引）
+# ==========================================================
+def _search_subindex(analyzer: str, path: str, query_text: str, selected_doc_ids: List[str]) -> List[Tuple[str, float]]:
+    """在單一子索引 shard 上檢索，回傳 [(docid, score), ...]"""
+    with searcher_pool.acquire(analyzer, path) as searcher:
+        if not searcher:
+            return []
+        # doc_id 過濾直接下推到 Lucene 查詢，每筆命中都屬於勾選文件，所以只需取 NUM_PASSAGES 筆
+        hits = searcher.search(build_filtered_query(searcher, query_text, selected_doc_ids), k=NUM_PASSAGES)
+        return [(hit.docid, hit.score) for hit in hits]
+
+
+def _search_bm25_engine(analyzer: str, path: Optional[str], query_text: str, selected_doc_ids: List[str]) -> List[Tuple[str, float]]:
+    """在 NumPy BM25 引擎上檢索（與 _search_subindex 相同的介面；引擎只有一個索引）"""
+    return bm25_engine.search(query_text, selected_doc_ids, k=NUM_PASSAGES)
+
+
+def _search_dense(analyzer: str, path: Optional[str], query_text: str, selected_doc_ids: List[str]) -> List[Tuple[str, float]]:
+    """在勾選文件的 chunk 向量上檢索（cosine similarity）"""
+    with track_stage("chat", "dense_search"):
+        return get_dense_index().search(query_text, selected_doc_ids, k=NUM_PASSAGES)
+
+
+async def search_chunks(search_query: str, selected_doc_ids: List[str]) -> List[Dict]:
+    """
+    檢索勾選文件中的相關 chunks。
+    
+    每個 (子索引 shard, 查詢變體) 組合同時檢索；同一子索引各 shard 的結果依 BM25 分數
+    合併取前 NUM_PASSAGES 筆，不同子索引 / 查詢變體再以 Reciprocal Rank Fusion 合併排序，
+    查無結果時也只花一輪檢索時間，不必依序嘗試多個 analyzer。
+    使用 NumPy BM25 引擎時只有一個索引，每個查詢變體檢索一次。
+    啟用 dense 檢索（DENSE_ENCODER）時，向量檢索的結果也作為一個排名列表參與 RRF。
+    
+    Args:
+        search_query: 正規化後的查詢
+        selected_doc_ids: 使用者勾選的 doc_id 列表
+        
+    Returns:
+        [{"id": ..., "text": ..., "filename": ..., "score": ...}, ...]，最多 NUM_PASSAGES 筆
+    """
+    # Query variants (handle underscore mismatch like "16_flat_clustering" vs "16 flat clustering")
+    query_variants = [search_query]
+    if "_" in search_query:
+        query_variants.append(search_query.replace("_", " "))
+
+    if search_backend() == NUMPY_BACKEND:
+        analyzers = [NUMPY_BACKEND]
+        search_fn = _search_bm25_engine
+        tasks = [(NUMPY_BACKEND, None, qv) for qv in query_variants]
+    else:
+        available = searcher_pool.analyzers()
+        if not available:
+            return []
+        analyzers = _query_analyzers(search_query, available)
+        search_fn = _search_subindex
+        tasks = [
+            (analyzer, path, qv)
+            for analyzer in analyzers
+            for path in searcher_pool.shards(analyzer)
+            for qv in query_variants
+        ]
+    dense_index = get_dense_index()
+    if dense_index.enabled:
+        analyzers = analyzers + [DENSE_LABEL]
+        tasks.append((DENSE_LABEL, None, search_query))
+
+    # 相同的查詢 / analyzer / 勾選文件在同一個索引世代內結果相同，直接回傳快取
+    cache_key = None
+    generation = read_index_generation()
+    if RETRIEVAL_CACHE_ENABLED:
+        _sync_retrieval_cache(generation)
+        cache_key = make_cache_key(
+            search_query, analyzers, sorted(set(selected_doc_ids)), generation, NUM_PASSAGES,
+            dense_index.signature if dense_index.enabled else None
+        )
+        hit, cached_chunks = retrieval_cache.get(cache_key)
+        if hit:
+            print(f"[INFO] Retrieval cache hit for '{search_query}' ({len(cached_chunks)} chunks)")
+            return [dict(chunk) for chunk in cached_chunks]
+
+    loop = asyncio.get_running_loop()
+    with track_stage("chat", "search"):
+        # copy_context：讓 worker thread 中的 searcher_load 計時也記到目前請求
+        results = await asyncio.gather(
+            *(loop.run_in_executor(
+                _search_executor, contextvars.copy_context().run,
+                _search_dense if analyzer == DENSE_LABEL else search_fn, analyzer, path, qv, selected_doc_ids
+              ) for analyzer, path, qv in tasks),
+            return_exceptions=True
+        )
+
+    # 同一子索引的各 shard 使用相同 analyzer，BM25 分數可直接比較：依分數合併取 top-k
+    merged: Dict[Tuple[str, str], List[Tuple[str, float]]] = {}
+    for (analyzer, path, qv), hits in zip(tasks, results):
+        if isinstance(hits, Exception):
+            print(f"[WARNING] Search on sub-index '{analyzer}' ({path}) failed: {hits}")
+            continue
+        merged.setdefault((analyzer, qv), []).extend(hits)
+
+    # Reciprocal Rank Fusion：不同 analyzer 的 BM25 分數不可直接比較，改用名次合併
+    fused_scores: Dict[str, float] = {}
+    best_score: Dict[str, float] = {}   # docid -> 原始分數（BM25 或 dense cosine，取各列表中最高者）
+    for hits in merged.values():
+        hits = sorted(hits, key=lambda hit: hit[1], reverse=True)[:NUM_PASSAGES]
+        for rank, (docid, score) in enumerate(hits):
+            # SCORE_THRESHOLD 過濾（目前設為 0，即不過濾）
+            if score < SCORE_THRESHOLD:
+                continue
+            fused_scores[docid] = fused_scores.get(docid, 0.0) + 1.0 / (RRF_K + rank + 1)
+            if docid not in best_score or score > best_score[docid]:
+                best_score[docid] = score
+
+    ranked = sorted(fused_scores, key=fused_scores.get, reverse=True)[:NUM_PASSAGES]
+    print(f"[INFO] Searched sub-indexes {analyzers} with {len(query_variants)} query variant(s), hits: {len(ranked)}")
+    if not ranked:
+        return []
+
+    # 原文從 mmap chunk store 讀取，不經由 JVM 讀 raw JSON
+    with track_stage("chat", "doc_fetch"):
+        docs = chunk_store.get_many(ranked)
+
+    valid_chunks = []
+    for docid in ranked:
+        chunk = docs.get(docid)
+        if not chunk:
+            continue
+        valid_chunks.append({
+            "id": docid,  # doc_id#chunk_index
+            "text": chunk["text"],
+            "filename": chunk["filename"],
+            "score": best_score[docid]
+        })
+
+    # 檢索期間索引若已更新（世代改變），結果可能混合新舊索引，不寫入快取
+    if cache_key is not None and read_index_generation() == generation:
+        retrieval_cache.set(cache_key, [dict(chunk) for chunk in valid_chunks])
+    
+    return valid_chunks
+
+
+def _sync_retrieval_cache(generation: int) -> None:
+    """索引世代改變時清空檢索結果快取（舊世代的 key 不會再命中，只是提早釋放記憶體）"""
+    global _retrieval_cache_generation
+    if _retrieval_cache_generation != generation:
+        if _retrieval_cache_generation is not None:
+            retrieval_cache.clear()
+        _retrieval_cache_generation = generation
+
+# ==========================================================
+# RAG 檢索流程（LLM4CS 改寫 -> BM25 檢索 -> 摘要分塊）
+# ==========================================================
+async def retrieve_context(
+    context: str,
+    query: str,
+    selected_doc_ids: List[str],
+    reserved_tokens: int = 0
+) -> Tuple[str, List[Dict]]:
+    """
+    執行 RAG 文件搜尋，回傳要注入 prompt 的參考文字與來源列表。
+    參數：NUM_PASSAGES=13, CONTEXT_TOKEN_BUDGET, SUMMARY_CHUNK_SIZE=5
+    
+    Args:
+        context: 對話歷史上下文
+        query: 當前使用者問題
+        selected_doc_ids: 使用者勾選的 doc_id 列表
+        reserved_tokens: RAG prompt 中 passages 以外的部分（問題、指示文字）預估佔用的 token
+        
+    Returns:
+        (retrieved_docs_text, retrieved_sources)；沒有檢索結果時為 ("", [])
+    """
+    retrieved_docs_text = ""
+    retrieved_sources = []
+    
+    # Searcher 由 searcher_pool 管理：索引更新（上傳 / 刪除）後會自動切換到新世代
+    # NumPy BM25 引擎則在 CURRENT 指向新的 merged 目錄時重新載入
+    index_ready = False
+    backend = search_backend()
+    if backend == NUMPY_BACKEND:
+        index_ready = bm25_engine.has_index()
+    elif backend is not None and searcher_pool is not None:
+        index_ready = searcher_pool.has_index()
+    else:
+        if selected_doc_ids:
+            print(f"[WARNING] Search backend unavailable (SEARCH_BACKEND={SEARCH_BACKEND}, Pyserini or NumPy missing). RAG search is disabled.")
+
+    # 只有當索引存在 且 使用者有勾選檔案時 才搜尋
+    if not (index_ready and selected_doc_ids):
+        return retrieved_docs_text, retrieved_sources
+    
+    # Step 4.5.1: LLM4CS Query Rewriting
+    try:
+        with track_stage("chat", "rewrite"):
+            search_query = await llm4cs_rewrite_query(context, query)
+    except Exception as e:
+        print(f"[WARNING] LLM4CS rewrite failed, using original query: {e}")
+        search_query = query
+    
+    # Step 4.5.1.5: Normalize search query (清理使用者輸入的不相關字元)
+    original_search_query = search_query
+    search_query = normalize_search_query(search_query)
+    if original_search_query != search_query:
+        print(f"[INFO] Query normalized: '{original_search_query}' -> '{search_query}'")
+    
+    print(f"[INFO] Performing RAG search with query: '{search_query}' on docs: {selected_doc_ids}")
+    
+    try:
+        # Step 4.5.2: 檢索（只在這段期間借用 Searcher，摘要階段不佔用）
+        valid_chunks = await search_chunks(search_query, selected_doc_ids)
+        
+        # Step 4.5.3: 處理 passages（token 預算內的直接用，放不下的才摘要）
+        if valid_chunks:
+            budget = CONTEXT_TOKEN_BUDGET - reserved_tokens
+            print(f"[INFO] Found {len(valid_chunks)} relevant chunks. Packing into {budget} tokens...")
+            
+            direct_passages, summaries = await process_passages_with_summary(
+                valid_chunks, context, query, budget
+            )
+            
+            # 整理結果：直接 passage 標註來源，摘要放在最後
+            retrieved_docs_text = "【Reference Documents】:\n"
+            for passage in direct_passages:
+                source_info = passage.get('filename', 'unknown')
+                retrieved_docs_text += f"[Source: {source_info}]: {passage.get('text', '')}\n\n"
+            for summary in summaries:
+                retrieved_docs_text += f"[Summary]: {summary}\n\n"
+            
+            retrieved_sources = direct_passages  # 只回傳直接使用的來源
+            print(
+                f"[INFO] Packed {len(direct_passages)} passages directly, "
+                f"{len(valid_chunks) - len(direct_passages)} summarized into {len(summaries)} summaries."
+            )
+        else:
+            print("[INFO] No chunks found after filtering.")
+            
+    except Exception as e:
+        print(f"[ERROR] RAG Search failed: {e}")
+    
+    return retrieved_docs_text, retrieved_sources
+
+
+async def _get_relevant_ptkbs_safe(context: str, query: str, ptkb_list: List[str]) -> List[str]:
+    try:
+        with track_stage("chat", "ptkb"):
+            return await get_relevant_ptkbs(context, query, ptkb_list)
+    except Exception as e:
+        print(f"[ERROR] Get relevant PTKBs failed: {e}")
+        return []
 
 # ==========================================================
 # 主邏輯
 # ==========================================================
-async def generate_response(
+async def _prepare_turn(
     query: str,
     conversation_history: List[Dict],
     ptkb_list: List[str],
-    conversation_id: str = None,
-    selected_doc_ids: List[str] = None 
+    selected_doc_ids: List[str]
 ) -> Dict:
     """
-    生成整合回應 (RAG + PTKB)
+    執行最終生成之前的所有階段（PTKB + RAG），並組出最終 prompt。
+    
+    各階段的相依關係：
+        PTKB 相關性判斷 ─────────────────────────────┐
+        LLM4CS 改寫 -> 檢索 -> 摘要（各 chunk 並行）──┴─> 最終回應
+    互不相依的 Gemini 呼叫會同時送出，整體延遲約等於最長的那條路徑。
     """
     
     # Step 1: 建立對話上下文 (PTKB)
@@ -284,167 +702,17 @@ async def generate_response(
     # Step 3: 更新 PTKB 列表 (PTKB)
     updated_ptkb_list = ptkb_list + ([new_ptkb] if new_ptkb else [])
     
-    # Step 4: 取得相關的 PTKB (PTKB)
-    relevant_ptkbs = []
-    try:
-        relevant_ptkbs = await get_relevant_ptkbs(context, query, updated_ptkb_list)
-    except Exception as e:
-        print(f"[ERROR] Get relevant PTKBs failed: {e}")
-
-    # ============================================================
-    # Step 4.5: 執行 RAG 文件搜尋 (LLM4CS + 摘要分塊)
-    # 參數：NUM_PASSAGES=13, NUM_DIRECT_PASSAGES=4, SUMMARY_CHUNK_SIZE=5
-    # ============================================================
-    retrieved_docs_text = ""
-    retrieved_sources = []
-    
-    # [關鍵修改] 每次請求時才載入 Searcher，解決「上傳後要重啟才搜得到」的問題
-    searcher = None
-    if PYSERINI_AVAILABLE:
-        try:
-            if os.path.exists(INDEX_PATH) and os.listdir(INDEX_PATH):
-                searcher = LuceneSearcher(INDEX_PATH)
-        except Exception as e:
-            print(f"[WARNING] Failed to load index dynamically: {e}")
-    else:
-        if selected_doc_ids:
-            print("[WARNING] Pyserini not available. RAG search is disabled.")
-
-    # 只有當 Searcher 活著 且 使用者有勾選檔案時 才搜尋
-    if searcher and selected_doc_ids:
-        
-        # Step 4.5.1: LLM4CS Query Rewriting
-        try:
-            search_query = await llm4cs_rewrite_query(context, query)
-        except Exception as e:
-            print(f"[WARNING] LLM4CS rewrite failed, using original query: {e}")
-            search_query = query
-        
-        # Step 4.5.1.5: Normalize search query (清理使用者輸入的不相關字元)
-        original_search_query = search_query
-        search_query = normalize_search_query(search_query)
-        if original_search_query != search_query:
-            print(f"[INFO] Query normalized: '{original_search_query}' -> '{search_query}'")
-        
-        print(f"[INFO] Performing RAG search with query: '{search_query}' on docs: {selected_doc_ids}")
-        
-        try:
-            # -----------------------------
-            # Analyzer selection (auto + fallback)
-            # -----------------------------
-            q_has_zh = bool(re.search(r"[\u4e00-\u9fff]", search_query))
-            q_has_en = bool(re.search(r"[a-zA-Z]", search_query))
-
-            if q_has_zh and q_has_en:
-                analyzer_order = ["other", "zh", "en", "default"]
-            else:
-                primary = _detect_query_language(search_query)
-                if primary == "zh":
-                    analyzer_order = ["zh", "other", "en", "default"]
-                elif primary == "en":
-                    analyzer_order = ["en", "other", "default"]
-                else:
-                    analyzer_order = [primary, "other", "default"]
-
-            # Query variants (handle underscore mismatch like "16_flat_clustering" vs "16 flat clustering")
-            query_variants = [search_query]
-            if "_" in search_query:
-                query_variants.append(search_query.replace("_", " "))
-
-            def _run_search(q: str):
-                return searcher.search(q, k=NUM_PASSAGES * 3)
-
-            hits = []
-            analyzer_used = None
-            query_used = None
-
-            for analyzer in analyzer_order:
-                if analyzer != "default" and hasattr(searcher, "set_language"):
-                    try:
-                        searcher.set_language(analyzer)
-                    except Exception as e:
-                        print(f"[WARNING] set_language('{analyzer}') failed: {e}")
-
-                for qv in query_variants:
-                    hits = _run_search(qv)
-                    if hits:
-                        analyzer_used = analyzer
-                        query_used = qv
-                        break
-                if hits:
-                    break
-
-            if not hits and hasattr(searcher, "set_language"):
-                try:
-                    searcher.set_language("other")
-                    hits = _run_search(search_query)
-                    if hits:
-                        analyzer_used = "other"
-                        query_used = search_query
-                except Exception:
-                    pass
-
-            print(f"[INFO] Search analyzer used: {analyzer_used}, query used: {query_used}, hits: {len(hits)}")
-            valid_chunks = []
-            
-            for hit in hits:
-                # 讀取完整內容
-                doc = searcher.doc(hit.docid)
-                if not doc: 
-                    continue
-                
-                doc_json = json.loads(doc.raw())
-                metadata = doc_json.get('metadata', {})
-                doc_id_from_metadata = metadata.get('doc_id')
-                hit_score = hit.score
-                
-                # 過濾：只保留勾選的 doc_id (白名單機制)
-                if doc_id_from_metadata in selected_doc_ids:
-                    # SCORE_THRESHOLD 過濾（目前設為 0，即不過濾）
-                    if hit_score >= SCORE_THRESHOLD:
-                        valid_chunks.append({
-                            "text": doc_json.get('contents', ''),
-                            "filename": metadata.get('filename', 'unknown'),
-                            "score": hit_score
-                        })
-                        # 取 NUM_PASSAGES 筆
-                        if len(valid_chunks) >= NUM_PASSAGES:
-                            break
-            
-            # Step 4.5.3: 處理 passages（前 4 個直接用，剩餘摘要）
-            if valid_chunks:
-                print(f"[INFO] Found {len(valid_chunks)} relevant chunks. Processing with summarization...")
-                
-                # 使用摘要分塊邏輯
-                processed_passages = await process_passages_with_summary(
-                    valid_chunks, context, query
-                )
-                
-                # 整理結果
-                retrieved_docs_text = "【Reference Documents】:\n"
-                for i, passage_text in enumerate(processed_passages):
-                    if i < NUM_DIRECT_PASSAGES:
-                        # 直接 passage，標註來源
-                        source_info = valid_chunks[i].get('filename', 'unknown') if i < len(valid_chunks) else 'summary'
-                        retrieved_docs_text += f"[Source: {source_info}]: {passage_text}\n\n"
-                    else:
-                        # 摘要 passage
-                        retrieved_docs_text += f"[Summary]: {passage_text}\n\n"
-                
-                retrieved_sources = valid_chunks[:NUM_DIRECT_PASSAGES]  # 只回傳直接使用的來源
-                print(f"[INFO] Processed into {len(processed_passages)} final passages.")
-            else:
-                print("[INFO] No chunks found after filtering.")
-                
-        except Exception as e:
-            print(f"[ERROR] RAG Search failed: {e}")
+    # Step 4 & 4.5: 取得相關的 PTKB 與 RAG 文件搜尋彼此獨立，同時執行
+    # 有檢索結果時最終 prompt 只包含 passages、問題與指示文字（見 Step 5），預算只扣掉這些
+    reserved_tokens = estimate_tokens(query) + PROMPT_OVERHEAD_TOKENS
+    relevant_ptkbs, (retrieved_docs_text, retrieved_sources) = await asyncio.gather(
+        _get_relevant_ptkbs_safe(context, query, updated_ptkb_list),
+        retrieve_context(context, query, selected_doc_ids or [], reserved_tokens)
+    )
 
-    # Step 5: 生成最終回應
+    # Step 5: 組合最終 Prompt
     ptkb_str = "\n".join([f"- {p}" for p in relevant_ptkbs]) if relevant_ptkbs else "None provided."
-    base_user_prompt = format_response_prompt(context, query, ptkb_str)
-    
-    # 組合 Prompt
-    final_user_prompt = base_user_prompt
+    final_user_prompt = format_response_prompt(context, query, ptkb_str)
     if retrieved_docs_text:
         # 指示 AI：參考文件，但用使用者的語言回答
         final_user_prompt = (
@@ -455,31 +723,132 @@ async def generate_response(
             f"If the documents are in English but the question is in Chinese, please answer in Chinese."
         )
     
-    final_response = ""
-    try:
-        gemini_response = await call_gemini(
-            system_prompt=SYSTEM_PROMPT_RESPONSE,
-            user_prompt=final_user_prompt,
-            temperature=0.5,
-            max_tokens=2000  # Increased from 500 to 2000 to allow longer responses
-        )
-        final_response = parse_final_response(gemini_response)
-        # Only truncate if response is extremely long
-        word_count = len(final_response.split())
-        if word_count > RESPONSE_LIMIT:
-            print(f"[WARNING] Response truncated from {word_count} to {RESPONSE_LIMIT} words")
-            final_response = truncate_response(final_response, RESPONSE_LIMIT)
-    except Exception as e:
-        print(f"[ERROR] Gemini call failed: {e}")
-        final_response = "Sorry, error generating response."
+    return {
+        "new_ptkb": new_ptkb,
+        "relevant_ptkbs": relevant_ptkbs,
+        "retrieved_sources": retrieved_sources,
+        "final_user_prompt": final_user_prompt
+    }
+
+
+async def generate_response(
+    query: str,
+    conversation_history: List[Dict],
+    ptkb_list: List[str],
+    conversation_id: str = None,
+    selected_doc_ids: List[str] = None,
+    include_timings: bool = False
+) -> Dict:
+    """
+    生成整合回應 (RAG + PTKB)
+    
+    include_timings 為 True 時，回傳值多一個 "timings"：各階段耗時（毫秒）
+    """
+    started = time.perf_counter()
+    with collect_timings() as timings:
+        turn = await _prepare_turn(query, conversation_history, ptkb_list, selected_doc_ids)
+        
+        # Step 5: 生成最終回應
+        final_response = ""
+        try:
+            with track_stage("chat", "generation"):
+                gemini_response = await call_gemini(
+                    system_prompt=SYSTEM_PROMPT_RESPONSE,
+                    user_prompt=turn["final_user_prompt"],
+                    temperature=0.5,
+                    max_tokens=2000  # Increased from 500 to 2000 to allow longer responses
+                )
+            final_response = parse_final_response(gemini_response)
+            # Only truncate if response is extremely long
+            word_count = len(final_response.split())
+            if word_count > RESPONSE_LIMIT:
+                print(f"[WARNING] Response truncated from {word_count} to {RESPONSE_LIMIT} words")
+                final_response = truncate_response(final_response, RESPONSE_LIMIT)
+        except Exception as e:
+            print(f"[ERROR] Gemini call failed: {e}")
+            final_response = "Sorry, error generating response."
+    record_stage("chat", "total", time.perf_counter() - started, timings)
     
     # Step 6: 回傳
-    return {
+    result = {
         "answer": final_response,
         "conversation_id": conversation_id or str(uuid.uuid4()),
-        "ptkb_used": relevant_ptkbs,
-        "new_ptkb": new_ptkb,
-        "sources": retrieved_sources
+        "ptkb_used": turn["relevant_ptkbs"],
+        "new_ptkb": turn["new_ptkb"],
+        "sources": turn["retrieved_sources"]
+    }
+    if include_timings:
+        result["timings"] = timings
+    return result
+
+
+async def stream_response(
+    query: str,
+    conversation_history: List[Dict],
+    ptkb_list: List[str],
+    conversation_id: str = None,
+    selected_doc_ids: List[str] = None,
+    include_timings: bool = False
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    generate_response 的串流版本，依序 yield (event, data)：
+    
+        ("sources", {"sources": [...]})             檢索完成後立即送出
+        ("token",   {"text": "..."})                 Gemini 生成的文字片段（可能多次）
+        ("done",    {"conversation_id", "ptkb_used", "new_ptkb"})
+    
+    生成失敗時以 ("error", {"detail": ...}) 取代剩餘的 token，最後仍會送出 done。
+    include_timings 為 True 時，done 事件多一個 "timings"（各階段耗時，毫秒）。
+    """
+    started = time.perf_counter()
+    # collect_timings 不跨越 yield：generator 每次恢復執行時的 context 不一定相同
+    with collect_timings() as timings:
+        turn = await _prepare_turn(query, conversation_history, ptkb_list, selected_doc_ids)
+    yield "sources", {"sources": turn["retrieved_sources"]}
+    
+    formatter = StreamingResponseFormatter(RESPONSE_LIMIT)
+    generation_started = time.perf_counter()
+    stream = stream_gemini(
+        system_prompt=SYSTEM_PROMPT_RESPONSE,
+        user_prompt=turn["final_user_prompt"],
+        temperature=0.5,
+        max_tokens=2000
+    )
+    try:
+        async for fragment in stream:
+            text = formatter.feed(fragment)
+            if text:
+                yield "token", {"text": text}
+            if formatter.truncated:
+                print(f"[WARNING] Streamed response truncated at {RESPONSE_LIMIT} words")
+                break
+        text = formatter.finish()
+        if text:
+            yield "token", {"text": text}
+    except Exception as e:
+        print(f"[ERROR] Gemini stream failed: {e}")
+        yield "error", {"detail": "Sorry, error generating response."}
+    finally:
+        # 提前結束（字數上限、client 斷線）時立即關閉串流，釋放 Gemini 併發名額，不等到 GC
+        await stream.aclose()
+    record_stage("chat", "generation", time.perf_counter() - generation_started, timings)
+    record_stage("chat", "total", time.perf_counter() - started, timings)
+    
+    done = {
+        "conversation_id": conversation_id or str(uuid.uuid4()),
+        "ptkb_used": turn["relevant_ptkbs"],
+        "new_ptkb": turn["new_ptkb"]
+    }
+    if include_timings:
+        done["timings"] = timings
+    yield "done", done
+
+def get_cache_stats() -> Dict[str, Dict]:
+    """回傳 chat pipeline 各快取的命中統計"""
+    return {
+        "rewrite": {"enabled": REWRITE_CACHE_ENABLED, **rewrite_cache.stats()},
+        "summary": {"mode": SUMMARY_CACHE_MODE, **summary_cache.stats()},
+        "retrieval": {"enabled": RETRIEVAL_CACHE_ENABLED, **retrieval_cache.stats()},
     }
 
 # Helper functions
@@ -494,3 +863,79 @@ def truncate_response(text: str, limit: int) -> str:
     words = text.split()
     if len(words) <= limit: return text
     return " ".join(words[:limit]) + "..."
+
+
+class StreamingResponseFormatter:
+    """
+    parse_final_response + truncate_response 的增量版本。
+    
+    - 開頭先緩衝 PREFIX_WINDOW 個字元，判斷是否有 "Response:" 前綴並移除
+    - 邊輸出邊累計字數，超過 limit 時截斷並補上 "..."，之後 truncated 為 True
+    """
+    PREFIX = "response:"
+    PREFIX_WINDOW = 32
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.truncated = False
+        self._head = ""
+        self._head_done = False
+        self._strip_leading = False
+        self._word_count = 0
+        self._in_word = False
+        self._pending_space = ""
+
+    def feed(self, fragment: str) -> str:
+        """輸入一段新生成的文字，回傳可以送給使用者的部分"""
+        if self.truncated:
+            return ""
+        if not self._head_done:
+            self._head += fragment
+            if self.PREFIX not in self._head.lower() and len(self._head) < self.PREFIX_WINDOW:
+                return ""
+            fragment = self._release_head()
+        return self._emit(fragment)
+
+    def finish(self) -> str:
+        """串流結束時呼叫，送出仍在緩衝中的文字"""
+        if self.truncated or self._head_done:
+            return ""
+        return self._emit(self._release_head())
+
+    def _release_head(self) -> str:
+        head, self._head, self._head_done = self._head, "", True
+        if self.PREFIX in head.lower():
+            # 與 parse_final_response 相同：取第一個冒號之後的內容
+            self._strip_leading = True
+            return head.split(":", 1)[1]
+        return head
+
+    def _emit(self, fragment: str) -> str:
+        if self._strip_leading:
+            fragment = fragment.lstrip()
+            if not fragment:
+                return ""
+            self._strip_leading = False
+        
+        for match in re.finditer(r"\S+", fragment):
+            # 片段開頭接續上一段未結束的單字時不重複計數
+            if match.start() == 0 and self._in_word:
+                continue
+            self._word_count += 1
+            if self._word_count > self.limit:
+                self.truncated = True
+                kept = fragment[:match.start()].rstrip()
+                return (self._pending_space + kept if kept else "") + "..."
+        
+        if not fragment:
+            return ""
+        self._in_word = not fragment[-1].isspace()
+        
+        # 結尾空白先保留，等下一段有文字時再送出（串流結束時捨棄，等同 strip）
+        body = fragment.rstrip()
+        if not body:
+            self._pending_space += fragment
+            return ""
+        text = self._pending_space + body
+        self._pending_space = fragment[len(body):]
+        return text
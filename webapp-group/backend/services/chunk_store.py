@@ -0,0 +1,203 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+# ================= 設定區 =================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK_DIR = os.path.join(BASE_DIR, "data", "chunks")   # 每份文件一組 .bin（文字）+ .idx（offset 表）
+JSONL_DIR = os.path.join(BASE_DIR, "data", "jsonl")    # 缺少 chunk store 時從 JSONL 補建
+
+# 同時保持 mmap 開啟的文件數上限
+CHUNK_STORE_OPEN_DOCS = int(os.getenv("CHUNK_STORE_OPEN_DOCS", "256"))
+
+# .idx 格式（little-endian）：
+#   magic(4) | meta_len(u32) | meta JSON | count(u32) | offsets(u64 * (count + 1))
+# 第 i 個 chunk 的文字為 .bin[offsets[i]:offsets[i + 1]]（UTF-8）
+_MAGIC = b"CKS1"
+_U32 = struct.Struct("<I")
+
+
+class _MappedDocument:
+    """單一文件的 mmap 檢視"""
+
+    def __init__(self, blob_path: str, idx_path: str):
+        self._files = []
+        self.blob = self._map(blob_path)
+        self.idx = self._map(idx_path)
+
+        if bytes(self.idx[:4]) != _MAGIC:
+            raise ValueError(f"Invalid chunk index file: {idx_path}")
+        meta_len = _U32.unpack_from(self.idx, 4)[0]
+        self.meta = json.loads(bytes(self.idx[8:8 + meta_len]).decode("utf-8"))
+        self.count = _U32.unpack_from(self.idx, 8 + meta_len)[0]
+        self._offsets_at = 12 + meta_len
+
+    def _map(self, path: str):
+        f = open(path, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def text(self, chunk_index: int) -> Optional[str]:
+        if not 0 <= chunk_index < self.count:
+            return None
+        start, end = struct.unpack_from("<QQ", self.idx, self._offsets_at + 8 * chunk_index)
+        # memoryview 切片不複製資料，只在解碼成 str 時讀取需要的範圍
+        with memoryview(self.blob) as view:
+            return str(view[start:end], "utf-8")
+
+    def close(self) -> None:
+        for mapped in (self.blob, self.idx):
+            if isinstance(mapped, mmap.mmap):
+                try:
+                    mapped.close()
+                except BufferError:
+                    # 其他 thread 仍在讀取；mmap 會在最後一個參照釋放時由 GC 關閉
+                    pass
+        for f in self._files:
+            f.close()
+
+
+class ChunkStore:
+    """
+    以 mmap 讀取的 chunk 文字庫，key 為 Lucene docid（doc_id#chunk_index）。
+
+    檢索命中後直接從這裡取 chunk 文字與 metadata，不必經由 JVM 讀取 raw JSON 再 json.loads，
+    索引也因此不需要 --storeRaw。
+    """
+
+    def __init__(self, root: str = CHUNK_DIR, jsonl_dir: str = JSONL_DIR, max_open: int = CHUNK_STORE_OPEN_DOCS):
+        self.root = root
+        self.jsonl_dir = jsonl_dir
+        self.max_open = max(1, max_open)
+        self._open: "OrderedDict[str, _MappedDocument]" = OrderedDict()
+        self._lock = threading.RLock()   # 補建時會在持有 lock 的情況下呼叫 write_document
+
+    def _paths(self, doc_id: str):
+        return (
+            os.path.join(self.root, f"{doc_id}.bin"),
+            os.path.join(self.root, f"{doc_id}.idx"),
+        )
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def write_document(self, doc_id: str, filename: str, chunks: Iterable[str]) -> int:
+        """
+        寫入一份文件的所有 chunks（依 chunk_index 順序），回傳 chunk 數量。
+        先寫入暫存檔再 os.replace，讀取端不會看到寫到一半的檔案。
+        """
+        os.makedirs(self.root, exist_ok=True)
+        blob_path, idx_path = self._paths(doc_id)
+        offsets = [0]
+        with open(f"{blob_path}.tmp", "wb") as blob:
+            for chunk in chunks:
+                data = chunk.encode("utf-8")
+                blob.write(data)
+                offsets.append(offsets[-1] + len(data))
+
+        meta = json.dumps({"doc_id": doc_id, "filename": filename}, ensure_ascii=False).encode("utf-8")
+        with open(f"{idx_path}.tmp", "wb") as idx:
+            idx.write(_MAGIC)
+            idx.write(_U32.pack(len(meta)))
+            idx.write(meta)
+            idx.write(_U32.pack(len(offsets) - 1))
+            idx.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+        self._evict(doc_id)
+        os.replace(f"{blob_path}.tmp", blob_path)
+        os.replace(f"{idx_path}.tmp", idx_path)
+        return len(offsets) - 1
+
+    def _backfill_from_jsonl(self, doc_id: str) -> bool:
+        """由 JSONL 補建 chunk store（舊版上傳的文件）"""
+        jsonl_path = os.path.join(self.jsonl_dir, f"{doc_id}.json")
+        if not os.path.exists(jsonl_path):
+            return False
+        records = []
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        records.sort(key=lambda rec: rec.get("metadata", {}).get("chunk_index", 0))
+        filename = records[0].get("metadata", {}).get("filename", "unknown") if records else "unknown"
+        self.write_document(doc_id, filename, (rec.get("contents", "") for rec in records))
+        print(f"[INFO] Built chunk store for {doc_id} from JSONL")
+        return True
+
+    def delete_document(self, doc_id: str) -> None:
+        self._evict(doc_id)
+        for path in self._paths(doc_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # ------------------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------------------
+    def _document(self, doc_id: str) -> Optional[_MappedDocument]:
+        with self._lock:
+            document = self._open.get(doc_id)
+            if document is not None:
+                self._open.move_to_end(doc_id)
+                return document
+
+            blob_path, idx_path = self._paths(doc_id)
+            if not (os.path.exists(blob_path) and os.path.exists(idx_path)):
+                if not self._backfill_from_jsonl(doc_id):
+                    return None
+            document = _MappedDocument(blob_path, idx_path)
+            self._open[doc_id] = document
+            while len(self._open) > self.max_open:
+                _, oldest = self._open.popitem(last=False)
+                oldest.close()
+            return document
+
+    def _evict(self, doc_id: str) -> None:
+        with self._lock:
+            document = self._open.pop(doc_id, None)
+        if document is not None:
+            document.close()
+
+    def get(self, chunk_id: str) -> Optional[Dict]:
+        """
+        依 chunk id（doc_id#chunk_index）取得 chunk。
+
+        Returns:
+            {"id", "doc_id", "chunk_index", "filename", "text"}；找不到時為 None
+        """
+        doc_id, sep, index_str = chunk_id.rpartition("#")
+        if not sep or not index_str.isdigit():
+            return None
+        try:
+            document = self._document(doc_id)
+        except Exception as e:
+            print(f"[WARNING] Failed to open chunk store for {doc_id}: {e}")
+            return None
+        if document is None:
+            return None
+        text = document.text(int(index_str))
+        if text is None:
+            return None
+        return {
+            "id": chunk_id,
+            "doc_id": doc_id,
+            "chunk_index": int(index_str),
+            "filename": document.meta.get("filename", "unknown"),
+            "text": text,
+        }
+
+    def get_many(self, chunk_ids: List[str]) -> Dict[str, Dict]:
+        chunks = {}
+        for chunk_id in chunk_ids:
+            chunk = self.get(chunk_id)
+            if chunk is not None:
+                chunks[chunk_id] = chunk
+        return chunks
+
+
+chunk_store = ChunkStore()
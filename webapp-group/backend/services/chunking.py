@@ -0,0 +1,97 @@
+import codecs
+from typing import Iterable, Iterator
+
+# 往後偷看多少字尋找句子結束符號
+LOOK_AHEAD = 50
+# 句子結束符號 (中文句號優先，再來是英文句號、問號等)；依序尋找，第一個找到的即為切分點
+SENTENCE_ENDINGS = ["。", "！", "？", ".", "!", "?", "\n"]
+# 讀取文字檔時每次讀入的字元數
+TEXT_BLOCK_SIZE = 1 << 16
+
+
+def iter_text_chunks(blocks: Iterable[str], chunk_size: int = 500, overlap: int = 100) -> Iterator[str]:
+    """
+    滑動視窗分段 (Sliding Window Chunking)，輸入為依序到達的文字片段。
+
+    結果與對完整字串分段完全相同，但只保留目前視窗附近的文字：
+    切分第 start 個字開始的 chunk 只需要 text[start:start + chunk_size + LOOK_AHEAD]，
+    所以不論檔案多大，記憶體用量只與 chunk_size 和片段大小有關。
+
+    1. 每一段都有足夠的重疊 (overlap)，避免語意被切斷。
+    2. 嘗試尋找句號切分，讓段落更自然。
+    """
+    blocks = iter(blocks)
+    buf = ""          # 尚未捨棄的文字
+    offset = 0        # buf[0] 在全文中的位置
+    start = 0
+    eof = False
+
+    while True:
+        # 讀入足夠切分目前 chunk 的文字（或讀到結尾）
+        while not eof and offset + len(buf) < start + chunk_size + LOOK_AHEAD:
+            try:
+                buf += next(blocks)
+            except StopIteration:
+                eof = True
+        available = offset + len(buf)   # 讀到結尾時即為全文長度
+        if start >= available:
+            break
+
+        # 1. 預設切分點
+        end = min(start + chunk_size, available)
+
+        # 2. 優化切分點：不要切在句子中間
+        # （尚未讀到結尾時 available >= end + LOOK_AHEAD，偷看的範圍與完整字串相同）
+        if end < available:
+            look_ahead_buffer = buf[end - offset:min(end + LOOK_AHEAD, available) - offset]
+            found_cut_point = False
+            for char in SENTENCE_ENDINGS:
+                if char in look_ahead_buffer:
+                    # 找到結束符號，把 end 延伸到該符號之後
+                    end += (look_ahead_buffer.index(char) + 1)
+                    found_cut_point = True
+                    break
+            # 如果沒找到標點，退而求其次找空白鍵 (避免切斷單字)
+            if not found_cut_point and " " in look_ahead_buffer:
+                end += (look_ahead_buffer.index(" ") + 1)
+
+        # 3. 取出 chunk
+        chunk = buf[start - offset:end - offset].strip()
+        if chunk:  # 避免存入空字串
+            yield chunk
+
+        # 4. 移動視窗 (Sliding)：確保上一段的結尾重複出現在下一段的開頭
+        start += (chunk_size - overlap)
+        # 防止無窮迴圈
+        if start >= end:
+            start = end
+
+        # 捨棄已不再需要的文字（累積超過一半才搬移，避免每段都複製整個 buffer）
+        consumed = start - offset
+        if consumed > 0 and consumed * 2 >= len(buf):
+            buf = buf[consumed:]
+            offset = start
+
+
+def iter_text_file(path: str, block_size: int = TEXT_BLOCK_SIZE) -> Iterator[str]:
+    """以 UTF-8 逐段讀取文字檔（不轉換換行符號，與一次 decode 整個檔案的結果相同）"""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+class Utf8Validator:
+    """逐段檢查上傳內容是否為 UTF-8，並記錄是否含有非空白文字（不保留內容）"""
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.has_text = False
+
+    def feed(self, data: bytes, final: bool = False) -> None:
+        """無法解碼時拋出 UnicodeDecodeError"""
+        text = self._decoder.decode(data, final)
+        if not self.has_text and text.strip():
+            self.has_text = True
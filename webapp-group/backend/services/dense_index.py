@@ -0,0 +1,430 @@
+import json
+import math
+import os
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from services.text_analysis import analyze
+
+# [可選] NumPy：沒有安裝時停用 dense 檢索
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    np = None
+
+# ================= 設定區 =================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTOR_DIR = os.path.join(BASE_DIR, "data", "vectors")   # 每份文件一個 <doc_id>.npy（第 i 列 = 第 i 個 chunk）
+JSONL_DIR = os.path.join(BASE_DIR, "data", "jsonl")      # 缺少向量時從 JSONL 補建
+
+# 向量編碼器：none（停用 dense 檢索）/ hashing / sentence-transformers:<model name>
+DENSE_ENCODER = os.getenv("DENSE_ENCODER", "none").strip()
+DENSE_DIM = int(os.getenv("DENSE_DIM", "384"))              # hashing encoder 的維度
+DENSE_DTYPE = os.getenv("DENSE_DTYPE", "int8").lower()      # 向量儲存格式：int8（預設，掃描較快）/ float16
+# 每次矩陣乘法處理的列數（限制轉成 float32 的暫存大小）
+DENSE_BLOCK_ROWS = int(os.getenv("DENSE_BLOCK_ROWS", "16384"))
+# 同時保持 mmap 開啟的文件數上限（np.load 的 mmap 不佔用 file descriptor，只佔一個 memory mapping）
+DENSE_OPEN_DOCS = int(os.getenv("DENSE_OPEN_DOCS", "4096"))
+# 上傳時每批編碼的 chunk 數
+ENCODE_BATCH = 256
+
+SIGNATURE_FILE = "ENCODER"
+
+
+# ==========================================================
+# Encoder
+# ==========================================================
+class Encoder(ABC):
+    """把文字轉成 L2 正規化向量的介面；只需實作 encode"""
+
+    name = "encoder"
+    dim = 0
+
+    @property
+    def signature(self) -> str:
+        """向量空間的識別字串：改變時既有向量全部重新編碼"""
+        return f"{self.name}:{self.dim}"
+
+    @abstractmethod
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        """
+        Args:
+            texts: 文字列表
+
+        Returns:
+            (len(texts), dim) 的 float32 矩陣，每列 L2 norm 為 1（空文字為零向量）
+        """
+
+
+class HashingEncoder(Encoder):
+    """
+    決定性的 feature hashing 編碼器（純 CPU、不需下載模型，離線測試用）。
+
+    特徵為 analyzer 的 term 與相鄰 term 組成的 bigram，以 CRC32 雜湊到 dim 個維度並帶正負號，
+    權重為 1 + log(tf)；相同輸入在任何機器上都得到相同向量。
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = DENSE_DIM):
+        self.dim = dim
+
+    @staticmethod
+    @lru_cache(maxsize=262144)
+    def _feature(feature: str, dim: int) -> Tuple[int, float]:
+        h = zlib.crc32(feature.encode("utf-8"))
+        return h % dim, (1.0 if h & 0x80000000 else -1.0)
+
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = analyze(text)
+            features = Counter(terms)
+            features.update(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+            if not features:
+                continue
+            columns, values = [], []
+            for feature, tf in features.items():
+                column, sign = self._feature(feature, self.dim)
+                columns.append(column)
+                values.append(sign * (1.0 + math.log(tf)))
+            # 不同特徵可能雜湊到同一維度，以 add.at 累加
+            np.add.at(vectors[row], columns, values)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class SentenceTransformerEncoder(Encoder):
+    """sentence-transformers 模型（需另外安裝 sentence-transformers；只在 CPU 上執行）"""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError("DENSE_ENCODER requires the sentence-transformers package") from e
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"sentence-transformers/{model_name}"
+        self.dim = int(self.model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: List[str]) -> "np.ndarray":
+        return np.asarray(
+            self.model.encode(texts, batch_size=ENCODE_BATCH, normalize_embeddings=True, convert_to_numpy=True),
+            dtype=np.float32
+        )
+
+
+@lru_cache(maxsize=1)
+def get_encoder() -> Optional[Encoder]:
+    """依 DENSE_ENCODER 建立編碼器；停用或無法建立時回傳 None"""
+    if DENSE_ENCODER.lower() in ("", "none", "off"):
+        return None
+    if not NUMPY_AVAILABLE:
+        print("[WARNING] NumPy not available. Dense retrieval is disabled.")
+        return None
+    if DENSE_ENCODER.lower() == "hashing":
+        return HashingEncoder()
+    if DENSE_ENCODER.startswith("sentence-transformers:"):
+        try:
+            return SentenceTransformerEncoder(DENSE_ENCODER.split(":", 1)[1])
+        except Exception as e:
+            print(f"[WARNING] Failed to load dense encoder '{DENSE_ENCODER}': {e}")
+            return None
+    print(f"[WARNING] Unknown DENSE_ENCODER '{DENSE_ENCODER}'. Dense retrieval is disabled.")
+    return None
+
+
+# ==========================================================
+# 向量儲存格式
+# ==========================================================
+def quantize(vectors: "np.ndarray", dtype: str) -> Tuple["np.ndarray", Optional["np.ndarray"]]:
+    """
+    float32 向量轉成儲存格式。
+
+    Returns:
+        (matrix, scales)：float16 時 scales 為 None；int8 時每列以 max|v| / 127 對稱量化，
+        內積 = (matrix @ q) * scales
+    """
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        safe = np.where(scales > 0, scales, 1.0)
+        matrix = np.rint(vectors / safe[:, None]).astype(np.int8)
+        return matrix, scales.astype(np.float32)
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    raise ValueError(f"Unsupported DENSE_DTYPE: {dtype}")
+
+
+class _MappedVectors:
+    """單一文件向量的 mmap 檢視"""
+
+    def __init__(self, matrix_path: str, scale_path: str):
+        self.matrix = np.load(matrix_path, mmap_mode="r")
+        self.scales = np.load(scale_path, mmap_mode="r") if os.path.exists(scale_path) else None
+
+
+class _VectorWriter:
+    """上傳時邊分塊邊編碼：wrap() 把 chunk 原樣傳下去，每 ENCODE_BATCH 個編碼一次"""
+
+    def __init__(self, index: "DenseIndex", doc_id: str):
+        self.index = index
+        self.doc_id = doc_id
+        self._pending: List[str] = []
+        self._parts: List[np.ndarray] = []
+
+    def _flush(self) -> None:
+        if self._pending:
+            self._parts.append(self.index.encoder.encode(self._pending))
+            self._pending = []
+
+    def add(self, text: str) -> None:
+        self._pending.append(text)
+        if len(self._pending) >= ENCODE_BATCH:
+            self._flush()
+
+    def wrap(self, chunks: Iterable[str]) -> Iterator[str]:
+        for chunk in chunks:
+            self.add(chunk)
+            yield chunk
+
+    def commit(self) -> int:
+        """寫出向量檔，回傳列數"""
+        self._flush()
+        vectors = (
+            np.concatenate(self._parts) if self._parts
+            else np.zeros((0, self.index.encoder.dim), dtype=np.float32)
+        )
+        self._parts = []
+        self.index._save(self.doc_id, vectors)
+        return len(vectors)
+
+
+class DenseIndex:
+    """
+    暴力搜尋（brute-force）的 chunk 向量索引，只用 CPU。
+
+    - 每份文件一個 float16 / int8 矩陣（int8 另存每列的 scale），以 mmap 讀取
+    - 檢索時只掃描勾選文件的矩陣（doc_id 預先過濾），每 DENSE_BLOCK_ROWS 列做一次矩陣乘法，
+      逐塊以 argpartition 保留 top-k；多個查詢可一起計算（search_vectors）
+    - 編碼器或儲存格式改變時（ENCODER 檔記錄的簽章不同），sync 會重新編碼所有文件
+    """
+
+    def __init__(
+        self,
+        root: str = VECTOR_DIR,
+        encoder: Optional[Encoder] = None,
+        dtype: str = DENSE_DTYPE,
+        block_rows: int = DENSE_BLOCK_ROWS,
+        max_open: int = DENSE_OPEN_DOCS
+    ):
+        self.root = root
+        self.encoder = encoder
+        self.dtype = dtype
+        self.block_rows = max(1, block_rows)
+        self.max_open = max(1, max_open)
+        self._open: "OrderedDict[str, _MappedVectors]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.encoder is not None
+
+    @property
+    def signature(self) -> str:
+        return f"{self.encoder.signature}:{self.dtype}"
+
+    def _paths(self, doc_id: str):
+        return (
+            os.path.join(self.root, f"{doc_id}.npy"),
+            os.path.join(self.root, f"{doc_id}.scale.npy"),
+        )
+
+    # ------------------------------------------------------------------
+    # 寫入
+    # ------------------------------------------------------------------
+    def writer(self, doc_id: str) -> _VectorWriter:
+        return _VectorWriter(self, doc_id)
+
+    def _save(self, doc_id: str, vectors: "np.ndarray") -> None:
+        """先寫入暫存檔再 os.replace，讀取端不會看到寫到一半的檔案"""
+        os.makedirs(self.root, exist_ok=True)
+        self._write_signature()
+        matrix, scales = quantize(vectors, self.dtype)
+        matrix_path, scale_path = self._paths(doc_id)
+        self._evict(doc_id)
+        if scales is not None:
+            with open(f"{scale_path}.tmp", "wb") as f:
+                np.save(f, scales)
+            os.replace(f"{scale_path}.tmp", scale_path)
+        elif os.path.exists(scale_path):
+            os.remove(scale_path)
+        with open(f"{matrix_path}.tmp", "wb") as f:
+            np.save(f, matrix)
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+
+    def _write_signature(self) -> None:
+        path = os.path.join(self.root, SIGNATURE_FILE)
+        if self._read_signature() != self.signature:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.signature)
+
+    def _read_signature(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, SIGNATURE_FILE), "r", encoding="utf-8") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def write_from_jsonl(self, doc_id: str, jsonl_path: str) -> int:
+        """由 JSONL 補建文件向量（依 chunk_index 順序）"""
+        records = []
+        with open(jsonl_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+        records.sort(key=lambda rec: rec.get("metadata", {}).get("chunk_index", 0))
+        writer = self.writer(doc_id)
+        for rec in records:
+            writer.add(rec.get("contents", "") or "")
+        return writer.commit()
+
+    def delete_document(self, doc_id: str) -> None:
+        self._evict(doc_id)
+        for path in self._paths(doc_id):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stored_doc_ids(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name[:-len(".npy")] for name in os.listdir(self.root)
+            if name.endswith(".npy") and not name.endswith(".scale.npy")
+        )
+
+    def sync(self, jsonl_dir: str = JSONL_DIR) -> int:
+        """
+        讓向量與 JSONL 目錄一致：簽章不同時全部重新編碼，補建缺少的文件、移除已刪除文件的向量。
+
+        Returns:
+            重新編碼的文件數
+        """
+        if not self.enabled:
+            return 0
+        if self._read_signature() not in (None, self.signature):
+            print(f"[INFO] Dense encoder changed to {self.signature}. Re-encoding all documents...")
+            for doc_id in self.stored_doc_ids():
+                self.delete_document(doc_id)
+        jsonl_docs = {
+            fname[:-len(".json")] for fname in (os.listdir(jsonl_dir) if os.path.isdir(jsonl_dir) else [])
+            if fname.endswith(".json")
+        }
+        stored = set(self.stored_doc_ids())
+        for doc_id in stored - jsonl_docs:
+            self.delete_document(doc_id)
+        encoded = 0
+        for doc_id in sorted(jsonl_docs - stored):
+            self.write_from_jsonl(doc_id, os.path.join(jsonl_dir, f"{doc_id}.json"))
+            encoded += 1
+        if encoded:
+            print(f"[INFO] Encoded vectors for {encoded} document(s)")
+        return encoded
+
+    # ------------------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------------------
+    def _document(self, doc_id: str) -> Optional[_MappedVectors]:
+        with self._lock:
+            mapped = self._open.get(doc_id)
+            if mapped is not None:
+                self._open.move_to_end(doc_id)
+                return mapped
+            matrix_path, scale_path = self._paths(doc_id)
+            if not os.path.exists(matrix_path):
+                return None
+            mapped = _MappedVectors(matrix_path, scale_path)
+            self._open[doc_id] = mapped
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return mapped
+
+    def _evict(self, doc_id: str) -> None:
+        with self._lock:
+            self._open.pop(doc_id, None)
+
+    def search_vectors(
+        self,
+        queries: "np.ndarray",
+        doc_ids: Optional[List[str]] = None,
+        k: int = 10
+    ) -> List[List[Tuple[str, float]]]:
+        """
+        以內積（向量已正規化，即 cosine）檢索一批查詢向量。
+
+        Args:
+            queries: (num_queries, dim) float32
+            doc_ids: 只掃描這些文件；None 表示所有文件
+            k: 每個查詢回傳的筆數
+
+        Returns:
+            每個查詢一個 [(chunk_id, score), ...]，依分數遞減
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        num_queries = len(queries)
+        doc_ids = self.stored_doc_ids() if doc_ids is None else sorted(set(doc_ids))
+        best_scores = np.empty((num_queries, 0), dtype=np.float32)
+        best_refs = np.empty((num_queries, 0), dtype=np.int64)   # (文件序號 << 32) | 列號
+
+        for doc_index, doc_id in enumerate(doc_ids):
+            mapped = self._document(doc_id)
+            if mapped is None or not len(mapped.matrix):
+                continue
+            rows = len(mapped.matrix)
+            for start in range(0, rows, self.block_rows):
+                end = min(start + self.block_rows, rows)
+                scores = np.asarray(mapped.matrix[start:end], dtype=np.float32) @ queries.T
+                if mapped.scales is not None:
+                    scores *= mapped.scales[start:end, None]
+                top = min(k, end - start)
+                local = np.argpartition(-scores, top - 1, axis=0)[:top].T        # (num_queries, top)
+                block_scores = np.take_along_axis(scores.T, local, axis=1)
+                block_refs = (doc_index << 32) | (start + local)
+                best_scores = np.concatenate([best_scores, block_scores], axis=1)
+                best_refs = np.concatenate([best_refs, block_refs], axis=1)
+                if best_scores.shape[1] > k:
+                    keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_refs = np.take_along_axis(best_refs, keep, axis=1)
+
+        results = []
+        for scores, refs in zip(best_scores, best_refs):
+            order = np.argsort(-scores, kind="stable")
+            results.append([
+                (f"{doc_ids[int(refs[i]) >> 32]}#{int(refs[i]) & 0xFFFFFFFF}", float(scores[i]))
+                for i in order
+            ])
+        return results
+
+    def search(self, query: str, doc_ids: Optional[List[str]] = None, k: int = 10) -> List[Tuple[str, float]]:
+        """編碼查詢後檢索；只回傳 cosine > 0 的 chunk（查詢沒有任何特徵時為空列表）"""
+        if not self.enabled or k <= 0:
+            return []
+        vector = self.encoder.encode([query])
+        if not np.any(vector):
+            return []
+        return [(chunk_id, score) for chunk_id, score in self.search_vectors(vector, doc_ids, k)[0] if score > 0]
+
+
+@lru_cache(maxsize=1)
+def get_dense_index() -> DenseIndex:
+    """
+    第一次使用時才建立向量索引與編碼器（sentence-transformers 模型可能需要數秒載入）。
+    模組匯入時不建立，PDF 解析的 spawn worker 等只匯入模組的 process 不會載入模型。
+    """
+    return DenseIndex(encoder=get_encoder())
@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# ================= 設定區 =================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_PATH = os.path.join(BASE_DIR, "data", "catalog.sqlite3")   # 文件目錄（SQLite）
+UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")            # 缺少紀錄時從原始檔補算 hash
+JSONL_DIR = os.path.join(BASE_DIR, "data", "jsonl")               # 缺少紀錄時從 JSONL 補建
+LEGACY_MANIFEST_PATH = os.path.join(BASE_DIR, "data", "manifest.json")
+
+# 補算 hash 時每次讀取的大小（bytes）
+HASH_BLOCK_SIZE = 1 << 20
+
+# list_documents 可用的排序欄位（對外名稱 -> 欄位）
+SORT_COLUMNS = {
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+    "filename": "filename COLLATE NOCASE",
+    "size": "size_bytes",
+    "chunks": "chunk_count",
+    "status": "status",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id       TEXT PRIMARY KEY,
+    filename     TEXT NOT NULL,
+    file_type    TEXT NOT NULL,
+    size_bytes   INTEGER,
+    chunk_count  INTEGER,
+    languages    TEXT,             -- JSON list；NULL 表示尚未偵測
+    content_hash TEXT,             -- 不設 UNIQUE：舊資料可能有內容相同的多份文件，新上傳的去重由 claim 負責
+    aliases      TEXT NOT NULL DEFAULT '[]',
+    status       TEXT NOT NULL,    -- processing / ready
+    created_at   REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS documents_created_at ON documents (created_at);
+CREATE INDEX IF NOT EXISTS documents_filename ON documents (filename COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+"""
+
+
+def file_sha256(path: str, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """分段計算檔案的 SHA-256（與上傳時的 content_hash 相同）"""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return hasher.hexdigest()
+            hasher.update(block)
+
+
+def file_type_of(filename: str) -> str:
+    return filename.split(".")[-1].lower() if "." in filename else "txt"
+
+
+class DocumentCatalog:
+    """
+    文件目錄（SQLite）：doc_id、檔名、類型、大小、chunk 數、語言、內容 hash、別名、狀態與時間。
+
+    - 以 content_hash 辨識重複上傳：相同內容直接對應到既有的 doc_id，只追加檔名別名
+    - list_documents 只需一次查詢（支援分頁與排序），不必讀取每個 JSONL
+    - transaction() 讓呼叫端把檔案操作與目錄更新放在同一個交易中：檔案操作失敗時目錄不變
+    """
+
+    def __init__(
+        self,
+        path: str = CATALOG_PATH,
+        upload_dir: str = UPLOAD_DIR,
+        jsonl_dir: str = JSONL_DIR,
+        legacy_manifest_path: str = LEGACY_MANIFEST_PATH
+    ):
+        self.path = path
+        self.upload_dir = upload_dir
+        self.jsonl_dir = jsonl_dir
+        self.legacy_manifest_path = legacy_manifest_path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._depth = 0
+        # 單一連線由所有 thread 共用，交易期間以 RLock 互斥（巢狀 transaction 併入最外層）
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        """延遲開啟資料庫（需在 lock 內呼叫）；第一次開啟時補建舊資料"""
+        if self._conn is not None:
+            return self._conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        self._conn = conn
+        with self.transaction() as conn:
+            self._migrate_manifest(conn)
+            self._backfill_from_jsonl(conn)
+            self._recover_interrupted(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        交易：區塊正常結束時 commit，拋出例外時 rollback。
+
+        區塊內可以再呼叫本類別的其他方法，它們會併入同一個交易。
+        """
+        with self._lock:
+            conn = self._connect()
+            outermost = self._depth == 0
+            if outermost:
+                conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield conn
+            except BaseException:
+                self._depth -= 1
+                if outermost:
+                    conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if outermost:
+                conn.execute("COMMIT")
+
+    @contextmanager
+    def _reading(self) -> Iterator[sqlite3.Connection]:
+        """唯讀查詢：只需取得連線，不開啟寫入交易"""
+        with self._lock:
+            yield self._connect()
+
+    # ---------- 舊資料補建 ----------
+    def _migrate_manifest(self, conn: sqlite3.Connection) -> None:
+        """匯入舊版 data/manifest.json（content hash / 別名 / 語言），完成後改名保留"""
+        if not os.path.exists(self.legacy_manifest_path):
+            return
+        try:
+            with open(self.legacy_manifest_path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("documents", {})
+        except Exception as e:
+            print(f"[WARNING] Failed to read legacy manifest: {e}")
+            return
+        for doc_id, entry in entries.items():
+            if not os.path.exists(os.path.join(self.jsonl_dir, f"{doc_id}.json")):
+                continue
+            languages = entry.get("languages")
+            conn.execute(
+                "INSERT OR IGNORE INTO documents (doc_id, filename, file_type, content_hash, aliases, languages,"
+                " status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'ready', ?, ?)",
+                (
+                    doc_id, entry["filename"], file_type_of(entry["filename"]), entry["content_hash"],
+                    json.dumps(entry.get("aliases", []), ensure_ascii=False),
+                    json.dumps(languages) if languages is not None else None,
+                    entry.get("created_at", time.time()), time.time(),
+                )
+            )
+        os.replace(self.legacy_manifest_path, f"{self.legacy_manifest_path}.migrated")
+        print(f"[INFO] Migrated {len(entries)} manifest entries to the document catalog")
+
+    def _backfill_from_jsonl(self, conn: sqlite3.Connection) -> None:
+        """為沒有紀錄（或由 manifest 匯入、缺少大小與 chunk 數）的已處理文件補建目錄資料"""
+        if not os.path.isdir(self.jsonl_dir):
+            return
+        known = {row["doc_id"] for row in conn.execute("SELECT doc_id FROM documents WHERE chunk_count IS NOT NULL")}
+        uploads = {}
+        if os.path.isdir(self.upload_dir):
+            for name in os.listdir(self.upload_dir):
+                uploads[name.rpartition(".")[0]] = os.path.join(self.upload_dir, name)
+
+        added = 0
+        for fname in os.listdir(self.jsonl_dir):
+            doc_id = fname[:-len(".json")]
+            if not fname.endswith(".json") or doc_id in known:
+                continue
+            jsonl_path = os.path.join(self.jsonl_dir, fname)
+            try:
+                with open(jsonl_path, "r", encoding="utf-8") as f:
+                    first_line = f.readline()
+                    chunk_count = (1 if first_line.strip() else 0) + sum(1 for line in f if line.strip())
+                filename = json.loads(first_line).get("metadata", {}).get("filename", "unknown") if first_line else "unknown"
+                upload_path = uploads.get(doc_id)
+                size = os.path.getsize(upload_path) if upload_path else None
+                row = conn.execute("SELECT content_hash FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+                if row is not None:
+                    content_hash = row["content_hash"]
+                else:
+                    content_hash = file_sha256(upload_path) if upload_path else None
+            except Exception as e:
+                print(f"[WARNING] Failed to add {fname} to the document catalog: {e}")
+                continue
+            created_at = os.path.getmtime(jsonl_path)
+            conn.execute(
+                "INSERT INTO documents (doc_id, filename, file_type, size_bytes, chunk_count, content_hash,"
+                " status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, 'ready', ?, ?)"
+                " ON CONFLICT (doc_id) DO UPDATE SET size_bytes = excluded.size_bytes, chunk_count = excluded.chunk_count",
+                (doc_id, filename, file_type_of(filename), size, chunk_count, content_hash, created_at, created_at)
+            )
+            added += 1
+        if added:
+            print(f"[INFO] Added {added} previously uploaded documents to the document catalog")
+
+    def _recover_interrupted(self, conn: sqlite3.Connection) -> None:
+        """
+        服務重啟時背景工作已不存在：已寫出 JSONL 的文件視為 ready，
+        其餘（處理到一半）移除紀錄，之後重新上傳相同內容會再處理一次。
+        """
+        rows = conn.execute("SELECT doc_id FROM documents WHERE status = 'processing'").fetchall()
+        for row in rows:
+            if os.path.exists(os.path.join(self.jsonl_dir, f"{row['doc_id']}.json")):
+                conn.execute("UPDATE documents SET status = 'ready' WHERE doc_id = ?", (row["doc_id"],))
+            else:
+                conn.execute("DELETE FROM documents WHERE doc_id = ?", (row["doc_id"],))
+        if rows:
+            print(f"[INFO] Recovered {len(rows)} documents interrupted during processing")
+
+    # ---------- 寫入 ----------
+    def claim(self, doc_id: str, filename: str, content_hash: str, size_bytes: int) -> Optional[str]:
+        """
+        登記新上傳的文件（status = processing）；相同內容已存在時不登記。
+
+        Returns:
+            已存在的 doc_id；成功登記新文件時為 None
+        """
+        with self.transaction() as conn:
+            # 舊資料可能有多份相同內容的文件：沿用最早上傳的那一份
+            row = conn.execute(
+                "SELECT doc_id FROM documents WHERE content_hash = ? ORDER BY created_at, doc_id LIMIT 1",
+                (content_hash,)
+            ).fetchone()
+            if row is not None:
+                return row["doc_id"]
+            now = time.time()
+            conn.execute(
+                "INSERT INTO documents (doc_id, filename, file_type, size_bytes, content_hash, status,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, 'processing', ?, ?)",
+                (doc_id, filename, file_type_of(filename), size_bytes, content_hash, now, now)
+            )
+            return None
+
+    def add_alias(self, doc_id: str, filename: str) -> bool:
+        """記錄重複上傳的檔名；已記錄過（或與原檔名相同）時回傳 False"""
+        with self.transaction() as conn:
+            row = conn.execute("SELECT filename, aliases FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return False
+            aliases = json.loads(row["aliases"])
+            if filename == row["filename"] or filename in aliases:
+                return False
+            aliases.append(filename)
+            conn.execute(
+                "UPDATE documents SET aliases = ?, updated_at = ? WHERE doc_id = ?",
+                (json.dumps(aliases, ensure_ascii=False), time.time(), doc_id)
+            )
+            return True
+
+    def update(self, doc_id: str, **fields: Any) -> None:
+        """
+        更新欄位，例如 update(doc_id, status="ready", chunk_count=12)。
+        languages 可傳入任意可迭代的語言集合。
+        """
+        if "languages" in fields:
+            fields["languages"] = json.dumps(sorted(fields["languages"]))
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        with self.transaction() as conn:
+            conn.execute(f"UPDATE documents SET {assignments} WHERE doc_id = ?", (*fields.values(), doc_id))
+
+    def set_languages(self, doc_id: str, languages: Iterable[str]) -> None:
+        """記錄文件中出現的語言集合（建立索引時用來決定子索引 analyzer）"""
+        self.update(doc_id, languages=languages)
+
+    def remove(self, doc_id: str) -> None:
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+
+    # ---------- 查詢 ----------
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        entry = dict(row)
+        entry["aliases"] = json.loads(entry["aliases"])
+        if entry["languages"] is not None:
+            entry["languages"] = json.loads(entry["languages"])
+        return entry
+
+    def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._reading() as conn:
+            row = conn.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            return self._to_dict(row) if row is not None else None
+
+    def list_documents(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = "created_at",
+        descending: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        依 sort 欄位排序列出文件（sort 需為 SORT_COLUMNS 之一）。
+
+        Args:
+            offset: 略過前幾筆
+            limit: 最多回傳幾筆；None 表示全部
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort field: {sort}")
+        direction = "DESC" if descending else "ASC"
+        with self._reading() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM documents ORDER BY {SORT_COLUMNS[sort]} {direction}, doc_id LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count(self) -> int:
+        with self._reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+
+doc_catalog = DocumentCatalog()
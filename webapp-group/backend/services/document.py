@@ -1,60 +1,39 @@
+import time
 import os
 import json
 import uuid
+import hashlib
 import subprocess
+import threading
 import shutil
-import re # [新增] 用於文字清洗
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
 from fastapi import UploadFile, HTTPException
-from pypdf import PdfReader
-
-LANGUAGE_REGEX = {
-    "zh": re.compile(r"[\u4e00-\u9fff]"),
-    "ja": re.compile(r"[\u3040-\u30ff]"),
-    "ko": re.compile(r"[\uac00-\ud7a3]"),
-    "ru": re.compile(r"[\u0400-\u04ff]"),
-    "ar": re.compile(r"[\u0600-\u06ff]"),
-    "hi": re.compile(r"[\u0900-\u097f]"),
-    "el": re.compile(r"[\u0370-\u03ff]"),
-    "he": re.compile(r"[\u0590-\u05ff]"),
-    "th": re.compile(r"[\u0e00-\u0e7f]"),
-    "en": re.compile(r"[a-zA-Z]"),
-}
-
-
-def _detect_language(text: str) -> str:
-    if not text:
-        return "en"
-    for language, pattern in LANGUAGE_REGEX.items():
-        if pattern.search(text):
-            return language
-    return "en"
-
-
-def _detect_languages_in_text(text: str) -> set:
-    """
-    回傳文字中可能出現的語言集合
-    """
-    if not text:
-        return set()
-
-    langs = set()
-    for language, pattern in LANGUAGE_REGEX.items():
-        if pattern.search(text):
-            langs.add(language)
-    return langs
-
-
-def _choose_index_language(langs: set) -> str:
-    if not langs:
-        return "en"
-    if "zh" in langs and "en" in langs:
-        return "other"
-    if "zh" in langs:
-        return "zh"
-    if "en" in langs:
-        return "en"
-    return next(iter(langs))
+from services.pdf_extract import extract_pdf_text
+from services.chunking import iter_text_chunks, iter_text_file, Utf8Validator
+from services.language_profile import LanguageProfiler
+from services.searcher_pool import (
+    bump_index_generation,
+    analyzer_for_language,
+    subindex_path,
+    list_subindexes,
+    list_shards,
+    shard_for,
+    shard_path,
+    read_index_shards,
+    write_index_shards,
+    DEFAULT_ANALYZER,
+    INDEX_SHARDS,
+    SHARD_PREFIX
+)
+from services.lucene_query import DOC_KEY_FIELD, doc_filter_key
+from services.chunk_store import chunk_store
+from services.doc_catalog import doc_catalog
+from services.bm25_engine import bm25_engine, search_backend, NUMPY_BACKEND
+from services.dense_index import get_dense_index
+from services.metrics import record_stage, track_stage
+from services.ingest_queue import ingest_queue, IngestQueueFull, ACTIVE_STATUSES
 
 # ================= 設定區 =================
 # 取得 backend 的根目錄路徑
@@ -63,52 +42,86 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 資料夾結構配置
 UPLOAD_DIR = os.path.join(BASE_DIR, "data", "uploads")        # 原始檔案存放區
 JSONL_DIR = os.path.join(BASE_DIR, "data", "jsonl")          # 切塊後的 JSONL
-INDEX_DIR = os.path.join(BASE_DIR, "data", "indexes", "lucene-index") # Pyserini 索引位置
+INDEX_DIR = os.path.join(BASE_DIR, "data", "indexes", "lucene-index") # Pyserini 索引位置（每個 analyzer 一個子目錄）
+INDEX_INPUT_DIR = os.path.join(BASE_DIR, "data", "index-input")       # 各子索引的輸入（JSONL hard link）
+
+# 上傳檔案每次讀取 / 寫入的大小（bytes）
+UPLOAD_BLOCK_SIZE = 1 << 20
+# 追加索引時每批送給 LuceneIndexer 的 JSONL 筆數
+INDEX_APPEND_BATCH = 1000
+# 完整重建時可用的索引 thread 總數（由同時建立的 shard 平分）
+INDEX_THREADS = max(1, int(os.getenv("INDEX_THREADS", str(os.cpu_count() or 1))))
 
 # 確保目錄都存在
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(JSONL_DIR, exist_ok=True)
 
+# 所有索引寫入（追加 / 刪除 / 重建 / compaction）互斥，避免兩個 writer 同時改同一個子索引
+_index_lock = threading.RLock()
+
+# 刪除文件後延遲多久在背景回收已刪除文件的空間（秒）；期間的多次刪除只合併一次
+INDEX_COMPACTION_DELAY = float(os.getenv("INDEX_COMPACTION_DELAY", "30"))
+_compaction_timer = None
+_compaction_timer_lock = threading.Lock()
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat() if timestamp is not None else None
+
+
 class DocumentService:
     
-    def list_documents(self) -> List[Dict[str, Any]]:
-        """列出所有已索引的文件"""
+    def list_documents(
+        self,
+        offset: int = 0,
+        limit: Optional[int] = None,
+        sort: str = "created_at",
+        order: str = "asc"
+    ) -> List[Dict[str, Any]]:
+        """
+        列出文件（查詢文件目錄，不讀取 JSONL）；背景處理尚未完成的文件狀態為 processing。
+
+        Args:
+            offset / limit: 分頁
+            sort: 排序欄位（doc_catalog.SORT_COLUMNS 之一）
+            order: asc 或 desc
+        """
         documents = []
-        if not os.path.exists(JSONL_DIR):
-            return documents
-        
-        for filename in os.listdir(JSONL_DIR):
-            if filename.endswith('.json'):
-                filepath = os.path.join(JSONL_DIR, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        first_line = f.readline()
-                        if first_line:
-                            data = json.loads(first_line)
-                            metadata = data.get('metadata', {})
-                            original_filename = metadata.get('filename', 'unknown')
-                            file_ext = original_filename.split('.')[-1].lower() if '.' in original_filename else 'txt'
-                            documents.append({
-                                "id": metadata.get('doc_id'),
-                                "filename": original_filename,
-                                "file_type": file_ext,
-                                "status": "ready"
-                            })
-                except Exception as e:
-                    print(f"[WARNING] Failed to read {filename}: {e}")
-        
+        for entry in doc_catalog.list_documents(offset, limit, sort, descending=order == "desc"):
+            documents.append({
+                "id": entry["doc_id"],
+                "filename": entry["filename"],
+                "file_type": entry["file_type"],
+                "status": entry["status"],
+                "aliases": entry["aliases"],
+                "size_bytes": entry["size_bytes"],
+                "chunk_count": entry["chunk_count"],
+                "languages": entry["languages"],
+                "content_hash": entry["content_hash"],
+                "created_at": _isoformat(entry["created_at"]),
+                "updated_at": _isoformat(entry["updated_at"])
+            })
         return documents
     
     def delete_document(self, doc_id: str) -> bool:
         """刪除文件及其索引"""
+        job = ingest_queue.get(doc_id)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
+            # 背景工作仍在寫入 JSONL / 索引，完成後才能刪除
+            raise HTTPException(status_code=409, detail="Document is still being processed.")
         print(f"[INFO] Deleting document: {doc_id}")
         
+        # 目錄紀錄先刪除並 commit，之後才刪除檔案：刪檔途中失敗時不會留下列在目錄中、內容卻已刪除的文件；
+        # 殘留的 JSONL 會在下次啟動時由 doc_catalog 補回列表，可以再刪除一次
+        doc_catalog.remove(doc_id)
+
         # 1. 刪除 JSONL 檔案
         jsonl_path = os.path.join(JSONL_DIR, f"{doc_id}.json")
         if os.path.exists(jsonl_path):
             os.remove(jsonl_path)
             print(f"[INFO] Removed JSONL: {jsonl_path}")
-        
+        chunk_store.delete_document(doc_id)
+        get_dense_index().delete_document(doc_id)
+
         # 2. 刪除原始檔案 (可能有多種副檔名)
         for ext in ['pdf', 'txt', 'PDF', 'TXT']:
             upload_path = os.path.join(UPLOAD_DIR, f"{doc_id}.{ext}")
@@ -117,23 +130,36 @@ class DocumentService:
                 print(f"[INFO] Removed upload file: {upload_path}")
                 break
         
-        # 3. 重建索引 (如果還有其他文件的話)
+        # 3. 從索引移除 (如果還有其他文件的話)
+        if search_backend() == NUMPY_BACKEND:
+            with _index_lock:
+                if bm25_engine.delete_document(doc_id):
+                    bump_index_generation()
+            self._schedule_compaction()
+            return True
+
         remaining_files = [f for f in os.listdir(JSONL_DIR) if f.endswith('.json')] if os.path.exists(JSONL_DIR) else []
         
         if remaining_files:
-            print(f"[INFO] Rebuilding index with {len(remaining_files)} remaining documents...")
-            self._run_pyserini_indexing()
+            # 以 doc_key 做 delete-by-term，不重建索引；失敗時才退回完整重建
+            if not self._delete_from_index(doc_id):
+                print(f"[INFO] Rebuilding index with {len(remaining_files)} remaining documents...")
+                self._run_pyserini_indexing()
         else:
             # 沒有文件了，刪除索引目錄
-            if os.path.exists(INDEX_DIR):
-                shutil.rmtree(INDEX_DIR)
-                print("[INFO] Removed empty index directory")
+            with _index_lock:
+                shutil.rmtree(INDEX_INPUT_DIR, ignore_errors=True)
+                if os.path.exists(INDEX_DIR):
+                    shutil.rmtree(INDEX_DIR)
+                    print("[INFO] Removed empty index directory")
+                    bump_index_generation()
         
         return True
     
     async def process_upload(self, file: UploadFile) -> Dict[str, Any]:
         """
-        處理上傳流程：存檔 -> 文字提取 -> 智慧分塊 -> 轉JSONL -> 建立索引
+        處理上傳流程：存檔後立即回傳，其餘步驟交給背景 ingestion 工作
+        （文字提取 -> 智慧分塊 -> 轉JSONL -> 建立索引），進度以 get_status 查詢。
         """
         # 1. 產生唯一 ID 與路徑
         doc_id = str(uuid.uuid4())
@@ -141,106 +167,251 @@ class DocumentService:
         file_ext = filename.split(".")[-1].lower()
         save_path = os.path.join(UPLOAD_DIR, f"{doc_id}.{file_ext}")
         
-        # 2. 儲存原始檔案
+        # 2. 儲存原始檔案：分段寫入磁碟並同時計算 hash，不把整個檔案留在記憶體
+        # txt 的 UTF-8 檢查也在同一輪逐段進行，直接在請求內回報錯誤
+        is_pdf = file_ext == "pdf"
+        validator = None if is_pdf else Utf8Validator()
+        hasher = hashlib.sha256()
+        size_bytes = 0
         try:
-            with open(save_path, "wb") as f:
-                content = await file.read()
-                f.write(content)
+            with track_stage("upload", "save"), open(save_path, "wb") as f:
+                while True:
+                    block = await file.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    hasher.update(block)
+                    size_bytes += len(block)
+                    f.write(block)
+                    if validator:
+                        validator.feed(block)
+                if validator:
+                    validator.feed(b"", final=True)
+        except UnicodeDecodeError:
+            os.remove(save_path)
+            raise HTTPException(status_code=400, detail="Only UTF-8 text files are supported.")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"File save failed: {str(e)}")
 
-        # 3. 提取文字 (Extract)
-        text_content = ""
-        if file_ext == "pdf":
-            text_content = self._extract_text_from_pdf(save_path)
-        else:
-            # 預設嘗試用 utf-8 讀取 txt
+        if validator and not validator.has_text:
+            os.remove(save_path)
+            raise HTTPException(status_code=400, detail="File is empty or content is unreadable.")
+        content_hash = hasher.hexdigest()
+
+        # 3. 登記到文件目錄
+        with doc_catalog.transaction():
+            existing_id = doc_catalog.claim(doc_id, filename, content_hash, size_bytes)
+            if existing_id is not None and not self._document_exists(existing_id):
+                # 目錄紀錄已失效（例如處理中途失敗），改為當作新文件處理
+                doc_catalog.remove(existing_id)
+                existing_id = doc_catalog.claim(doc_id, filename, content_hash, size_bytes)
+
+            # 相同內容已上傳過：沿用既有文件，只記錄檔名別名，不重新解析 / 分塊 / 索引
+            if existing_id is not None:
+                doc_catalog.add_alias(existing_id, filename)
+                os.remove(save_path)
+                job = ingest_queue.get(existing_id)
+                print(f"[INFO] {filename} has the same content as document {existing_id}, skipping ingestion")
+                return {
+                    "id": existing_id,
+                    "job_id": existing_id,
+                    "filename": filename,
+                    "content_hash": content_hash,
+                    "status": job["status"] if job is not None else "ready",
+                    "duplicate_of": existing_id,
+                    "message": "Identical content was already uploaded; reusing the existing document."
+                }
+
+        # 4. 目錄紀錄 commit 之後才送出背景工作：交易 rollback 時不會留下找不到紀錄的工作
+        #    佇列已滿時移除剛登記的紀錄與檔案
+        try:
+            ingest_queue.submit(
+                doc_id, filename,
+                lambda report: self._run_ingest(doc_id, filename, save_path, is_pdf, report)
+            )
+        except IngestQueueFull as e:
+            doc_catalog.remove(doc_id)
+            os.remove(save_path)
+            raise HTTPException(status_code=503, detail=str(e))
+        ingest_queue.update(doc_id, content_hash=content_hash)
+
+        return {
+            "id": doc_id,
+            "job_id": doc_id,
+            "filename": filename,
+            "content_hash": content_hash,
+            "status": "processing",
+            "message": "File uploaded. Processing in background; poll /api/document/status/{id} for progress."
+        }
+
+    def _document_exists(self, doc_id: str) -> bool:
+        """文件已處理完成（有 JSONL）、仍在背景處理中，或剛登記、背景工作即將送出"""
+        job = ingest_queue.get(doc_id)
+        if job is not None and job["status"] in ACTIVE_STATUSES:
+            return True
+        if job is None:
+            # 處理失敗的紀錄會被移除、重啟時殘留的 processing 紀錄也已清除，
+            # 所以沒有工作的 processing 紀錄代表 commit 之後、submit 之前
+            entry = doc_catalog.get(doc_id)
+            if entry is not None and entry["status"] == "processing":
+                return True
+        return os.path.exists(os.path.join(JSONL_DIR, f"{doc_id}.json"))
+
+    def _run_ingest(self, doc_id: str, filename: str, save_path: str, is_pdf: bool, report: Callable[..., None]) -> None:
+        """執行 ingestion；失敗時移除已寫出的檔案與目錄紀錄，之後重新上傳相同內容會再處理一次"""
+        try:
+            self._ingest(doc_id, filename, save_path, is_pdf, report)
+        except Exception:
+            # 先刪檔再移除目錄紀錄：殘留的 JSONL 會在下次啟動時被當成已處理完成的文件補回目錄
+            self._discard_partial_ingest(doc_id, save_path)
+            doc_catalog.remove(doc_id)
+            raise
+        doc_catalog.update(doc_id, status="ready")
+
+    def _discard_partial_ingest(self, doc_id: str, save_path: str) -> None:
+        """刪除失敗的 ingestion 已寫出的 JSONL、chunk store、向量與上傳檔；個別刪除失敗只記錄警告"""
+        jsonl_path = os.path.join(JSONL_DIR, f"{doc_id}.json")
+        cleanups = [
+            ("JSONL", lambda: os.path.exists(jsonl_path) and os.remove(jsonl_path)),
+            ("chunk store", lambda: chunk_store.delete_document(doc_id)),
+            ("dense vectors", lambda: get_dense_index().delete_document(doc_id)),
+            ("upload file", lambda: os.path.exists(save_path) and os.remove(save_path)),
+        ]
+        for name, cleanup in cleanups:
             try:
-                text_content = content.decode("utf-8")
-            except UnicodeDecodeError:
-                raise HTTPException(status_code=400, detail="Only UTF-8 text files are supported.")
+                cleanup()
+            except Exception as e:
+                print(f"[WARNING] Failed to remove {name} of failed ingestion {doc_id}: {e}")
+        print(f"[INFO] Removed partial output of failed ingestion {doc_id}")
+
+    def _ingest(
+        self,
+        doc_id: str,
+        filename: str,
+        save_path: str,
+        is_pdf: bool,
+        report: Callable[..., None]
+    ) -> None:
+        """
+        背景 ingestion 工作（在 ingest_queue 的 worker thread 執行）。
 
-        if not text_content.strip():
-            raise HTTPException(status_code=400, detail="File is empty or content is unreadable.")
+        txt 以串流方式逐段讀取、分塊並寫出，記憶體用量與檔案大小無關。
+
+        Args:
+            is_pdf: PDF 先解析全文再分塊；txt 直接從磁碟逐段分塊
+            report: 更新工作進度的 callback
+        """
+        started = time.perf_counter()
+
+        # 3. 提取文字 (Extract)
+        if is_pdf:
+            report(stage="extraction")
+            with track_stage("upload", "extraction"):
+                text_content = self._extract_text_from_pdf(
+                    save_path,
+                    on_page=lambda done, total: report(pages_extracted=done, pages_total=total)
+                )
+            if not text_content.strip():
+                raise ValueError("File is empty or content is unreadable.")
+            text_blocks = [text_content]
+        else:
+            text_blocks = iter_text_file(save_path)
+        # 語言集合在讀取文字時一併計算並存進文件目錄，建立索引時不必再掃描全文
+        profiler = LanguageProfiler()
+        text_blocks = profiler.wrap(text_blocks)
 
         # 4. 內容分塊 (Chunking) - [已升級] 使用滑動視窗
         # chunk_size 設為 500，overlap 設為 100 以確保語意連貫
-        chunks = self._chunk_text(text_content, chunk_size=500, overlap=100)
-
-        # 5. 寫入 JSONL (Prepare for Pyserini) - 檢查 pyserini 是否可用
-        try:
-            import pyserini
-            PYSERINI_AVAILABLE = True
-        except ImportError:
-            PYSERINI_AVAILABLE = False
-            print("[WARNING] Pyserini not available. Indexing will be skipped.")
+        # 5. 寫入 JSONL (Prepare for Pyserini)
+        # 分塊與寫出同時進行：每產生一個 chunk 就寫入 JSONL 與 chunk store
+        report(stage="chunking")
         jsonl_path = os.path.join(JSONL_DIR, f"{doc_id}.json")
         
-        with open(jsonl_path, "w", encoding="utf-8") as f:
-            for idx, chunk in enumerate(chunks):
-                record = {
-                    "id": f"{doc_id}#{idx}",   # 唯一 ID
-                    "contents": chunk,         # 實際內容
-                    "metadata": {              # 後設資料
-                        "doc_id": doc_id,      # 過濾用 ID
-                        "filename": filename,
-                        "chunk_index": idx
+        doc_key = doc_filter_key(doc_id)
+        with track_stage("upload", "chunking"), open(jsonl_path, "w", encoding="utf-8") as f:
+            def write_records():
+                for idx, chunk in enumerate(iter_text_chunks(text_blocks, chunk_size=500, overlap=100)):
+                    record = {
+                        "id": f"{doc_id}#{idx}",   # 唯一 ID
+                        "contents": chunk,         # 實際內容
+                        DOC_KEY_FIELD: doc_key,    # 索引欄位：檢索時以 FILTER 子句限定勾選文件
+                        "metadata": {              # 後設資料
+                            "doc_id": doc_id,      # 過濾用 ID
+                            "filename": filename,
+                            "chunk_index": idx
+                        }
                     }
-                }
-                json.dump(record, f, ensure_ascii=False)
-                f.write("\n") # JSONL 格式要求每筆資料換行
-
-        # 6. 索引更新時需檢查 pyserini 是否可用
-        try:
-            import pyserini
-            PYSERINI_AVAILABLE = True
-        except (ImportError, Exception):
-            PYSERINI_AVAILABLE = False
-            print("[WARNING] Pyserini not available. Indexing will be skipped.")
+                    json.dump(record, f, ensure_ascii=False)
+                    f.write("\n") # JSONL 格式要求每筆資料換行
+                    if idx % 100 == 99:
+                        report(chunks_written=idx + 1)
+                    yield chunk
+
+            # 檢索時的原文來源（mmap chunk store），索引不再保存 raw JSON
+            # 啟用 dense 檢索時同時逐批編碼 chunk 向量（第 i 列對應 doc_id#i）
+            records = write_records()
+            dense_index = get_dense_index()
+            vector_writer = dense_index.writer(doc_id) if dense_index.enabled else None
+            if vector_writer is not None:
+                records = vector_writer.wrap(records)
+            chunks_count = chunk_store.write_document(doc_id, filename, records)
+        report(chunks_written=chunks_count)
+        if vector_writer is not None:
+            report(stage="embedding")
+            with track_stage("upload", "embedding"):
+                vector_writer.commit()
+        doc_catalog.update(doc_id, chunk_count=chunks_count, languages=profiler.languages)
+
+        # 6. 更新檢索索引：Lucene（需要 pyserini / Java）或程式內的 NumPy BM25 引擎
+        backend = search_backend()
+        if backend is None:
+            print("[WARNING] No search backend available (Pyserini or NumPy missing). Indexing will be skipped.")
         
-        if PYSERINI_AVAILABLE:
-            index_success = self._run_pyserini_indexing()
-            if not index_success:
+        if backend is not None:
+            # 只把新文件追加到既有子索引，耗時只與新文件大小有關
+            report(stage="indexing", indexing="running")
+            with track_stage("upload", "indexing"):
+                if backend == NUMPY_BACKEND:
+                    index_success = self._index_document_bm25(doc_id)
+                else:
+                    index_success = self._index_document(doc_id)
+            if index_success:
+                report(indexing="done")
+            else:
                 print("[WARNING] Indexing failed, but file upload succeeded.")
+                report(indexing="failed")
         else:
-            print("[INFO] Skipping indexing (Pyserini not available). File uploaded successfully.")
+            print("[INFO] Skipping indexing (no search backend available). File uploaded successfully.")
+            report(indexing="skipped")
+        record_stage("upload", "total", time.perf_counter() - started)
+        print(f"[INFO] Ingestion finished for {filename} ({doc_id}): {chunks_count} chunks")
 
-        return {
-            "id": doc_id,
-            "filename": filename,
-            "chunks_count": len(chunks),
-            "status": "ready",
-            "message": "File processed and indexed successfully."
-        }
+    def get_status(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查詢文件處理進度。
 
-    def _extract_text_from_pdf(self, path: str) -> str:
+        Returns:
+            ingestion 工作狀態；工作紀錄已過期（或服務重啟）但文件已處理完成時回傳 ready；
+            找不到文件時為 None
+        """
+        job = ingest_queue.get(doc_id)
+        if job is not None:
+            return job
+        entry = doc_catalog.get(doc_id)
+        if entry is not None:
+            return {"id": doc_id, "status": entry["status"], "stage": "done" if entry["status"] == "ready" else entry["status"]}
+        return None
+
+    def _extract_text_from_pdf(self, path: str, on_page: Optional[Callable[[int, int], None]] = None) -> str:
         """
         [強力清洗版] 使用 pypdf 讀取 PDF 並修復破碎單字
+
+        頁面依範圍分給 process pool 平行解析（見 services/pdf_extract.py），結果維持原頁序。
+
+        Args:
+            on_page: 每處理完一段頁面呼叫 on_page(已處理頁數, 總頁數)
         """
-        full_text = []
         try:
-            reader = PdfReader(path)
-            for page in reader.pages:
-                text = page.extract_text()
-                if text:
-                    # [清洗步驟]
-                    
-                    # 1. 先把換行轉成空白，避免句子因為排版換行被截斷
-                    text = text.replace('\n', ' ')
-                    
-                    # 2. [關鍵修復] 修復破碎單字 (例如: S t r u c t u r e -> Structure)
-                    # 邏輯：如果一個字母 (\w) 後面接空白 (\s+)，且再後面還是字母 (?=\w)，就把中間的空白拿掉
-                    # 注意：這是一個 Trade-off，可能會把 "I am" 變成 "Iam"，
-                    # 但對於解決 "S t r u c t u r e" 這種無法搜尋的問題至關重要。
-                    text = re.sub(r'(\w)\s+(?=\w)', r'\1', text)
-                    
-                    # 3. 清理多餘空白 (經過上面處理後，可能還有多餘的連續空白，縮減成一個)
-                    text = re.sub(r'\s+', ' ', text)
-
-                    full_text.append(text)
-            
-            # 用雙換行連接每一頁
-            return "\n\n".join(full_text)
+            return extract_pdf_text(path, on_page=on_page)
         except Exception as e:
             print(f"[ERROR] PDF Extract error: {e}")
             return ""
@@ -254,158 +425,378 @@ class DocumentService:
         滑動視窗能確保：
         1. 每一段都有足夠的重疊 (overlap)，避免語意被切斷。
         2. 嘗試尋找句號切分，讓段落更自然。
+
+        實作見 services/chunking.py 的 iter_text_chunks（可逐段輸入，上傳流程以串流方式使用）。
         """
-        if not text:
-            return []
-            
-        chunks = []
-        start = 0
-        text_len = len(text)
-        
-        while start < text_len:
-            # 1. 預設切分點
-            end = min(start + chunk_size, text_len)
-            
-            # 2. 優化切分點：不要切在句子中間
-            if end < text_len:
-                # 往後偷看 50 個字，找有沒有句號或空白
-                look_ahead_buffer = text[end:min(end + 50, text_len)]
-                
-                # 定義句子結束符號 (中文句號優先，再來是英文句號、問號等)
-                sentence_endings = ["。", "！", "？", ".", "!", "?", "\n"]
-                
-                found_cut_point = False
-                for char in sentence_endings:
-                    if char in look_ahead_buffer:
-                        # 找到結束符號，把 end 延伸到該符號之後
-                        end += (look_ahead_buffer.index(char) + 1)
-                        found_cut_point = True
-                        break
-                
-                # 如果沒找到標點，退而求其次找空白鍵 (避免切斷單字)
-                if not found_cut_point and " " in look_ahead_buffer:
-                     end += (look_ahead_buffer.index(" ") + 1)
-
-            # 3. 取出 chunk
-            chunk = text[start:end]
-            if chunk.strip(): # 避免存入空字串
-                chunks.append(chunk.strip())
-            
-            # 4. 移動視窗 (Sliding)
-            # 確保有 overlap，讓上一段的結尾重複出現在下一段的開頭
-            start += (chunk_size - overlap)
-            
-            # 防止無窮迴圈
-            if start >= end:
-                start = end
-            
-        return chunks
+        return list(iter_text_chunks([text], chunk_size=chunk_size, overlap=overlap))
 
-    
-    def _run_pyserini_indexing(self) -> bool:
-        """        Rebuild (or build) the Lucene index from JSONL chunks using Pyserini.
+    def _ensure_doc_filter_keys(self) -> None:
+        """
+        為舊版（沒有 doc_key 欄位）的 JSONL 檔補上過濾欄位。
+        只檢查第一行，已含 doc_key 的檔案不會被改寫。
+        """
+        if not os.path.exists(JSONL_DIR):
+            return
+        for fname in os.listdir(JSONL_DIR):
+            if not fname.endswith(".json"):
+                continue
+            fp = os.path.join(JSONL_DIR, fname)
+            try:
+                with open(fp, "r", encoding="utf-8") as fh:
+                    first_line = fh.readline()
+                if not first_line or DOC_KEY_FIELD in json.loads(first_line):
+                    continue
+
+                with open(fp, "r", encoding="utf-8") as fh:
+                    records = [json.loads(line) for line in fh if line.strip()]
+                # 暫存檔放在 JSONL_DIR 之外，避免被 JsonCollection 一起讀進索引
+                tmp_path = os.path.join(os.path.dirname(JSONL_DIR), f"{fname}.tmp")
+                with open(tmp_path, "w", encoding="utf-8") as fh:
+                    for rec in records:
+                        doc_id = rec.get("metadata", {}).get("doc_id") or fname[:-len(".json")]
+                        rec[DOC_KEY_FIELD] = doc_filter_key(doc_id)
+                        json.dump(rec, fh, ensure_ascii=False)
+                        fh.write("\n")
+                os.replace(tmp_path, fp)
+                print(f"[INFO] Added {DOC_KEY_FIELD} field to {fname}")
+            except Exception as e:
+                print(f"[WARNING] Failed to add {DOC_KEY_FIELD} to {fname}: {e}")
 
-        Key fixes:
-        - Use *the current interpreter* (sys.executable) so the venv-installed pyserini is found.
-          (Your log shows it was calling the system Python -> ModuleNotFoundError: pyserini)
-        - Auto-detect language across **all** documents/chunks.
-          * If both Chinese and English are detected => use 'other' analyzer (mixed-language).
-          * If only one language is detected => use that language analyzer.
-          * If detection fails => fall back to default analyzer.
-        - Try a small analyzer fallback chain to be robust.
+    def _detect_document_languages(self, jsonl_path: str) -> set:
+        """回傳單一 JSONL 文件中出現的語言集合"""
+        profiler = LanguageProfiler()
+        with open(jsonl_path, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                profiler.update(rec.get("contents", "") or "")
+                if profiler.complete:
+                    break
+        return profiler.languages
+
+    def _document_analyzers(self, fname: str) -> set:
         """
-        import sys
+        回傳文件要寫入的子索引 analyzer 集合（偵測不到語言時使用預設 analyzer）。
 
-        # ---------- 1) Detect index language over ALL jsonl files ----------
-        languages_found = set()
-        try:
-            if os.path.exists(JSONL_DIR):
-                for fname in os.listdir(JSONL_DIR):
-                    if not fname.endswith(".json"):
-                        continue
-                    fp = os.path.join(JSONL_DIR, fname)
-                    with open(fp, "r", encoding="utf-8") as fh:
-                        for line in fh:
-                            try:
-                                rec = json.loads(line)
-                            except json.JSONDecodeError:
-                                continue
-                            contents = rec.get("contents", "") or ""
-                            lang = _detect_language(contents)
-                            if lang:
-                                languages_found.add(lang)
-                            # early stop if mixed already
-                            if "zh" in languages_found and "en" in languages_found:
-                                raise StopIteration
-        except StopIteration:
-            pass
-        except Exception as e:
-            print(f"[WARNING] Language detection failed, will fall back to default analyzer: {e}")
-            languages_found = set()
-
-        # normalize: only keep analyzers we intend to use
-        # pyserini supports many, but for our use we mainly care about zh/en/other.
-        if "zh" in languages_found and "en" in languages_found:
-            detected = "other"   # mixed-language documents
-        elif "zh" in languages_found:
-            detected = "zh"
-        elif "en" in languages_found:
-            detected = "en"
+        語言集合在上傳時已存進文件目錄；舊版文件第一次用到時才掃描 JSONL 並補存。
+        """
+        doc_id = fname[:-len(".json")]
+        entry = doc_catalog.get(doc_id)
+        if entry is not None and entry["languages"] is not None:
+            languages = set(entry["languages"])
         else:
-            detected = "default"
-
-        # ---------- 2) Build base command ----------
-        # IMPORTANT: use sys.executable (venv python) instead of plain "python"
-        base_cmd = [
-            sys.executable, "-m", "pyserini.index.lucene",
-            "--collection", "JsonCollection",
-            "--input", "data/jsonl",
-            "--index", "data/indexes/lucene-index",
-            "--generator", "DefaultLuceneDocumentGenerator",
-            "--threads", "1",
-            "--storePositions", "--storeDocvectors", "--storeRaw",
-        ]
+            try:
+                languages = self._detect_document_languages(os.path.join(JSONL_DIR, fname))
+                doc_catalog.set_languages(doc_id, languages)
+            except Exception as e:
+                print(f"[WARNING] Language detection failed for {fname}, using default analyzer: {e}")
+                languages = set()
+        return {analyzer_for_language(lang) for lang in languages} or {DEFAULT_ANALYZER}
 
-        # ---------- 3) Analyzer fallback chain ----------
-        # 'default' means: do NOT pass --language at all (let Lucene default analyzer decide)
-        analyzer_candidates = []
-        if detected == "default":
-            analyzer_candidates = ["default", "en", "other"]
-        elif detected == "other":
-            analyzer_candidates = ["other", "zh", "en", "default"]
-        else:
-            # single-language index
-            analyzer_candidates = [detected, "other", "default"]
+    def _index_document(self, doc_id: str) -> bool:
+        """
+        將單一文件的 chunks 追加到既有子索引，不重新處理其他文件。
 
-        print(f"[INFO] Starting Indexing... Target: {JSONL_DIR}")
-        print(f"[INFO] Languages found: {sorted(languages_found) if languages_found else 'N/A'}")
-        print(f"[INFO] Detected analyzer: {detected}")
+        Lucene 會把每次追加寫成新的 segment，並由 merge policy 在背景合併。
+        還沒有子索引、但已有其他文件（例如舊版單一索引）時，改為完整重建；
+        追加失敗時也會退回完整重建。
+        """
+        fname = f"{doc_id}.json"
+        with _index_lock:
+            other_documents = [f for f in os.listdir(JSONL_DIR) if f.endswith(".json") and f != fname]
+            if other_documents and not list_subindexes(INDEX_DIR):
+                print("[INFO] No per-analyzer sub-indexes yet. Rebuilding all sub-indexes...")
+                return self._run_pyserini_indexing()
+            if read_index_shards() != INDEX_SHARDS:
+                if other_documents:
+                    print(f"[INFO] INDEX_SHARDS changed to {INDEX_SHARDS}. Rebuilding all sub-indexes...")
+                    return self._run_pyserini_indexing()
+                # 沒有其他文件：直接以新的 shard 數建立索引
+                shutil.rmtree(INDEX_DIR, ignore_errors=True)
+                write_index_shards(INDEX_SHARDS)
+
+            jsonl_path = os.path.join(JSONL_DIR, fname)
+            analyzers = sorted(self._document_analyzers(fname))
+            try:
+                for analyzer in analyzers:
+                    appended = self._append_to_subindex(analyzer, doc_id, jsonl_path)
+            except Exception as e:
+                print(f"[WARNING] Incremental indexing failed, rebuilding all sub-indexes: {e}")
+                return self._run_pyserini_indexing()
 
-        last_err = ""
-        for analyzer in analyzer_candidates:
-            cmd = list(base_cmd)
-            if analyzer != "default":
-                cmd += ["--language", analyzer]
+            print(f"[INFO] Appended {appended} chunks of {doc_id} to sub-indexes {analyzers}")
+            bump_index_generation()
+            return True
 
-            print(f"[INFO] Indexing with language analyzer: {analyzer if analyzer != 'default' else '(auto/default)'}")
+    def _index_document_bm25(self, doc_id: str) -> bool:
+        """將文件寫入 NumPy BM25 引擎（寫入 segment 後重新合併）"""
+        with _index_lock:
             try:
-                result = subprocess.run(cmd, capture_output=True, text=True, cwd=BASE_DIR)
+                bm25_engine.add_document(doc_id, os.path.join(JSONL_DIR, f"{doc_id}.json"))
+            except Exception as e:
+                print(f"[ERROR] BM25 engine indexing failed for {doc_id}: {e}")
+                return False
+            bump_index_generation()
+            return True
+
+    def _append_to_subindex(self, analyzer: str, doc_id: str, jsonl_path: str) -> int:
+        """
+        以與 _build_subindex 相同的設定，把 JSONL 記錄追加到文件所屬的子索引 shard（不存在時建立）。
+        每次送出 INDEX_APPEND_BATCH 筆，大文件不必一次載入記憶體。回傳追加的筆數。
+        """
+        from pyserini.index.lucene import LuceneIndexer
 
-                if result.returncode == 0:
-                    print("[INFO] Indexing Success!")
-                    return True
+        args = [
+            "-index", shard_path(analyzer, shard_for(doc_id), INDEX_SHARDS, INDEX_DIR),
+            "-storePositions", "-storeDocvectors",
+        ]
+        if analyzer != DEFAULT_ANALYZER:
+            args += ["-language", analyzer]
+        indexer = LuceneIndexer(args=args, append=True, threads=1)
+        appended = 0
+        try:
+            with open(jsonl_path, "r", encoding="utf-8") as fh:
+                batch = []
+                for line in fh:
+                    if line.strip():
+                        batch.append(line.strip())
+                    if len(batch) >= INDEX_APPEND_BATCH:
+                        indexer.add_batch_raw(batch)
+                        appended += len(batch)
+                        batch = []
+                if batch:
+                    indexer.add_batch_raw(batch)
+                    appended += len(batch)
+            return appended
+        finally:
+            # close() 會 commit，之後新開的 Searcher 才看得到新 segment
+            indexer.close()
+
+    def _delete_from_index(self, doc_id: str) -> bool:
+        """
+        從所有子索引刪除文件的 chunks（delete-by-term on doc_key）。
 
-                # show stderr for debugging, but keep going
-                last_err = (result.stderr or result.stdout or "").strip()
-                print("[WARNING] Indexing attempt failed. Trying next analyzer...")
-                if last_err:
-                    print(last_err[:2000])
+        只標記刪除並 commit，通常在毫秒內完成；空間由背景 compaction 回收。
+        """
+        from services.lucene_writer import delete_by_terms
 
+        with _index_lock:
+            analyzers = list_subindexes(INDEX_DIR)
+            if not analyzers:
+                return False
+            try:
+                for analyzer in analyzers:
+                    for path in list_shards(analyzer, INDEX_DIR):
+                        delete_by_terms(path, DOC_KEY_FIELD, [doc_filter_key(doc_id)])
             except Exception as e:
-                last_err = str(e)
-                print(f"[WARNING] Subprocess error: {e}. Trying next analyzer...")
+                print(f"[WARNING] Delete-by-term failed for {doc_id}: {e}")
+                return False
+            print(f"[INFO] Deleted {doc_id} from sub-indexes {analyzers}")
+            bump_index_generation()
+
+        self._schedule_compaction()
+        return True
 
-        print("[ERROR] Indexing Failed after fallbacks:")
+    def _schedule_compaction(self) -> None:
+        """延遲 INDEX_COMPACTION_DELAY 秒後在背景執行 compaction（重複呼叫會重新計時）"""
+        global _compaction_timer
+        with _compaction_timer_lock:
+            if _compaction_timer is not None:
+                _compaction_timer.cancel()
+            _compaction_timer = threading.Timer(INDEX_COMPACTION_DELAY, self._compact_index)
+            _compaction_timer.daemon = True
+            _compaction_timer.start()
+
+    def _compact_index(self) -> None:
+        """合併含有已刪除文件的 segment"""
+        if search_backend() == NUMPY_BACKEND:
+            with _index_lock:
+                try:
+                    if bm25_engine.compact():
+                        bump_index_generation()
+                except Exception as e:
+                    print(f"[WARNING] Compaction of the BM25 engine index failed: {e}")
+            return
+
+        from services.lucene_writer import compact_index
+
+        with _index_lock:
+            compacted = []
+            for analyzer in list_subindexes(INDEX_DIR):
+                for path in list_shards(analyzer, INDEX_DIR):
+                    try:
+                        if compact_index(path):
+                            compacted.append(os.path.relpath(path, INDEX_DIR))
+                    except Exception as e:
+                        print(f"[WARNING] Compaction of '{os.path.relpath(path, INDEX_DIR)}' failed: {e}")
+            if compacted:
+                print(f"[INFO] Compacted sub-indexes {compacted}")
+                bump_index_generation()
+
+    def _run_pyserini_indexing(self) -> bool:
+        """
+        Rebuild (or build) the Lucene sub-indexes from JSONL chunks using Pyserini.
+
+        - One sub-index per analyzer: data/indexes/lucene-index/<analyzer>/
+          Each document goes into the sub-index of every language detected in it
+          (e.g. a mixed Chinese/English document is indexed by both 'zh' and 'en').
+          chat_service sends each query to the matching sub-indexes in parallel
+          instead of retrying analyzers one after another.
+        - Use *the current interpreter* (sys.executable) so the venv-installed pyserini is found.
+        """
+        with _index_lock:
+            return self._rebuild_all_subindexes()
+
+    def _rebuild_all_subindexes(self) -> bool:
+        # ---------- 0) 舊版 JSONL 補上 doc_key 過濾欄位 ----------
+        self._ensure_doc_filter_keys()
+        shutil.rmtree(INDEX_INPUT_DIR, ignore_errors=True)
+
+        # ---------- 1) Detect languages per document ----------
+        files_by_analyzer: Dict[str, List[str]] = {}
+        if os.path.exists(JSONL_DIR):
+            for fname in sorted(os.listdir(JSONL_DIR)):
+                if not fname.endswith(".json"):
+                    continue
+                for analyzer in self._document_analyzers(fname):
+                    files_by_analyzer.setdefault(analyzer, []).append(fname)
+
+        print(f"[INFO] Starting Indexing... Target: {JSONL_DIR}")
+        print(f"[INFO] Sub-indexes: { {a: len(f) for a, f in sorted(files_by_analyzer.items())} }")
+
+        # ---------- 2) Build every (analyzer, shard) in parallel ----------
+        # 文件依 doc_id hash 分到 INDEX_SHARDS 個 shard；各 shard 各自一個索引程序，
+        # INDEX_THREADS 由同時執行的程序平分
+        builds = []
+        for analyzer, fnames in sorted(files_by_analyzer.items()):
+            by_shard: Dict[int, List[str]] = {}
+            for fname in fnames:
+                by_shard.setdefault(shard_for(fname[:-len(".json")]), []).append(fname)
+            for shard, shard_fnames in sorted(by_shard.items()):
+                builds.append((analyzer, shard_path(analyzer, shard, INDEX_SHARDS, INDEX_DIR), shard_fnames))
+
+        workers = max(1, min(len(builds), INDEX_THREADS))
+        threads = max(1, INDEX_THREADS // workers)
+        print(f"[INFO] Building {len(builds)} index shard(s) with {workers} parallel build(s) x {threads} thread(s)")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="index-build") as executor:
+            results = list(executor.map(lambda build: self._build_subindex(*build, threads=threads), builds))
+        success = all(results)
+        failed_analyzers = {analyzer for (analyzer, _, _), ok in zip(builds, results) if not ok}
+
+        # ---------- 3) Remove stale shards (layout changed or shard no longer has documents) ----------
+        built_paths = {path for _, path, _ in builds}
+        for analyzer in files_by_analyzer:
+            base = subindex_path(analyzer, INDEX_DIR)
+            if analyzer in failed_analyzers or not os.path.isdir(base):
+                continue
+            for name in os.listdir(base):
+                path = os.path.join(base, name)
+                if INDEX_SHARDS > 1:
+                    # 切分後子索引目錄只保留本次建立的 shard（移除未切分時的索引檔）
+                    stale = path not in built_paths
+                else:
+                    stale = name.startswith(SHARD_PREFIX)
+                if stale:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+        write_index_shards(INDEX_SHARDS)
+
+        # ---------- 4) Remove stale sub-indexes (and the legacy single index files) ----------
+        if os.path.exists(INDEX_DIR):
+            for name in os.listdir(INDEX_DIR):
+                if name in files_by_analyzer:
+                    continue
+                stale_path = os.path.join(INDEX_DIR, name)
+                if os.path.isdir(stale_path):
+                    shutil.rmtree(stale_path, ignore_errors=True)
+                else:
+                    os.remove(stale_path)
+                print(f"[INFO] Removed stale index entry: {name}")
+
+        # 通知 chat_service 的 Searcher 池改用新索引
+        bump_index_generation()
+        return success
+
+    def _build_subindex(self, analyzer: str, index_path: str, fnames: List[str], threads: int = 1) -> bool:
+        """以指定 analyzer 為一組 JSONL 檔建立子索引（或子索引的一個 shard）"""
+        import sys
+
+        # 子索引的輸入目錄：以 hard link 指向 JSONL 檔，不複製內容
+        name = os.path.relpath(index_path, INDEX_DIR)
+        input_dir = os.path.join(INDEX_INPUT_DIR, name)
+        shutil.rmtree(input_dir, ignore_errors=True)
+        os.makedirs(input_dir, exist_ok=True)
+        for fname in fnames:
+            src = os.path.join(JSONL_DIR, fname)
+            dst = os.path.join(input_dir, fname)
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copyfile(src, dst)
+
+        # IMPORTANT: use sys.executable (venv python) instead of plain "python"
+        cmd = [
+            sys.executable, "-m", "pyserini.index.lucene",
+            "--collection", "JsonCollection",
+            "--input", input_dir,
+            "--index", index_path,
+            "--generator", "DefaultLuceneDocumentGenerator",
+            "--threads", str(threads),
+            "--storePositions", "--storeDocvectors",
+        ]
+        # DEFAULT_ANALYZER 不傳 --language（使用 Anserini 預設英文 analyzer）
+        if analyzer != DEFAULT_ANALYZER:
+            cmd += ["--language", analyzer]
+
+        print(f"[INFO] Indexing {len(fnames)} documents into sub-index '{name}'")
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=BASE_DIR)
+            if result.returncode == 0:
+                print(f"[INFO] Indexing Success! ({name})")
+                return True
+            last_err = (result.stderr or result.stdout or "").strip()
+        except Exception as e:
+            last_err = str(e)
+
+        print(f"[ERROR] Indexing sub-index '{name}' failed:")
         if last_err:
             print(last_err[:4000])
-        return False
\ No newline at end of file
+        return False
+
+    def ensure_index_layout(self) -> None:
+        """
+        啟動時檢查索引格式：有文件但沒有任何子索引（例如舊版單一索引），
+        或 shard 數與 INDEX_SHARDS 不同時重建一次。
+
+        使用 NumPy BM25 引擎時改為同步引擎的 segment，並移除不再更新的 Lucene 索引
+        （之後切回 Lucene 時會因為沒有子索引而完整重建）。
+        啟用 dense 檢索時也補建缺少的 chunk 向量。
+        """
+        try:
+            get_dense_index().sync(JSONL_DIR)
+        except Exception as e:
+            print(f"[WARNING] Dense vector sync failed: {e}")
+        backend = search_backend()
+        if backend == NUMPY_BACKEND:
+            with _index_lock:
+                changed = bm25_engine.sync(JSONL_DIR)
+                if os.path.exists(INDEX_DIR):
+                    shutil.rmtree(INDEX_DIR, ignore_errors=True)
+                    print("[INFO] Removed Lucene index (SEARCH_BACKEND uses the NumPy BM25 engine)")
+                    changed = True
+                if changed:
+                    bump_index_generation()
+            return
+        if backend is None:
+            return
+        has_documents = os.path.exists(JSONL_DIR) and any(f.endswith(".json") for f in os.listdir(JSONL_DIR))
+        if has_documents and not list_subindexes(INDEX_DIR):
+            print("[INFO] No per-analyzer sub-indexes found. Rebuilding index...")
+            self._run_pyserini_indexing()
+        elif has_documents and read_index_shards() != INDEX_SHARDS:
+            print(f"[INFO] Index has {read_index_shards()} shard(s), INDEX_SHARDS is {INDEX_SHARDS}. Rebuilding index...")
+            self._run_pyserini_indexing()
@@ -1,13 +1,28 @@
+import asyncio
 import os
-import time
 import re
+import time
+from typing import AsyncIterator
 from google import generativeai as genai
 from dotenv import load_dotenv
+from services.metrics import observe_gemini_request, observe_gemini_usage
 
 load_dotenv()
 
 MAX_RETRY = 3
 
+# 同時進行中的 Gemini 請求上限（退避等待期間不佔用名額）
+MAX_CONCURRENT_REQUESTS = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+_request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+# [修正] 定義安全設定為 BLOCK_NONE，在模型初始化時設定
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
 # 初始化 Gemini client
 api_key = os.getenv("GEMINI_API_KEY")
 
@@ -43,6 +58,28 @@ def extract_retry_delay(error: Exception) -> float:
     # 如果找不到，返回 None（表示使用默認退避）
     return None
 
+def _raise_if_blocked(candidate) -> None:
+    """檢查 finish_reason（如果可用），被安全過濾或 recitation 阻擋時拋出 ValueError"""
+    if hasattr(candidate, 'finish_reason'):
+        finish_reason = candidate.finish_reason
+        # finish_reason 可能是數字（1=STOP, 2=MAX_TOKENS, 3=SAFETY, 4=RECITATION）
+        # 或字符串（"SAFETY", "RECITATION" 等）
+        if finish_reason == 3 or (isinstance(finish_reason, str) and "SAFETY" in finish_reason.upper()):
+            raise ValueError("Response was blocked by safety filters.")
+        elif finish_reason == 4 or (isinstance(finish_reason, str) and "RECITATION" in finish_reason.upper()):
+            raise ValueError("Response was blocked due to recitation.")
+
+def _build_model(model: str, temperature: float, max_tokens: int) -> genai.GenerativeModel:
+    # [修正] 在 GenerativeModel 初始化時設定安全設定
+    return genai.GenerativeModel(
+        model_name=model,
+        safety_settings=SAFETY_SETTINGS,
+        generation_config={
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+        }
+    )
+
 async def call_gemini(
     system_prompt: str,
     user_prompt: str,
@@ -66,6 +103,25 @@ async def call_gemini(
     Raises:
         Exception: If all retry attempts fail
     """
+    started = time.perf_counter()
+    stats = {"retries": 0}
+    try:
+        content = await _call_gemini_with_retry(system_prompt, user_prompt, temperature, max_tokens, model, stats)
+    except Exception:
+        observe_gemini_request("call", "error", time.perf_counter() - started, stats["retries"])
+        raise
+    observe_gemini_request("call", "ok", time.perf_counter() - started, stats["retries"])
+    return content
+
+async def _call_gemini_with_retry(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    model: str,
+    stats: dict
+) -> str:
+    """call_gemini 的重試迴圈；stats["retries"] 記錄已重試次數"""
     if not api_key:
         raise Exception("GEMINI_API_KEY is not configured")
     
@@ -74,43 +130,22 @@ async def call_gemini(
     combined_prompt = f"{system_prompt}\n\n{user_prompt}"
     
     last_error = None
-
-    # [修正] 定義安全設定為 BLOCK_NONE，在模型初始化時設定
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
     
     for attempt in range(MAX_RETRY):
+        stats["retries"] = attempt
         try:
-            # [修正] 在 GenerativeModel 初始化時設定安全設定
-            model_instance = genai.GenerativeModel(
-                model_name=model,
-                safety_settings=safety_settings,
-                generation_config={
-                    "temperature": temperature,
-                    "max_output_tokens": max_tokens,
-                }
-            )
+            model_instance = _build_model(model, temperature, max_tokens)
             
-            response = model_instance.generate_content(combined_prompt)
+            # 使用 SDK 的非同步 API，等待回應期間不會卡住 event loop
+            async with _request_slots:
+                response = await model_instance.generate_content_async(combined_prompt)
             
             # [修正] 正確檢查響應
             if not response.candidates:
                 raise ValueError("Response was blocked: no candidates returned")
             
             # 檢查 finish_reason（如果可用）
-            candidate = response.candidates[0]
-            if hasattr(candidate, 'finish_reason'):
-                finish_reason = candidate.finish_reason
-                # finish_reason 可能是數字（1=STOP, 2=MAX_TOKENS, 3=SAFETY, 4=RECITATION）
-                # 或字符串（"SAFETY", "RECITATION" 等）
-                if finish_reason == 3 or (isinstance(finish_reason, str) and "SAFETY" in finish_reason.upper()):
-                    raise ValueError("Response was blocked by safety filters.")
-                elif finish_reason == 4 or (isinstance(finish_reason, str) and "RECITATION" in finish_reason.upper()):
-                    raise ValueError("Response was blocked due to recitation.")
+            _raise_if_blocked(response.candidates[0])
             
             # 嘗試讀取內容
             try:
@@ -125,6 +160,7 @@ async def call_gemini(
             if not content:
                 raise ValueError("Empty response from Gemini API")
             
+            observe_gemini_usage("call", combined_prompt, len(content), getattr(response, "usage_metadata", None))
             return content
             
         except ValueError as e:
@@ -148,7 +184,7 @@ async def call_gemini(
             if attempt < MAX_RETRY - 1:
                 wait_time = (2 ** attempt)
                 print(f"[INFO] Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
+                await asyncio.sleep(wait_time)
                 
         except Exception as e:
             last_error = e
@@ -163,12 +199,12 @@ async def call_gemini(
                     # 使用 API 建議的延遲時間
                     print(f"[INFO] Quota limit reached. Waiting {retry_delay:.1f} seconds before retry...")
                     if attempt < MAX_RETRY - 1:
-                        time.sleep(retry_delay)
+                        await asyncio.sleep(retry_delay)
                 else:
                     # 如果無法提取延遲時間，使用較長的固定等待時間（60秒）
                     print(f"[INFO] Quota limit reached. Waiting 60 seconds before retry...")
                     if attempt < MAX_RETRY - 1:
-                        time.sleep(60)
+                        await asyncio.sleep(60)
                 
                 # 如果是配額錯誤且已經是最後一次嘗試，直接拋出更明確的錯誤
                 if attempt == MAX_RETRY - 1:
@@ -183,8 +219,109 @@ async def call_gemini(
                 if attempt < MAX_RETRY - 1:
                     wait_time = (2 ** attempt)
                     print(f"[INFO] Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
+                    await asyncio.sleep(wait_time)
     
     # If all retries failed, raise the last error
     raise Exception(f"Gemini API call failed after {MAX_RETRY} attempts: {str(last_error)}")
 
+
+async def stream_gemini(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float = 0.0,
+    max_tokens: int = 500,
+    model: str = "gemini-2.5-flash"
+) -> AsyncIterator[str]:
+    """
+    以串流方式呼叫 Gemini API，逐段 yield 生成的文字
+    
+    只有在尚未輸出任何文字前才會重試；一旦開始輸出，中途失敗會直接拋出例外，
+    避免同一段回答被重複送出。
+    
+    Args:
+        system_prompt: System instruction
+        user_prompt: User message
+        temperature: Sampling temperature (0.0-1.0)
+        max_tokens: Maximum output tokens
+        model: Gemini model name
+        
+    Yields:
+        Generated text fragments
+        
+    Raises:
+        Exception: If all retry attempts fail or the stream breaks mid-way
+    """
+    started = time.perf_counter()
+    stats = {"retries": 0}
+    outcome = "error"
+    stream = _stream_gemini_with_retry(system_prompt, user_prompt, temperature, max_tokens, model, stats)
+    try:
+        async for text in stream:
+            yield text
+        outcome = "ok"
+    except GeneratorExit:
+        # 呼叫端提前結束（例如回答達到字數上限）
+        outcome = "closed"
+        raise
+    finally:
+        # 立即關閉內層 generator，釋放 _request_slots 名額
+        await stream.aclose()
+        observe_gemini_request("stream", outcome, time.perf_counter() - started, stats["retries"])
+
+async def _stream_gemini_with_retry(
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    max_tokens: int,
+    model: str,
+    stats: dict
+) -> AsyncIterator[str]:
+    """stream_gemini 的重試迴圈；stats["retries"] 記錄已重試次數"""
+    if not api_key:
+        raise Exception("GEMINI_API_KEY is not configured")
+    
+    combined_prompt = f"{system_prompt}\n\n{user_prompt}"
+    last_error = None
+    
+    for attempt in range(MAX_RETRY):
+        stats["retries"] = attempt
+        emitted = False
+        output_chars = 0
+        try:
+            model_instance = _build_model(model, temperature, max_tokens)
+            async with _request_slots:
+                response = await model_instance.generate_content_async(combined_prompt, stream=True)
+                
+                async for chunk in response:
+                    if chunk.candidates:
+                        _raise_if_blocked(chunk.candidates[0])
+                    try:
+                        text = chunk.text
+                    except (ValueError, AttributeError):
+                        # 沒有文字的片段（例如只帶 finish_reason）
+                        continue
+                    if text:
+                        emitted = True
+                        output_chars += len(text)
+                        yield text
+            
+            if not emitted:
+                raise ValueError("Empty response from Gemini API")
+            observe_gemini_usage("stream", combined_prompt, output_chars, getattr(response, "usage_metadata", None))
+            return
+            
+        except Exception as e:
+            # 已輸出部分內容、或被安全過濾阻擋（相同輸入會再次被阻擋）時不重試
+            if emitted or "blocked" in str(e).lower():
+                raise
+            last_error = e
+            print(f"[ERROR] Gemini stream failed (attempt {attempt + 1}/{MAX_RETRY}): {e}")
+            
+            if attempt < MAX_RETRY - 1:
+                wait_time = extract_retry_delay(e) if is_quota_error(e) else None
+                if wait_time is None:
+                    wait_time = 60 if is_quota_error(e) else (2 ** attempt)
+                print(f"[INFO] Retrying in {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+    
+    raise Exception(f"Gemini API stream failed after {MAX_RETRY} attempts: {str(last_error)}")
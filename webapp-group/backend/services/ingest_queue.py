@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# ================= 設定區 =================
+# 同時執行的 ingestion 工作數（PDF 解析、分塊、索引）
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# 排隊 + 執行中的工作上限；超過時拒絕新的上傳
+INGEST_QUEUE_LIMIT = int(os.getenv("INGEST_QUEUE_LIMIT", "32"))
+# 已完成 / 失敗的工作保留多久供 status 查詢（秒）
+INGEST_JOB_TTL = float(os.getenv("INGEST_JOB_TTL", "3600"))
+
+ACTIVE_STATUSES = ("queued", "processing")
+
+
+class IngestQueueFull(Exception):
+    """排隊中的工作已達 INGEST_QUEUE_LIMIT"""
+
+
+class IngestQueue:
+    """
+    背景 ingestion 工作佇列。
+
+    上傳請求只負責存檔並送出工作，解析 / 分塊 / 索引在有上限的 worker pool 執行；
+    工作進度記在記憶體中，供 /api/document/status/{id} 查詢。
+
+    工作函式會收到 report(**fields)，用來更新進度欄位，例如：
+        report(stage="extraction", pages_extracted=3, pages_total=10)
+    """
+
+    def __init__(self, max_workers: int = INGEST_WORKERS, limit: int = INGEST_QUEUE_LIMIT):
+        self.limit = max(1, limit)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ingest")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_id: str, filename: str, work: Callable[[Callable[..., None]], None]) -> Dict[str, Any]:
+        """
+        送出工作；佇列已滿時拋出 IngestQueueFull。
+
+        Returns:
+            工作狀態（dict 副本）
+        """
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            active = sum(1 for job in self._jobs.values() if job["status"] in ACTIVE_STATUSES)
+            if active >= self.limit:
+                raise IngestQueueFull(f"Too many documents being processed ({active}). Please retry later.")
+            self._jobs[job_id] = {
+                "id": job_id,
+                "filename": filename,
+                "status": "queued",
+                "stage": "queued",
+                "pages_total": None,
+                "pages_extracted": 0,
+                "chunks_written": 0,
+                "indexing": "pending",
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+            job = dict(self._jobs[job_id])
+        self._executor.submit(self._run, job_id, work)
+        return job
+
+    def _run(self, job_id: str, work: Callable[[Callable[..., None]], None]) -> None:
+        self.update(job_id, status="processing")
+        try:
+            work(lambda **fields: self.update(job_id, **fields))
+        except Exception as e:
+            print(f"[ERROR] Ingestion job {job_id} failed: {e}")
+            self.update(job_id, status="failed", error=str(e))
+            return
+        self.update(job_id, status="ready", stage="done")
+
+    def _prune(self, now: float) -> None:
+        """移除超過 INGEST_JOB_TTL 的已結束工作（需在 lock 內呼叫）"""
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["status"] not in ACTIVE_STATUSES and now - job["updated_at"] > INGEST_JOB_TTL
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            job["updated_at"] = time.time()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def active_jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(job) for job in self._jobs.values() if job["status"] in ACTIVE_STATUSES]
+
+
+ingest_queue = IngestQueue()
@@ -0,0 +1,73 @@
+import re
+from functools import lru_cache
+from typing import FrozenSet, Iterable, Iterator, Set
+
+# 各語言（文字系統）的 Unicode 區段；key 與子索引的語言對應（searcher_pool.LANGUAGE_ANALYZERS）一致
+LANGUAGE_RANGES = {
+    "zh": r"\u4e00-\u9fff",
+    "ja": r"\u3040-\u30ff",
+    "ko": r"\uac00-\ud7a3",
+    "ru": r"\u0400-\u04ff",
+    "ar": r"\u0600-\u06ff",
+    "hi": r"\u0900-\u097f",
+    "el": r"\u0370-\u03ff",
+    "he": r"\u0590-\u05ff",
+    "th": r"\u0e00-\u0e7f",
+    "en": r"a-zA-Z",
+}
+
+
+_LANGUAGE_CHAR = {lang: re.compile(f"[{ranges}]") for lang, ranges in LANGUAGE_RANGES.items()}
+
+
+@lru_cache(maxsize=None)
+def _pattern_for(languages: FrozenSet[str]):
+    """只包含尚未出現語言的合併字元類別（一個 character class 比多組 alternation 快）"""
+    return re.compile("[" + "".join(LANGUAGE_RANGES[lang] for lang in sorted(languages)) + "]")
+
+
+def _language_of(char: str, languages: FrozenSet[str]) -> str:
+    for lang in languages:
+        if _LANGUAGE_CHAR[lang].match(char):
+            return lang
+    raise ValueError(f"Unexpected character: {char!r}")
+
+
+class LanguageProfiler:
+    """
+    逐段累積文件中出現的語言集合。
+
+    所有語言區段合併成一個正規表示式，從上次位置往後掃描：
+    找到某個語言後改用不含該語言的表示式繼續，因此每個字元最多只看一次，
+    所有語言都出現後就不再掃描。
+    """
+
+    def __init__(self):
+        self.languages: Set[str] = set()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.languages) == len(LANGUAGE_RANGES)
+
+    def update(self, text: str) -> None:
+        pos = 0
+        while text and not self.complete:
+            remaining = frozenset(LANGUAGE_RANGES) - self.languages
+            match = _pattern_for(remaining).search(text, pos)
+            if match is None:
+                return
+            self.languages.add(_language_of(match.group(), remaining))
+            pos = match.end()
+
+    def wrap(self, blocks: Iterable[str]) -> Iterator[str]:
+        """在文字片段傳給下一步（分塊）的同時累積語言集合"""
+        for block in blocks:
+            self.update(block)
+            yield block
+
+
+def detect_languages(text: str) -> Set[str]:
+    """回傳文字中可能出現的語言集合"""
+    profiler = LanguageProfiler()
+    profiler.update(text)
+    return profiler.languages
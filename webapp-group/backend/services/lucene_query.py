@@ -0,0 +1,65 @@
+import hashlib
+from typing import List
+
+# JSONL 中用來做文件過濾的欄位（JsonCollection 會把 id / contents 以外的字串欄位一併索引）
+DOC_KEY_FIELD = "doc_key"
+
+
+def doc_filter_key(doc_id: str) -> str:
+    """
+    產生 doc_id 對應的過濾 key。
+
+    key 為純數字字串：數字 token 不會被任何 analyzer（stemming、CJK bigram、stopwords）改寫，
+    所以不論索引用哪個 analyzer，查詢端都可以直接用 TermQuery 精確比對。
+    """
+    return str(int(hashlib.sha1(doc_id.encode("utf-8")).hexdigest(), 16))
+
+
+_lucene_classes = None
+
+
+def _get_lucene_classes():
+    """延遲載入 Lucene / Anserini 類別（避免 import 本模組就啟動 JVM）"""
+    global _lucene_classes
+    if _lucene_classes is None:
+        from pyserini.pyclass import autoclass
+        from pyserini.search.lucene import querybuilder
+
+        _lucene_classes = {
+            "querybuilder": querybuilder,
+            "BagOfWordsQueryGenerator": autoclass("io.anserini.search.query.BagOfWordsQueryGenerator"),
+        }
+    return _lucene_classes
+
+
+def build_filtered_query(searcher, query_text: str, doc_ids: List[str]):
+    """
+    建立「BM25 文字查詢 + doc_id 過濾」的 Lucene BooleanQuery。
+
+    文字部分使用 searcher 目前的 analyzer（與 set_language 一致）計分；
+    doc_id 過濾為 FILTER 子句，不影響分數，只限制命中範圍。
+
+    Args:
+        searcher: pyserini LuceneSearcher
+        query_text: 查詢字串
+        doc_ids: 允許的 doc_id 列表
+
+    Returns:
+        可直接傳給 searcher.search() 的 JQuery
+    """
+    classes = _get_lucene_classes()
+    querybuilder = classes["querybuilder"]
+    occur = querybuilder.JBooleanClauseOccur
+
+    analyzer = searcher.object.get_analyzer()
+    text_query = classes["BagOfWordsQueryGenerator"]().buildQuery("contents", analyzer, query_text)
+
+    doc_filter = querybuilder.get_boolean_query_builder()
+    for doc_id in dict.fromkeys(doc_ids):
+        term_query = querybuilder.JTermQuery(querybuilder.JTerm(DOC_KEY_FIELD, doc_filter_key(doc_id)))
+        doc_filter.add(term_query, occur.should.value)
+
+    builder = querybuilder.get_boolean_query_builder()
+    builder.add(text_query, occur.must.value)
+    builder.add(doc_filter.build(), occur.filter.value)
+    return builder.build()
@@ -0,0 +1,65 @@
+from typing import List
+
+_lucene_classes = None
+
+
+def _get_lucene_classes():
+    """延遲載入 Lucene 寫入相關類別（避免 import 本模組就啟動 JVM）"""
+    global _lucene_classes
+    if _lucene_classes is None:
+        from pyserini.pyclass import autoclass
+
+        _lucene_classes = {
+            "File": autoclass("java.io.File"),
+            "FSDirectory": autoclass("org.apache.lucene.store.FSDirectory"),
+            "IndexWriter": autoclass("org.apache.lucene.index.IndexWriter"),
+            "IndexWriterConfig": autoclass("org.apache.lucene.index.IndexWriterConfig"),
+            "OpenMode": autoclass("org.apache.lucene.index.IndexWriterConfig$OpenMode"),
+            "Term": autoclass("org.apache.lucene.index.Term"),
+        }
+    return _lucene_classes
+
+
+def _open_writer(index_path: str):
+    """以 APPEND 模式開啟既有索引的 IndexWriter"""
+    classes = _get_lucene_classes()
+    directory = classes["FSDirectory"].open(classes["File"](index_path).toPath())
+    config = classes["IndexWriterConfig"]()
+    config.setOpenMode(classes["OpenMode"].APPEND)
+    return classes["IndexWriter"](directory, config), directory
+
+
+def delete_by_terms(index_path: str, field: str, values: List[str]) -> None:
+    """
+    刪除 field 欄位等於任一 value 的所有文件並 commit。
+
+    刪除只在 segment 上標記 live docs，不重寫索引；空間由之後的 compact_index 回收。
+    """
+    classes = _get_lucene_classes()
+    writer, directory = _open_writer(index_path)
+    try:
+        for value in values:
+            writer.deleteDocuments(classes["Term"](field, value))
+        writer.commit()
+    finally:
+        writer.close()
+        directory.close()
+
+
+def compact_index(index_path: str) -> bool:
+    """
+    合併含有已刪除文件的 segment，回收空間。
+
+    Returns:
+        索引中原本有已刪除文件（有進行合併）時為 True
+    """
+    writer, directory = _open_writer(index_path)
+    try:
+        if not writer.hasDeletions():
+            return False
+        writer.forceMergeDeletes()
+        writer.commit()
+        return True
+    finally:
+        writer.close()
+        directory.close()
@@ -0,0 +1,213 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+# ================= Bucket 設定 =================
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+RETRY_BUCKETS = (0, 1, 2, 3, 5)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """
+    最小化的 Prometheus histogram（不依賴 prometheus_client）。
+
+    每組 label 值各自累計 bucket 次數、總和與筆數；以 lock 保護，可在 worker thread 中呼叫。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], List] = {}   # label 值 -> [bucket 次數..., sum, count]
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._series[key] = series
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            snapshot = {key: list(series) for key, series in self._series.items()}
+        for key in sorted(snapshot):
+            series = snapshot[key]
+            label_pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for i, upper in enumerate(self.buckets):
+                cumulative += series[i]
+                labels = _format_labels(label_pairs + [("le", _format_value(upper))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(label_pairs)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+_REGISTRY: List[Histogram] = []
+
+
+def render_metrics() -> str:
+    """輸出所有 metrics（Prometheus text format），供 /metrics 使用"""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================================
+# Metrics 定義
+# ==========================================================
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each pipeline stage in seconds.",
+    ("pipeline", "stage"),
+)
+GEMINI_REQUEST_SECONDS = Histogram(
+    "gemini_request_duration_seconds",
+    "Duration of Gemini requests in seconds, including retries and backoff.",
+    ("mode", "outcome"),
+)
+GEMINI_RETRIES = Histogram(
+    "gemini_request_retries",
+    "Number of retries per Gemini request.",
+    ("mode",),
+    RETRY_BUCKETS,
+)
+GEMINI_PROMPT_CHARS = Histogram(
+    "gemini_prompt_chars",
+    "Prompt size in characters per Gemini request.",
+    ("mode",),
+    SIZE_BUCKETS,
+)
+GEMINI_OUTPUT_CHARS = Histogram(
+    "gemini_output_chars",
+    "Output size in characters per Gemini request.",
+    ("mode",),
+    SIZE_BUCKETS,
+)
+GEMINI_PROMPT_TOKENS = Histogram(
+    "gemini_prompt_tokens",
+    "Prompt token count reported by Gemini usage metadata.",
+    ("mode",),
+    TOKEN_BUCKETS,
+)
+GEMINI_OUTPUT_TOKENS = Histogram(
+    "gemini_output_tokens",
+    "Output token count reported by Gemini usage metadata.",
+    ("mode",),
+    TOKEN_BUCKETS,
+)
+
+
+# ==========================================================
+# 各階段計時
+# ==========================================================
+# 目前請求的計時明細（stage -> 毫秒）；未設定時只記錄到 histogram
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+# 同一請求的 dict 會經由 copy_context 傳到多個 worker thread，累加（讀取 + 寫回）需互斥
+_timings_lock = threading.Lock()
+
+
+@contextmanager
+def collect_timings(timings: Optional[Dict[str, float]] = None) -> Iterator[Dict[str, float]]:
+    """
+    在此區塊內（含其中建立的 task / to_thread）呼叫 track_stage 的結果都會累計到回傳的 dict。
+
+    用法：
+        with collect_timings() as timings:
+            await generate(...)
+        # timings == {"rewrite": 812.4, "search": 35.1, ...}
+    """
+    timings = {} if timings is None else timings
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def record_stage(pipeline: str, stage: str, seconds: float, timings: Optional[Dict[str, float]] = None) -> None:
+    """記錄一個階段的耗時；同一請求中重複的 stage 會累加"""
+    STAGE_SECONDS.observe(seconds, pipeline=pipeline, stage=stage)
+    if timings is None:
+        timings = _request_timings.get()
+    if timings is not None:
+        with _timings_lock:
+            timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+
+@contextmanager
+def track_stage(pipeline: str, stage: str) -> Iterator[None]:
+    """計時 with 區塊並記錄為 pipeline 的 stage（例外時也會記錄）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.perf_counter() - started)
+
+
+def observe_gemini_request(mode: str, outcome: str, seconds: float, retries: int) -> None:
+    GEMINI_REQUEST_SECONDS.observe(seconds, mode=mode, outcome=outcome)
+    GEMINI_RETRIES.observe(retries, mode=mode)
+
+
+def observe_gemini_usage(mode: str, prompt: str, output_chars: int, usage=None) -> None:
+    """記錄 prompt / 輸出大小；有 usage_metadata 時一併記錄 token 數"""
+    GEMINI_PROMPT_CHARS.observe(len(prompt), mode=mode)
+    GEMINI_OUTPUT_CHARS.observe(output_chars, mode=mode)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if prompt_tokens:
+        GEMINI_PROMPT_TOKENS.observe(prompt_tokens, mode=mode)
+    if output_tokens:
+        GEMINI_OUTPUT_TOKENS.observe(output_tokens, mode=mode)
@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+from pypdf import PdfReader
+
+# ================= 設定區 =================
+# 解析 PDF 的 process 數（1 表示不使用 process pool）
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 頁數少於此值時直接在目前 process 解析（啟動 / 傳輸成本大於平行的好處）
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# 每個 worker 平均分到幾段頁面範圍（切細一點可以平衡各頁解析時間差異，也讓進度回報更即時）
+RANGES_PER_WORKER = 4
+
+# 清洗用的正規表示式（預先編譯）
+# 修復破碎單字 (例如: S t r u c t u r e -> Structure)：字母 + 空白 + 字母 時移除中間空白
+# 注意：這是一個 Trade-off，可能會把 "I am" 變成 "Iam"，但對於解決無法搜尋的問題至關重要。
+_BROKEN_WORD_RE = re.compile(r"(\w)\s+(?=\w)")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def clean_page_text(text: str) -> str:
+    """單頁文字清洗：換行轉空白 -> 修復破碎單字 -> 合併連續空白"""
+    # 1. 先把換行轉成空白，避免句子因為排版換行被截斷
+    text = text.replace("\n", " ")
+    # 2. 修復破碎單字
+    text = _BROKEN_WORD_RE.sub(r"\1", text)
+    # 3. 清理多餘空白
+    return _WHITESPACE_RE.sub(" ", text)
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """
+    解析 [start, end) 頁並清洗（在 worker process 執行，須為模組層級函式才能被 pickle）。
+    沒有文字的頁面回傳空字串，保持頁碼位置。
+    """
+    reader = PdfReader(path)
+    pages = []
+    for page in reader.pages[start:end]:
+        text = page.extract_text()
+        pages.append(clean_page_text(text) if text else "")
+    return pages
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    共用的 process pool（延遲建立）。
+
+    使用 spawn：後端 process 內有 JVM 與多個 thread，fork 可能複製到被鎖住的狀態。
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _page_ranges(total_pages: int, parts: int) -> List[tuple]:
+    size = max(1, -(-total_pages // parts))
+    return [(start, min(start + size, total_pages)) for start in range(0, total_pages, size)]
+
+
+def extract_pdf_text(
+    path: str,
+    workers: int = PDF_EXTRACT_WORKERS,
+    on_page: Optional[Callable[[int, int], None]] = None
+) -> str:
+    """
+    解析 PDF 全文，依頁面範圍分給 process pool 平行處理，結果維持原頁序。
+
+    Args:
+        path: PDF 路徑
+        workers: process 數；1 或頁數少於 PDF_PARALLEL_MIN_PAGES 時在目前 process 解析
+        on_page: 進度 callback，on_page(已處理頁數, 總頁數)
+
+    Returns:
+        各頁清洗後的文字，以雙換行連接（略過沒有文字的頁面）
+    """
+    reader = PdfReader(path)
+    total_pages = len(reader.pages)
+    pages: List[str] = [""] * total_pages
+
+    if workers <= 1 or total_pages < PDF_PARALLEL_MIN_PAGES:
+        for i, page in enumerate(reader.pages):
+            text = page.extract_text()
+            pages[i] = clean_page_text(text) if text else ""
+            if on_page:
+                on_page(i + 1, total_pages)
+    else:
+        pool = _get_pool(workers)
+        futures = {
+            pool.submit(_extract_page_range, path, start, end): (start, end)
+            for start, end in _page_ranges(total_pages, workers * RANGES_PER_WORKER)
+        }
+        done_pages = 0
+        for future in as_completed(futures):
+            start, end = futures[future]
+            pages[start:end] = future.result()
+            done_pages += end - start
+            if on_page:
+                on_page(done_pages, total_pages)
+
+    # 用雙換行連接每一頁
+    return "\n\n".join(page for page in pages if page)
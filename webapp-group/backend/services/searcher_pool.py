@@ -0,0 +1,241 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+# ================= 設定區 =================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX_ROOT = os.path.join(BASE_DIR, "data", "indexes")
+INDEX_PATH = os.path.join(INDEX_ROOT, "lucene-index")
+
+# 索引世代標記：每次索引重建 / 刪除後遞增，Searcher 只在世代改變時才重新開啟
+GENERATION_PATH = os.path.join(INDEX_ROOT, "GENERATION")
+
+# 建立索引時使用的 shard 數（寫在標記檔中，與目前設定不同時需重建索引）
+SHARDS_PATH = os.path.join(INDEX_ROOT, "SHARDS")
+
+# 每個子索引切成幾個 shard（依 doc_id hash 分配）；建立與檢索時各 shard 平行處理，1 表示不切分
+INDEX_SHARDS = max(1, int(os.getenv("INDEX_SHARDS", "1")))
+SHARD_PREFIX = "shard-"
+
+# 每個世代、每個子索引最多保留的閒置 Searcher 數量（並行請求超過時會臨時多開，用完即關）
+SEARCHER_POOL_SIZE = int(os.getenv("SEARCHER_POOL_SIZE", "4"))
+
+# ==========================================================
+# 子索引配置：每個 analyzer 一個子索引 data/indexes/lucene-index/<analyzer>/
+# - 語言偵測結果（LANGUAGE_REGEX 的 key）對應到 Anserini 支援的語言 analyzer
+# - 沒有專用 analyzer 的語言（含英文）使用 Anserini 預設英文 analyzer，子索引名稱為 "en"
+# ==========================================================
+DEFAULT_ANALYZER = "en"
+LANGUAGE_ANALYZERS = {
+    "zh": "zh",
+    "ja": "ja",
+    "ko": "ko",
+    "ru": "ru",
+    "ar": "ar",
+    "hi": "hi",
+    "th": "th",
+}
+
+
+def analyzer_for_language(language: str) -> str:
+    """將偵測到的語言對應到建立子索引用的 analyzer"""
+    return LANGUAGE_ANALYZERS.get(language, DEFAULT_ANALYZER)
+
+
+def subindex_path(analyzer: str, root: str = INDEX_PATH) -> str:
+    return os.path.join(root, analyzer)
+
+
+def shard_for(doc_id: str, shards: int = INDEX_SHARDS) -> int:
+    """依 doc_id 的 hash 決定所屬 shard（不使用內建 hash()，重啟後結果不變）"""
+    return int(hashlib.sha1(doc_id.encode("utf-8")).hexdigest(), 16) % shards
+
+
+def shard_path(analyzer: str, shard: int, shards: int = INDEX_SHARDS, root: str = INDEX_PATH) -> str:
+    """
+    子索引 shard 的路徑：不切分時為子索引目錄本身，
+    否則為 <analyzer>/shard-00、shard-01 ...
+    """
+    base = subindex_path(analyzer, root)
+    return base if shards <= 1 else os.path.join(base, f"{SHARD_PREFIX}{shard:02d}")
+
+
+def list_shards(analyzer: str, root: str = INDEX_PATH) -> List[str]:
+    """回傳子索引目前存在（非空）的 shard 路徑；未切分的子索引回傳子索引目錄本身"""
+    base = subindex_path(analyzer, root)
+    if not os.path.isdir(base):
+        return []
+    names = sorted(os.listdir(base))
+    shards = [
+        os.path.join(base, name) for name in names
+        if name.startswith(SHARD_PREFIX) and os.path.isdir(os.path.join(base, name)) and os.listdir(os.path.join(base, name))
+    ]
+    if shards:
+        return shards
+    return [base] if any(os.path.isfile(os.path.join(base, name)) for name in names) else []
+
+
+def read_index_shards() -> int:
+    """讀取目前索引的 shard 數（標記檔不存在時為 1，即未切分的舊版索引）"""
+    try:
+        with open(SHARDS_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 1)
+    except (FileNotFoundError, ValueError):
+        return 1
+
+
+def write_index_shards(shards: int) -> None:
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    tmp_path = f"{SHARDS_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(shards))
+    os.replace(tmp_path, SHARDS_PATH)
+
+
+def list_subindexes(root: str = INDEX_PATH) -> List[str]:
+    """回傳目前存在（非空）的子索引 analyzer 名稱"""
+    if not os.path.isdir(root):
+        return []
+    analyzers = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if os.path.isdir(path) and os.listdir(path):
+            analyzers.append(name)
+    return analyzers
+
+
+def read_index_generation() -> int:
+    """讀取目前的索引世代編號（標記檔不存在時為 0）"""
+    try:
+        with open(GENERATION_PATH, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_index_generation() -> int:
+    """
+    遞增索引世代編號，通知所有 SearcherPool 在下次取用時重新開啟索引。
+
+    以「寫入暫存檔 + os.replace」的方式更新，讀取端不會看到寫到一半的內容。
+    """
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    generation = read_index_generation() + 1
+    tmp_path = f"{GENERATION_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(str(generation))
+    os.replace(tmp_path, GENERATION_PATH)
+    print(f"[INFO] Index generation bumped to {generation}")
+    return generation
+
+
+def _close_searcher(searcher) -> None:
+    close = getattr(searcher, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception as e:
+        print(f"[WARNING] Failed to close searcher: {e}")
+
+
+class _Generation:
+    """單一索引世代的 Searcher 集合（依子索引 / shard 路徑分組）"""
+
+    def __init__(self, number: int):
+        self.number = number
+        self.idle: Dict[str, List[object]] = {}
+        self.retired = False
+
+
+class SearcherPool:
+    """
+    長駐的 Searcher 池。
+
+    - 同一個索引世代內重複使用已開啟的 Searcher，不再每次請求都重新開啟索引
+    - 每個子索引（analyzer）的每個 shard 各自維護一組 Searcher
+    - 偵測到世代標記改變時，後續請求改用新索引；舊世代的 Searcher
+      會留給仍在執行的請求使用，歸還時才關閉
+    - 每個 Searcher 同一時間只借給一個請求
+    """
+
+    def __init__(
+        self,
+        root: str,
+        factory: Callable[[str, str], object],
+        size: int = SEARCHER_POOL_SIZE
+    ):
+        """
+        Args:
+            root: 子索引的根目錄
+            factory: factory(index_path, analyzer) -> Searcher
+            size: 每個子索引保留的閒置 Searcher 上限
+        """
+        self.root = root
+        self.factory = factory
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._current: Optional[_Generation] = None
+
+    def analyzers(self) -> List[str]:
+        return list_subindexes(self.root)
+
+    def shards(self, analyzer: str) -> List[str]:
+        return list_shards(analyzer, self.root)
+
+    def has_index(self) -> bool:
+        return bool(self.analyzers())
+
+    def _current_generation(self) -> _Generation:
+        """取得目前世代；世代改變時汰換舊世代（需在 lock 內呼叫）"""
+        number = read_index_generation()
+        if self._current is None or self._current.number != number:
+            old = self._current
+            self._current = _Generation(number)
+            if old is not None:
+                old.retired = True
+                for searchers in old.idle.values():
+                    for searcher in searchers:
+                        _close_searcher(searcher)
+                old.idle.clear()
+                print(f"[INFO] Searcher pool switched to index generation {number}")
+        return self._current
+
+    @contextmanager
+    def acquire(self, analyzer: str, path: Optional[str] = None) -> Iterator[Optional[object]]:
+        """
+        借出指定子索引（或其中一個 shard）的 Searcher；索引不存在或開啟失敗時 yield None。
+
+        用法：
+            with pool.acquire("zh") as searcher:
+                if searcher:
+                    hits = searcher.search(query)
+
+        Args:
+            path: shard 路徑（pool.shards(analyzer) 的其中一個）；None 表示子索引目錄本身
+        """
+        path = path or subindex_path(analyzer, self.root)
+        with self._lock:
+            generation = self._current_generation()
+            idle = generation.idle.setdefault(path, [])
+            searcher = idle.pop() if idle else None
+
+        try:
+            if searcher is None and os.path.isdir(path) and os.listdir(path):
+                try:
+                    searcher = self.factory(path, analyzer)
+                except Exception as e:
+                    print(f"[WARNING] Failed to open searcher for sub-index '{analyzer}' ({path}): {e}")
+                    searcher = None
+            yield searcher
+        finally:
+            keep = False
+            with self._lock:
+                idle = generation.idle.setdefault(path, [])
+                if searcher is not None and not generation.retired and len(idle) < self.size:
+                    idle.append(searcher)
+                    keep = True
+            if searcher is not None and not keep:
+                _close_searcher(searcher)
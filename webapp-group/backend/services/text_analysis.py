@@ -0,0 +1,220 @@
+import re
+from functools import lru_cache
+from typing import List
+
+# ================= 設定區 =================
+# Lucene EnglishAnalyzer.ENGLISH_STOP_WORDS_SET（Anserini 預設 analyzer 使用的停用詞）
+ENGLISH_STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with"
+))
+# 超過此長度的 token 直接丟棄（與 Lucene StandardTokenizer 的 maxTokenLength 同樣的用意）
+MAX_TOKEN_LENGTH = 255
+
+# CJK 文字（中文、日文假名、韓文）以 bigram 切分，與 CJKAnalyzer 相同
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7a3"
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+# 數字（含小數點 / 千分位）、含撇號的英文字（don't、John's）、其他連續的字母數字
+_TOKEN = re.compile(r"[0-9]+(?:[.,][0-9]+)+|[^\W_]+(?:['’][^\W_]+)*")
+
+
+# ==========================================================
+# Porter stemmer（Martin Porter 的 C 版實作，與 Lucene PorterStemFilter 相同）
+# ==========================================================
+_STEP2 = {
+    "a": (("ational", "ate"), ("tional", "tion")),
+    "c": (("enci", "ence"), ("anci", "ance")),
+    "e": (("izer", "ize"),),
+    "l": (("bli", "ble"), ("alli", "al"), ("entli", "ent"), ("eli", "e"), ("ousli", "ous")),
+    "o": (("ization", "ize"), ("ation", "ate"), ("ator", "ate")),
+    "s": (("alism", "al"), ("iveness", "ive"), ("fulness", "ful"), ("ousness", "ous")),
+    "t": (("aliti", "al"), ("iviti", "ive"), ("biliti", "ble")),
+    "g": (("logi", "log"),),
+}
+_STEP3 = {
+    "e": (("icate", "ic"), ("ative", ""), ("alize", "al")),
+    "i": (("iciti", "ic"),),
+    "l": (("ical", "ic"), ("ful", "")),
+    "s": (("ness", ""),),
+}
+_STEP4 = {
+    "a": ("al",),
+    "c": ("ance", "ence"),
+    "e": ("er",),
+    "i": ("ic",),
+    "l": ("able", "ible"),
+    "n": ("ant", "ement", "ment", "ent"),
+    "o": ("ion", "ou"),
+    "s": ("ism",),
+    "t": ("ate", "iti"),
+    "u": ("ous",),
+    "v": ("ive",),
+    "z": ("ize",),
+}
+
+
+def _is_consonant(word: str, i: int) -> bool:
+    ch = word[i]
+    if ch in "aeiou":
+        return False
+    if ch == "y":
+        return i == 0 or not _is_consonant(word, i - 1)
+    return True
+
+
+def _measure(stem: str) -> int:
+    """stem 中 VC（母音串 + 子音串）出現的次數"""
+    n = 0
+    i = 0
+    length = len(stem)
+    while i < length and _is_consonant(stem, i):
+        i += 1
+    while i < length:
+        while i < length and not _is_consonant(stem, i):
+            i += 1
+        if i >= length:
+            break
+        n += 1
+        while i < length and _is_consonant(stem, i):
+            i += 1
+    return n
+
+
+def _has_vowel(stem: str) -> bool:
+    return any(not _is_consonant(stem, i) for i in range(len(stem)))
+
+
+def _double_consonant(word: str) -> bool:
+    return len(word) >= 2 and word[-1] == word[-2] and _is_consonant(word, len(word) - 1)
+
+
+def _cvc(word: str) -> bool:
+    """結尾為 子音-母音-子音，且最後一個子音不是 w、x、y"""
+    i = len(word) - 1
+    if i < 2 or not _is_consonant(word, i) or _is_consonant(word, i - 1) or not _is_consonant(word, i - 2):
+        return False
+    return word[i] not in "wxy"
+
+
+def _replace_suffix(word: str, rules, min_measure: int = 0) -> str:
+    """套用第一個符合的後綴規則（stem 的 measure 須大於 min_measure）"""
+    for suffix, replacement in rules:
+        if word.endswith(suffix):
+            stem = word[:-len(suffix)]
+            return stem + replacement if _measure(stem) > min_measure else word
+    return word
+
+
+def _step1ab(word: str) -> str:
+    if word.endswith("s"):
+        if word.endswith("sses"):
+            word = word[:-2]
+        elif word.endswith("ies"):
+            word = word[:-2]
+        elif not word.endswith("ss"):
+            word = word[:-1]
+
+    if word.endswith("eed"):
+        if _measure(word[:-3]) > 0:
+            word = word[:-1]
+        return word
+
+    for suffix in ("ed", "ing"):
+        if word.endswith(suffix) and _has_vowel(word[:-len(suffix)]):
+            word = word[:-len(suffix)]
+            if word.endswith(("at", "bl", "iz")):
+                word += "e"
+            elif _double_consonant(word):
+                if word[-1] not in "lsz":
+                    word = word[:-1]
+            elif _measure(word) == 1 and _cvc(word):
+                word += "e"
+            break
+    return word
+
+
+def _step4(word: str) -> str:
+    if len(word) < 2:
+        return word
+    for suffix in _STEP4.get(word[-2], ()):
+        if not word.endswith(suffix):
+            continue
+        stem = word[:-len(suffix)]
+        if suffix == "ion" and not stem.endswith(("s", "t")):
+            continue
+        return stem if _measure(stem) > 1 else word
+    return word
+
+
+def _step5(word: str) -> str:
+    if word.endswith("e"):
+        m = _measure(word[:-1])
+        if m > 1 or (m == 1 and not _cvc(word[:-1])):
+            word = word[:-1]
+    if word.endswith("l") and _double_consonant(word) and _measure(word) > 1:
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=65536)
+def porter_stem(word: str) -> str:
+    """回傳小寫單字的 Porter stem（長度 <= 2 的字不處理）"""
+    if len(word) <= 2:
+        return word
+    word = _step1ab(word)
+    if len(word) > 1:
+        if word.endswith("y") and _has_vowel(word[:-1]):
+            word = word[:-1] + "i"
+        if len(word) >= 2:
+            word = _replace_suffix(word, _STEP2.get(word[-2], ()))
+        word = _replace_suffix(word, _STEP3.get(word[-1], ()))
+        word = _step4(word)
+        word = _step5(word)
+    return word
+
+
+# ==========================================================
+# Analyzer
+# ==========================================================
+def _cjk_bigrams(run: str) -> List[str]:
+    if len(run) == 1:
+        return [run]
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def analyze(text: str) -> List[str]:
+    """
+    將文字切成檢索用的 term 序列，近似 Anserini 的預設 analyzer：
+    小寫化、去除英文所有格與停用詞、Porter stemming；CJK 文字切成 bigram（單一字元時保留 unigram）。
+
+    Args:
+        text: 原始文字（chunk 內容或查詢）
+
+    Returns:
+        term 列表（保留重複，用於計算 term frequency）
+    """
+    terms: List[str] = []
+    for match in _TOKEN.finditer(text.lower()):
+        token = match.group()
+        if not token.isascii() and _CJK_RUN.search(token):
+            # 字母數字串中混有 CJK：CJK 部分切 bigram，其餘部分照一般 token 處理
+            pos = 0
+            for run in _CJK_RUN.finditer(token):
+                if run.start() > pos:
+                    _add_word(terms, token[pos:run.start()])
+                terms.extend(_cjk_bigrams(run.group()))
+                pos = run.end()
+            if pos < len(token):
+                _add_word(terms, token[pos:])
+        else:
+            _add_word(terms, token)
+    return terms
+
+
+def _add_word(terms: List[str], token: str) -> None:
+    if token.endswith(("'s", "’s")):
+        token = token[:-2]
+    if not token or len(token) > MAX_TOKEN_LENGTH or token in ENGLISH_STOP_WORDS:
+        return
+    terms.append(porter_stem(token))
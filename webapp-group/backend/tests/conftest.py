@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 測試以 backend/ 為根目錄匯入 services.*（與 uvicorn main:app 相同）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from services.bm25_engine import BM25Engine, _lucene_doc_length  # noqa: E402
+from services.text_analysis import analyze  # noqa: E402
+
+WORDS = [f"w{i}" for i in range(40)] + ["資訊", "檢索"]
+
+
+class Corpus:
+    """JSONL 目錄與對照用的暴力 BM25（Lucene 公式、docCount 只計入非空 chunk）"""
+
+    def __init__(self, root, seed: int = 0):
+        self.dir = root / "jsonl"
+        self.dir.mkdir()
+        self.docs = {}
+        self.rng = random.Random(seed)
+
+    def path(self, doc_id: str) -> str:
+        return str(self.dir / f"{doc_id}.json")
+
+    def write(self, doc_id: str, chunks=None) -> str:
+        if chunks is None:
+            chunks = [
+                " ".join(self.rng.choices(WORDS, k=self.rng.randint(0, 30)))
+                for _ in range(self.rng.randint(1, 5))
+            ]
+        self.docs[doc_id] = chunks
+        with open(self.path(doc_id), "w", encoding="utf-8") as f:
+            for i, text in enumerate(chunks):
+                f.write(json.dumps({"id": f"{doc_id}#{i}", "contents": text}, ensure_ascii=False) + "\n")
+        return self.path(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        del self.docs[doc_id]
+        os.remove(self.path(doc_id))
+
+    def scores(self, query: str, selected=None):
+        chunks = [
+            (f"{doc_id}#{i}", Counter(analyze(text)))
+            for doc_id, texts in self.docs.items() for i, text in enumerate(texts)
+        ]
+        chunks = [(chunk_id, tf) for chunk_id, tf in chunks if tf]
+        n = len(chunks)
+        avgdl = sum(sum(tf.values()) for _, tf in chunks) / max(n, 1)
+        results = {}
+        for chunk_id, tf in chunks:
+            if selected is not None and chunk_id.split("#")[0] not in selected:
+                continue
+            dl = float(_lucene_doc_length(np.array([sum(tf.values())]))[0])
+            score = 0.0
+            for term, qtf in Counter(analyze(query)).items():
+                if tf[term]:
+                    df = sum(1 for _, other in chunks if other[term])
+                    idf = math.log1p((n - df + 0.5) / (df + 0.5))
+                    score += qtf * idf * tf[term] / (tf[term] + 1.2 * (1 - 0.75 + 0.75 * dl / avgdl))
+            if score > 0:
+                results[chunk_id] = score
+        return results
+
+
+def assert_matches(engine: BM25Engine, corpus: Corpus, query: str, selected=None, k: int = 10) -> None:
+    expected = corpus.scores(query, selected)
+    results = engine.search(query, selected, k)
+    assert len(results) == min(k, len(expected))
+    top = sorted(expected.values(), reverse=True)
+    for (chunk_id, score), best in zip(results, top):
+        # 同分的 chunk 順序可能不同：比較分數，並確認每個 chunk 的分數正確
+        assert score == pytest.approx(best, rel=1e-4)
+        assert score == pytest.approx(expected[chunk_id], rel=1e-4)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    return Corpus(tmp_path)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return BM25Engine(root=str(tmp_path / "bm25"))
+
+
+def test_lucene_doc_length_encoding():
+    lengths = np.array([0, 1, 23, 24, 40, 41, 100, 1000])
+    assert _lucene_doc_length(lengths).tolist() == [0, 1, 23, 24, 40, 40, 96, 984]
+
+
+def test_search_matches_brute_force(engine, corpus):
+    for i in range(30):
+        engine.add_document(f"d{i}", corpus.write(f"d{i}"))
+    for _ in range(20):
+        assert_matches(engine, corpus, " ".join(corpus.rng.choices(WORDS, k=3)))
+
+
+def test_doc_filter(engine, corpus):
+    for i in range(10):
+        engine.add_document(f"d{i}", corpus.write(f"d{i}"))
+    for _ in range(10):
+        assert_matches(engine, corpus, " ".join(corpus.rng.choices(WORDS, k=3)), selected=["d1", "d4"])
+    assert engine.search("w1", [], 10) == []
+    assert engine.search("w1", ["missing"], 10) == []
+
+
+def test_delete_replace_and_compact(engine, corpus):
+    for i in range(12):
+        engine.add_document(f"d{i}", corpus.write(f"d{i}"))
+    for doc_id in ["d0", "d5", "d11"]:
+        corpus.remove(doc_id)
+        assert engine.delete_document(doc_id)
+    assert not engine.delete_document("d0")
+    engine.add_document("d3", corpus.write("d3"))
+    queries = [" ".join(corpus.rng.choices(WORDS, k=3)) for _ in range(10)]
+    for query in queries:
+        assert_matches(engine, corpus, query)
+        assert not any(chunk_id.startswith(("d0#", "d5#", "d11#")) for chunk_id, _ in engine.search(query, None, 100))
+
+    assert engine.compact()
+    assert len(engine._read_manifest(engine._current_name())) == 1
+    assert not engine.compact()
+    for query in queries:
+        assert_matches(engine, corpus, query)
+
+
+def test_parts_are_merged_logarithmically(engine, corpus):
+    for i in range(64):
+        engine.add_document(f"d{i}", corpus.write(f"d{i}", ["w1 w2 w3"]))
+    parts = engine._read_manifest(engine._current_name())
+    assert len(parts) <= 7
+    assert sum(part["docs"] for part in parts) == 64
+
+
+def test_deleting_every_document_clears_the_index(engine, corpus):
+    engine.add_document("a", corpus.write("a"))
+    engine.add_document("b", corpus.write("b"))
+    assert engine.delete_document("a")
+    assert engine.delete_document("b")
+    assert not engine.has_index()
+    assert engine.search("w1", None, 10) == []
+
+
+def test_previous_generation_is_kept_until_the_next_swap(engine, corpus):
+    engine.add_document("a", corpus.write("a", ["w1 w2"]))
+    first = engine._current_name()
+    first_parts = [part["name"] for part in engine._read_manifest(first)]
+    engine.add_document("b", corpus.write("b", ["w2 w3"]))
+    files = set(os.listdir(engine.root))
+    assert first in files and set(first_parts) <= files
+
+    engine.add_document("c", corpus.write("c", ["w3 w4"]))
+    files = set(os.listdir(engine.root))
+    assert first not in files
+
+
+def test_sync_rebuilds_from_jsonl(tmp_path, corpus):
+    for i in range(5):
+        corpus.write(f"d{i}")
+    engine = BM25Engine(root=str(tmp_path / "bm25"))
+    assert engine.sync(str(corpus.dir))
+    assert not engine.sync(str(corpus.dir))
+    corpus.remove("d2")
+    os.utime(corpus.write("d3"), (2e9, 2e9))   # JSONL 比索引新：重新索引
+    assert engine.sync(str(corpus.dir))
+    for _ in range(5):
+        assert_matches(engine, corpus, " ".join(corpus.rng.choices(WORDS, k=3)))
+
+    # 另一個 process（新的 BM25Engine）讀到相同的索引
+    assert_matches(BM25Engine(root=engine.root), corpus, "w1 w2 資訊")
+
+
+def test_searches_run_while_parts_are_swapped(engine, corpus):
+    # 寫入端切換 manifest 時會增刪 _parts；同時進行的檢索不應出錯
+    for i in range(8):
+        engine.add_document(f"d{i}", corpus.write(f"d{i}"))
+    stop = threading.Event()
+    errors = []
+
+    def searcher():
+        while not stop.is_set():
+            try:
+                engine.search("w1 w2 資訊", None, 10)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=searcher) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    try:
+        for i in range(8, 40):
+            engine.add_document(f"d{i}", corpus.write(f"d{i}"))
+            if i % 3 == 0:
+                corpus.remove(f"d{i - 5}")
+                engine.delete_document(f"d{i - 5}")
+            if i % 10 == 0:
+                engine.compact()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    # 已移除的 part 不會留在快取中
+    assert set(engine._parts) <= set(os.listdir(engine.root))
+    assert_matches(engine, corpus, "w1 w2 資訊")
@@ -0,0 +1,46 @@
+import time
+
+from services.cache import TTLCache, make_cache_key
+
+
+def test_make_cache_key_is_stable_and_order_sensitive():
+    assert make_cache_key("ctx", "query") == make_cache_key("ctx", "query")
+    assert make_cache_key("ctx", "query") != make_cache_key("query", "ctx")
+    assert make_cache_key({"b": 1, "a": 2}) == make_cache_key({"a": 2, "b": 1})
+    assert len(make_cache_key("資訊檢索")) == 64
+
+
+def test_get_set_and_stats():
+    cache = TTLCache("test", maxsize=4, ttl=0)
+    assert cache.get("k") == (False, None)
+    cache.set("k", "v")
+    assert cache.get("k") == (True, "v")
+    stats = cache.stats()
+    assert (stats["size"], stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 1, 0.5)
+
+
+def test_evicts_least_recently_used():
+    cache = TTLCache("test", maxsize=2, ttl=0)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache("test", maxsize=2, ttl=0.05)
+    cache.set("a", 1)
+    assert cache.get("a") == (True, 1)
+    time.sleep(0.1)
+    assert cache.get("a") == (False, None)
+    assert cache.stats()["size"] == 0
+
+
+def test_clear():
+    cache = TTLCache("test")
+    cache.set("a", 1)
+    cache.clear()
+    assert cache.get("a") == (False, None)
@@ -0,0 +1,203 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("google.generativeai")
+
+from services import chat_service, gemini_client  # noqa: E402
+
+
+class _FakeChunkStore:
+    def get_many(self, chunk_ids):
+        return {chunk_id: {"text": f"text of {chunk_id}", "filename": "a.txt"} for chunk_id in chunk_ids}
+
+
+class _DisabledDenseIndex:
+    enabled = False
+
+
+@pytest.fixture
+def retrieval(monkeypatch):
+    """以 NumPy 後端檢索，BM25 結果與索引世代由測試控制"""
+    state = {"generation": 1, "searches": 0, "hits": [("doc#0", 2.0), ("doc#1", 1.0)]}
+
+    def fake_search(analyzer, path, query_text, selected_doc_ids):
+        state["searches"] += 1
+        return list(state["hits"])
+
+    monkeypatch.setattr(chat_service, "search_backend", lambda: chat_service.NUMPY_BACKEND)
+    monkeypatch.setattr(chat_service, "_search_bm25_engine", fake_search)
+    monkeypatch.setattr(chat_service, "read_index_generation", lambda: state["generation"])
+    monkeypatch.setattr(chat_service, "chunk_store", _FakeChunkStore())
+    monkeypatch.setattr(chat_service, "get_dense_index", lambda: _DisabledDenseIndex())
+    monkeypatch.setattr(chat_service, "RETRIEVAL_CACHE_ENABLED", True)
+    chat_service.retrieval_cache.clear()
+    return state
+
+
+def _search(query, doc_ids):
+    return asyncio.run(chat_service.search_chunks(query, doc_ids))
+
+
+def test_retrieval_cache_hits_and_returns_copies(retrieval):
+    first = _search("bm25 ranking", ["doc"])
+    assert [chunk["id"] for chunk in first] == ["doc#0", "doc#1"]
+    first[0]["text"] = "modified"
+    second = _search("bm25 ranking", ["doc"])
+    assert retrieval["searches"] == 1
+    assert second[0]["text"] == "text of doc#0"
+
+
+def test_retrieval_cache_key_includes_doc_scope(retrieval):
+    _search("bm25 ranking", ["doc"])
+    _search("bm25 ranking", ["doc", "other"])
+    _search("bm25 ranking", ["other", "doc"])
+    assert retrieval["searches"] == 2
+
+
+def test_retrieval_cache_is_invalidated_on_generation_bump(retrieval):
+    _search("bm25 ranking", ["doc"])
+    retrieval["generation"] = 2
+    retrieval["hits"] = [("doc#1", 3.0)]
+    assert [chunk["id"] for chunk in _search("bm25 ranking", ["doc"])] == ["doc#1"]
+    assert retrieval["searches"] == 2
+    assert chat_service.retrieval_cache.stats()["size"] == 1
+
+
+def test_results_are_not_cached_when_the_index_changes_during_search(retrieval, monkeypatch):
+    def search_then_bump(analyzer, path, query_text, selected_doc_ids):
+        retrieval["searches"] += 1
+        retrieval["generation"] += 1
+        return list(retrieval["hits"])
+
+    monkeypatch.setattr(chat_service, "_search_bm25_engine", search_then_bump)
+    _search("bm25 ranking", ["doc"])
+    assert chat_service.retrieval_cache.stats()["size"] == 0
+
+
+def _passages(count, words=100):
+    return [{"id": f"doc#{i}", "text": "word " * words, "filename": "a.txt"} for i in range(count)]
+
+
+def _packed_cost(direct, overflow):
+    return (
+        sum(chat_service.estimate_tokens(p["text"]) + chat_service.PASSAGE_OVERHEAD_TOKENS for p in direct)
+        + chat_service._summary_reserve(len(overflow))
+    )
+
+
+def test_estimate_tokens():
+    assert chat_service.estimate_tokens("") == 0
+    assert chat_service.estimate_tokens("abcd" * 10) == 10
+    assert chat_service.estimate_tokens("資訊檢索") == 4
+
+
+def test_pack_passages_fits_everything_in_a_large_budget():
+    passages = _passages(13)
+    assert chat_service.pack_passages(passages, 8000) == (passages, [])
+
+
+@pytest.mark.parametrize("budget", range(0, 3000, 97))
+def test_pack_passages_respects_budget_and_rank_order(budget):
+    passages = _passages(13)
+    direct, overflow = chat_service.pack_passages(passages, budget, min_direct=0)
+    assert direct + overflow == passages
+    assert _packed_cost(direct, overflow) <= budget or not direct
+
+
+def test_pack_passages_keeps_minimum_direct_passages():
+    passages = _passages(13)
+    direct, overflow = chat_service.pack_passages(passages, 0, min_direct=3)
+    assert (len(direct), len(overflow)) == (3, 10)
+    direct, overflow = chat_service.pack_passages(passages[:2], 0, min_direct=3)
+    assert (len(direct), len(overflow)) == (2, 0)
+
+
+def test_only_overflow_is_summarized(monkeypatch):
+    calls = []
+
+    async def fake_summarize(passages, context, utterance, *args, **kwargs):
+        calls.append(len(passages))
+        return "summary"
+
+    monkeypatch.setattr(chat_service, "summarize_passages", fake_summarize)
+    passages = _passages(13)
+    direct, summaries = asyncio.run(chat_service.process_passages_with_summary(passages, "ctx", "q", 8000))
+    assert (len(direct), summaries, calls) == (13, [], [])
+
+    direct, summaries = asyncio.run(chat_service.process_passages_with_summary(passages, "ctx", "q", 1500))
+    overflow = 13 - len(direct)
+    assert 0 < overflow < 13
+    assert sum(calls) == overflow and max(calls) <= chat_service.SUMMARY_CHUNK_SIZE
+    assert summaries == ["summary"] * len(calls)
+
+
+def test_budget_reserves_only_what_the_rag_prompt_contains(monkeypatch):
+    reserved = []
+
+    async def fake_retrieve(context, query, selected_doc_ids, reserved_tokens=0):
+        reserved.append(reserved_tokens)
+        return "【Reference Documents】:\n[Source: a.txt]: text\n\n", []
+
+    async def fake_ptkbs(context, query, ptkb_list):
+        return list(ptkb_list)
+
+    monkeypatch.setattr(chat_service, "retrieve_context", fake_retrieve)
+    monkeypatch.setattr(chat_service, "_get_relevant_ptkbs_safe", fake_ptkbs)
+    history = [{"role": "user", "content": "long earlier question " * 500}]
+    turn = asyncio.run(chat_service._prepare_turn("what is bm25?", history, ["likes IR " * 200], ["doc"]))
+
+    assert reserved == [chat_service.estimate_tokens("what is bm25?") + chat_service.PROMPT_OVERHEAD_TOKENS]
+    assert "long earlier question" not in turn["final_user_prompt"]
+    assert "what is bm25?" in turn["final_user_prompt"]
+
+
+class _FakeChunk:
+    candidates = []
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _FakeModel:
+    async def generate_content_async(self, prompt, stream=False):
+        async def chunks():
+            for i in range(100):
+                yield _FakeChunk(f"word{i} ")
+        return chunks()
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    async def fake_prepare_turn(query, history, ptkb_list, selected_doc_ids):
+        return {"new_ptkb": None, "relevant_ptkbs": [], "retrieved_sources": [], "final_user_prompt": query}
+
+    monkeypatch.setattr(chat_service, "_prepare_turn", fake_prepare_turn)
+    monkeypatch.setattr(gemini_client, "api_key", "test-key")
+    monkeypatch.setattr(gemini_client, "_build_model", lambda model, temperature, max_tokens: _FakeModel())
+    return gemini_client._request_slots
+
+
+def test_disconnect_releases_gemini_slot(streaming):
+    async def consume_then_disconnect():
+        events = chat_service.stream_response("q", [], [])
+        assert (await events.__anext__())[0] == "sources"
+        assert (await events.__anext__())[0] == "token"
+        held = streaming._value
+        await events.aclose()   # event_stream 在 client 斷線時呼叫
+        return held, streaming._value
+
+    held, released = asyncio.run(consume_then_disconnect())
+    assert released == held + 1 == gemini_client.MAX_CONCURRENT_REQUESTS
+
+
+def test_truncation_releases_gemini_slot(streaming, monkeypatch):
+    monkeypatch.setattr(chat_service, "RESPONSE_LIMIT", 5)
+
+    async def consume_until_done():
+        events = [event async for event, _ in chat_service.stream_response("q", [], [])]
+        return events, streaming._value
+
+    events, value = asyncio.run(consume_until_done())
+    assert events[-1] == "done"
+    assert value == gemini_client.MAX_CONCURRENT_REQUESTS
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from benchmarks.bench_chunking import legacy_chunk_text, precomputed_chunk_text, synthetic_text
+from services.chunking import Utf8Validator, iter_text_chunks, iter_text_file
+
+
+def _blocks(text: str, size: int):
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+
+@pytest.mark.parametrize("kind", ["en", "zh", "mixed"])
+@pytest.mark.parametrize("block_size", [1, 7, 333, 1 << 16])
+def test_streaming_chunker_matches_legacy_chunker(kind, block_size):
+    text = synthetic_text(kind, 20000, seed=block_size)
+    expected = legacy_chunk_text(text)
+    assert list(iter_text_chunks(_blocks(text, block_size))) == expected
+
+
+@pytest.mark.parametrize("chunk_size,overlap", [(50, 10), (120, 0), (500, 100), (80, 79)])
+def test_chunk_size_and_overlap(chunk_size, overlap):
+    text = synthetic_text("mixed", 5000, seed=chunk_size)
+    expected = legacy_chunk_text(text, chunk_size, overlap)
+    assert list(iter_text_chunks(_blocks(text, 97), chunk_size, overlap)) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cut_prefers_higher_priority_ending(seed):
+    # 偷看範圍內常同時出現多種結束符號：要選 SENTENCE_ENDINGS 中較前面的，而不是位置最前面的
+    rng = random.Random(seed)
+    text = "".join(rng.choice("ab  .!?\n。！？") for _ in range(5000))
+    for chunk_size, overlap in [(20, 5), (60, 30), (500, 100)]:
+        expected = legacy_chunk_text(text, chunk_size, overlap)
+        assert list(iter_text_chunks(_blocks(text, 13), chunk_size, overlap)) == expected
+        assert precomputed_chunk_text(text, chunk_size, overlap) == expected
+
+
+@pytest.mark.parametrize("text", ["", "   \n\n  ", "short text", "x" * 1234])
+def test_edge_cases(text):
+    assert list(iter_text_chunks([text])) == legacy_chunk_text(text)
+
+
+def test_iter_text_file_keeps_newlines(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_bytes("第一行\r\nsecond line\n資訊檢索".encode("utf-8"))
+    assert "".join(iter_text_file(str(path), block_size=3)) == "第一行\r\nsecond line\n資訊檢索"
+
+
+def test_utf8_validator_accepts_split_multibyte_characters():
+    data = "  資訊檢索".encode("utf-8")
+    validator = Utf8Validator()
+    for i in range(len(data)):
+        validator.feed(data[i:i + 1])
+    validator.feed(b"", final=True)
+    assert validator.has_text
+
+
+def test_utf8_validator_rejects_invalid_bytes():
+    validator = Utf8Validator()
+    with pytest.raises(UnicodeDecodeError):
+        validator.feed(b"\xff\xfe", final=True)
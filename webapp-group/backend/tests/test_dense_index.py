@@ -0,0 +1,111 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from services.dense_index import DenseIndex, Encoder, HashingEncoder, quantize  # noqa: E402
+
+
+def _write_jsonl(path, doc_id, texts):
+    with open(path, "w", encoding="utf-8") as f:
+        for i, text in enumerate(texts):
+            f.write(json.dumps({"id": f"{doc_id}#{i}", "contents": text, "metadata": {"chunk_index": i}}) + "\n")
+
+
+@pytest.fixture
+def encoder():
+    return HashingEncoder(dim=64)
+
+
+def test_encoder_subclass_must_implement_encode():
+    class Incomplete(Encoder):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+    with pytest.raises(TypeError):
+        Encoder()
+
+
+def test_hashing_encoder_is_normalized_and_deterministic(encoder):
+    vectors = encoder.encode(["dense vector search", "dense vector search", ""])
+    assert vectors.shape == (3, 64)
+    assert np.allclose(np.linalg.norm(vectors[:2], axis=1), 1.0)
+    assert np.array_equal(vectors[0], vectors[1])
+    assert not vectors[2].any()
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_quantize_preserves_inner_products(encoder, dtype):
+    vectors = encoder.encode(["bm25 ranking", "semantic retrieval", "資訊檢索系統"])
+    matrix, scales = quantize(vectors, dtype)
+    restored = matrix.astype(np.float32) * (scales[:, None] if scales is not None else 1)
+    assert np.allclose(restored @ vectors[0], vectors @ vectors[0], atol=0.02)
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float16"])
+def test_search_matches_exact_cosine(tmp_path, encoder, dtype):
+    texts = {f"d{i}": [f"topic{i} word{j} shared" for j in range(7)] for i in range(4)}
+    index = DenseIndex(root=str(tmp_path / "vectors"), encoder=encoder, dtype=dtype, block_rows=3)
+    for doc_id, chunks in texts.items():
+        writer = index.writer(doc_id)
+        for chunk in writer.wrap(iter(chunks)):
+            pass
+        assert writer.commit() == len(chunks)
+
+    query = encoder.encode(["topic2 word3"])[0]
+    exact = sorted(
+        ((f"{doc_id}#{i}", float(vector @ query))
+         for doc_id, chunks in texts.items() for i, vector in enumerate(encoder.encode(chunks))),
+        key=lambda item: -item[1]
+    )[:5]
+    results = index.search_vectors(query, None, k=5)[0]
+    assert results[0][0] == exact[0][0] == "d2#3"
+    assert [score for _, score in results] == pytest.approx([score for _, score in exact], abs=0.02)
+
+    # doc_id 預先過濾
+    filtered = index.search("topic2 word3", ["d0", "d1"], k=5)
+    assert filtered and all(chunk_id.split("#")[0] in ("d0", "d1") for chunk_id, _ in filtered)
+
+
+def test_sync_delete_and_reencode(tmp_path, encoder):
+    jsonl_dir = tmp_path / "jsonl"
+    jsonl_dir.mkdir()
+    _write_jsonl(jsonl_dir / "a.json", "a", ["alpha text", "beta text"])
+    _write_jsonl(jsonl_dir / "b.json", "b", ["gamma text"])
+    index = DenseIndex(root=str(tmp_path / "vectors"), encoder=encoder)
+    assert index.sync(str(jsonl_dir)) == 2
+    assert index.sync(str(jsonl_dir)) == 0
+    assert index.search("gamma", None, k=1)[0][0] == "b#0"
+
+    (jsonl_dir / "b.json").unlink()
+    assert index.sync(str(jsonl_dir)) == 0
+    assert index.stored_doc_ids() == ["a"]
+
+    # 編碼器改變時全部重新編碼
+    other = DenseIndex(root=str(tmp_path / "vectors"), encoder=HashingEncoder(dim=32))
+    assert other.sync(str(jsonl_dir)) == 1
+    assert other.search("alpha", None, k=1)[0][0] == "a#0"
+
+
+def test_disabled_index_returns_nothing(tmp_path):
+    index = DenseIndex(root=str(tmp_path / "vectors"), encoder=None)
+    assert not index.enabled
+    assert index.search("anything", None, k=5) == []
+    assert index.sync(str(tmp_path)) == 0
+
+
+def test_encoder_is_not_created_at_import():
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (
+        "import services.dense_index as d\n"
+        "assert d.get_encoder.cache_info().currsize == 0\n"
+        "assert d.get_dense_index().enabled\n"
+        "assert d.get_encoder.cache_info().currsize == 1\n"
+    )
+    env = dict(os.environ, DENSE_ENCODER="hashing")
+    subprocess.run([sys.executable, "-c", code], cwd=backend_dir, env=env, check=True)
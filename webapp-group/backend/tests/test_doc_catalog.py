@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+from services.doc_catalog import DocumentCatalog, file_sha256
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "jsonl").mkdir()
+    return tmp_path
+
+
+def _catalog(data_dir) -> DocumentCatalog:
+    return DocumentCatalog(
+        path=str(data_dir / "catalog.sqlite3"),
+        upload_dir=str(data_dir / "uploads"),
+        jsonl_dir=str(data_dir / "jsonl"),
+        legacy_manifest_path=str(data_dir / "manifest.json")
+    )
+
+
+def _write_document(data_dir, doc_id: str, content: bytes, chunks: int = 2, mtime: float = 1000.0) -> None:
+    (data_dir / "uploads" / f"{doc_id}.txt").write_bytes(content)
+    jsonl_path = data_dir / "jsonl" / f"{doc_id}.json"
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i in range(chunks):
+            f.write(json.dumps({"id": f"{doc_id}#{i}", "contents": "x", "metadata": {"filename": f"{doc_id}.txt"}}) + "\n")
+    os.utime(jsonl_path, (mtime, mtime))
+
+
+def test_claim_dedupes_by_content_hash(data_dir):
+    catalog = _catalog(data_dir)
+    assert catalog.claim("a", "a.txt", "h1", 10) is None
+    assert catalog.claim("b", "b.txt", "h1", 10) == "a"
+    assert catalog.add_alias("a", "b.txt")
+    assert not catalog.add_alias("a", "b.txt")
+    entry = catalog.get("a")
+    assert (entry["status"], entry["aliases"]) == ("processing", ["b.txt"])
+    assert catalog.get("b") is None
+
+
+def test_backfill_keeps_documents_with_the_same_content(data_dir):
+    _write_document(data_dir, "first", b"same bytes", mtime=1000)
+    _write_document(data_dir, "second", b"same bytes", mtime=2000)
+    catalog = _catalog(data_dir)
+    entries = catalog.list_documents()
+    assert [entry["doc_id"] for entry in entries] == ["first", "second"]
+    assert all(entry["status"] == "ready" and entry["chunk_count"] == 2 for entry in entries)
+    # 新上傳相同內容時沿用最早的文件
+    content_hash = file_sha256(str(data_dir / "uploads" / "first.txt"))
+    assert catalog.claim("third", "third.txt", content_hash, 10) == "first"
+
+
+def test_recover_interrupted_documents(data_dir):
+    catalog = _catalog(data_dir)
+    catalog.claim("done", "done.txt", "h1", 10)
+    catalog.claim("lost", "lost.txt", "h2", 10)
+    _write_document(data_dir, "done", b"done")
+    catalog._conn.close()
+
+    reopened = _catalog(data_dir)
+    assert [(entry["doc_id"], entry["status"]) for entry in reopened.list_documents()] == [("done", "ready")]
+
+
+def test_transaction_rolls_back_on_error(data_dir):
+    catalog = _catalog(data_dir)
+    with pytest.raises(RuntimeError):
+        with catalog.transaction():
+            catalog.claim("a", "a.txt", "h1", 10)
+            raise RuntimeError("file write failed")
+    assert catalog.count() == 0
+
+
+def test_list_documents_sort_and_paging(data_dir):
+    catalog = _catalog(data_dir)
+    for doc_id, size in [("a", 30), ("b", 10), ("c", 20)]:
+        catalog.claim(doc_id, f"{doc_id}.txt", doc_id, size)
+    assert [entry["doc_id"] for entry in catalog.list_documents(sort="size")] == ["b", "c", "a"]
+    assert [entry["doc_id"] for entry in catalog.list_documents(1, 1, sort="size", descending=True)] == ["c"]
+    with pytest.raises(ValueError):
+        catalog.list_documents(sort="doc_id; DROP TABLE documents")
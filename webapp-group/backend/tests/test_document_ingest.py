@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from services import document
+from services.chunk_store import ChunkStore
+from services.dense_index import DenseIndex, HashingEncoder
+from services.doc_catalog import DocumentCatalog
+
+DOC_ID = "doc-1"
+
+
+def _catalog(tmp_path) -> DocumentCatalog:
+    return DocumentCatalog(
+        path=str(tmp_path / "catalog.sqlite3"),
+        upload_dir=str(tmp_path / "uploads"),
+        jsonl_dir=str(tmp_path / "jsonl"),
+        legacy_manifest_path=str(tmp_path / "manifest.json")
+    )
+
+
+@pytest.fixture
+def ingest_env(tmp_path, monkeypatch):
+    """把 document.py 的資料目錄與 singleton 換成 tmp_path 底下的實例"""
+    for name in ("uploads", "jsonl"):
+        (tmp_path / name).mkdir()
+    catalog = _catalog(tmp_path)
+    store = ChunkStore(root=str(tmp_path / "chunks"), jsonl_dir=str(tmp_path / "jsonl"))
+    dense = DenseIndex(root=str(tmp_path / "vectors"), encoder=HashingEncoder(dim=16))
+
+    monkeypatch.setattr(document, "UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(document, "JSONL_DIR", str(tmp_path / "jsonl"))
+    monkeypatch.setattr(document, "doc_catalog", catalog)
+    monkeypatch.setattr(document, "chunk_store", store)
+    monkeypatch.setattr(document, "get_dense_index", lambda: dense)
+    return tmp_path, catalog
+
+
+def _files(root) -> list:
+    return sorted(str(p.relative_to(root)) for p in root.rglob("*") if p.is_file() and p.suffix != ".sqlite3")
+
+
+def test_failed_ingest_leaves_nothing_behind(ingest_env, monkeypatch):
+    tmp_path, catalog = ingest_env
+    save_path = tmp_path / "uploads" / f"{DOC_ID}.txt"
+    save_path.write_text("Sentence one. Sentence two. " * 200, encoding="utf-8")
+    assert catalog.claim(DOC_ID, "a.txt", "hash", save_path.stat().st_size) is None
+
+    # JSONL / chunk store / 向量都寫出之後才失敗
+    def fail():
+        assert (tmp_path / "jsonl" / f"{DOC_ID}.json").exists()
+        assert (tmp_path / "chunks" / f"{DOC_ID}.bin").exists()
+        assert (tmp_path / "vectors" / f"{DOC_ID}.npy").exists()
+        raise RuntimeError("indexing crashed")
+
+    monkeypatch.setattr(document, "search_backend", fail)
+
+    with pytest.raises(RuntimeError, match="indexing crashed"):
+        document.DocumentService()._run_ingest(DOC_ID, "a.txt", str(save_path), False, lambda **kw: None)
+
+    assert catalog.get(DOC_ID) is None
+    assert [f for f in _files(tmp_path) if DOC_ID in f] == []
+    # 重新啟動後也不會由殘留的 JSONL 補回目錄
+    assert _catalog(tmp_path).get(DOC_ID) is None
@@ -0,0 +1,83 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("pyserini")
+
+from services.bm25_engine import lucene_available
+from services.lucene_query import DOC_KEY_FIELD, build_filtered_query, doc_filter_key
+
+if not lucene_available():
+    pytest.skip("Java / Lucene is not available", allow_module_level=True)
+
+from pyserini.search.lucene import LuceneSearcher
+
+from services.lucene_writer import delete_by_terms
+
+QUERY = "retrieval ranking"
+
+
+def _record(doc_id: str, chunk: int, text: str) -> dict:
+    """與 document.py 寫入 JSONL 的欄位相同"""
+    return {
+        "id": f"{doc_id}#{chunk}",
+        "contents": text,
+        DOC_KEY_FIELD: doc_filter_key(doc_id),
+        "metadata": {"doc_id": doc_id, "filename": f"{doc_id}.txt", "chunk_index": chunk},
+    }
+
+
+@pytest.fixture()
+def index_path(tmp_path):
+    """以與 DocumentService._build_subindex 相同的參數建立兩份文件的索引"""
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    docs = {
+        "doc-a": ["retrieval ranking with bm25", "ranking functions for retrieval"],
+        "doc-b": ["dense retrieval and ranking models"],
+    }
+    for doc_id, chunks in docs.items():
+        with open(input_dir / f"{doc_id}.json", "w", encoding="utf-8") as fh:
+            for i, text in enumerate(chunks):
+                fh.write(json.dumps(_record(doc_id, i, text)) + "\n")
+
+    path = tmp_path / "index"
+    cmd = [
+        sys.executable, "-m", "pyserini.index.lucene",
+        "--collection", "JsonCollection",
+        "--input", str(input_dir),
+        "--index", str(path),
+        "--generator", "DefaultLuceneDocumentGenerator",
+        "--threads", "1",
+        "--storePositions", "--storeDocvectors",
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr or result.stdout
+    return str(path)
+
+
+def _hit_docs(index_path: str, doc_ids=None) -> list:
+    searcher = LuceneSearcher(index_path)
+    try:
+        if doc_ids is None:
+            hits = searcher.search(QUERY, k=10)
+        else:
+            hits = searcher.search(build_filtered_query(searcher, QUERY, doc_ids), k=10)
+        return sorted(hit.docid for hit in hits)
+    finally:
+        searcher.close()
+
+
+def test_filter_limits_hits_to_selected_document(index_path):
+    assert _hit_docs(index_path) == ["doc-a#0", "doc-a#1", "doc-b#0"]
+    assert _hit_docs(index_path, ["doc-b"]) == ["doc-b#0"]
+    assert _hit_docs(index_path, ["doc-a"]) == ["doc-a#0", "doc-a#1"]
+
+
+def test_delete_by_doc_key_removes_all_chunks(index_path):
+    delete_by_terms(index_path, DOC_KEY_FIELD, [doc_filter_key("doc-a")])
+
+    assert _hit_docs(index_path) == ["doc-b#0"]
+    assert _hit_docs(index_path, ["doc-a"]) == []
@@ -0,0 +1,37 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics import STAGE_SECONDS, collect_timings, record_stage, render_metrics, track_stage
+
+
+def test_collect_timings_accumulates_stages():
+    with collect_timings() as timings:
+        record_stage("test", "search", 0.010)
+        record_stage("test", "search", 0.005)
+        with track_stage("test", "rewrite"):
+            pass
+    record_stage("test", "search", 1.0)   # 區塊外只記錄到 histogram
+    assert timings["search"] == 15.0
+    assert "rewrite" in timings
+
+
+def test_worker_threads_do_not_lose_samples():
+    workers, samples = 8, 2000
+
+    def work():
+        for _ in range(samples):
+            record_stage("test", "searcher_load", 0.001)
+
+    with collect_timings() as timings:
+        with ThreadPoolExecutor(workers) as pool:
+            futures = [pool.submit(contextvars.copy_context().run, work) for _ in range(workers)]
+            for future in futures:
+                future.result()
+    assert round(timings["searcher_load"]) == workers * samples
+
+
+def test_render_metrics_includes_stage_histogram():
+    record_stage("test", "render", 0.02)
+    text = render_metrics()
+    assert f"# TYPE {STAGE_SECONDS.name} histogram" in text
+    assert 'rag_stage_duration_seconds_count{pipeline="test",stage="render"}' in text
@@ -0,0 +1,40 @@
+import pytest
+
+from services.text_analysis import analyze, porter_stem
+
+
+@pytest.mark.parametrize("word,stem", [
+    ("caresses", "caress"),
+    ("ponies", "poni"),
+    ("relational", "relat"),
+    ("generalization", "gener"),
+    ("hopping", "hop"),
+    ("agreed", "agre"),
+    ("happy", "happi"),
+    ("is", "is"),
+])
+def test_porter_stem(word, stem):
+    assert porter_stem(word) == stem
+
+
+def test_english_lowercase_stopwords_and_stemming():
+    assert analyze("The cats are running quickly!") == ["cat", "run", "quickli"]
+    assert analyze("John's BM25 ranking") == ["john", "bm25", "rank"]
+
+
+def test_numbers_keep_decimal_points():
+    assert analyze("version 3.14 costs 1,000") == ["version", "3.14", "cost", "1,000"]
+
+
+def test_cjk_bigrams():
+    assert analyze("資訊檢索") == ["資訊", "訊檢", "檢索"]
+    assert analyze("書") == ["書"]
+
+
+def test_mixed_cjk_and_latin_token():
+    assert analyze("Hello世界") == ["hello", "世界"]
+
+
+def test_empty_and_punctuation_only():
+    assert analyze("") == []
+    assert analyze("... !!! ___") == []
@@ -2,7 +2,7 @@
 "use client";
 
 import { createContext, useContext, useState, ReactNode, useCallback, useEffect } from 'react';
-import { UploadResponse } from '@/types';
+import { UploadResponse, DocumentStatus } from '@/types';
 import * as api from '@/lib/api';
 import { toast } from "sonner";
 
@@ -16,10 +16,41 @@ type DocumentContextType = {
 
 const DocumentContext = createContext<DocumentContextType | undefined>(undefined);
 
+// 背景處理進度的輪詢間隔與上限（毫秒）
+const STATUS_POLL_INTERVAL = 1500;
+const STATUS_POLL_TIMEOUT = 10 * 60 * 1000;
+const ACTIVE_STATUSES = ["queued", "processing"];
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+/**
+ * 輪詢 /api/document/status/{id} 直到背景處理結束，回傳最後的狀態；逾時回傳 null
+ */
+const waitForIngestion = async (id: string): Promise<DocumentStatus | null> => {
+  const deadline = Date.now() + STATUS_POLL_TIMEOUT;
+  while (Date.now() < deadline) {
+    try {
+      const status = await api.getDocumentStatus(id);
+      if (!ACTIVE_STATUSES.includes(status.status)) return status;
+    } catch (error) {
+      // 暫時性的網路錯誤：繼續輪詢
+      console.error("Failed to fetch document status:", error);
+    }
+    await sleep(STATUS_POLL_INTERVAL);
+  }
+  return null;
+};
+
 export const DocumentProvider = ({ children }: { children: ReactNode }) => {
   const [documents, setDocuments] = useState<UploadResponse[]>([]);
   const [isLoading, setIsLoading] = useState(false);
 
+  // 不切換 isLoading 的重新整理（背景處理完成後使用）
+  const refreshDocuments = useCallback(async () => {
+    const docs = await api.getDocuments();
+    setDocuments(docs);
+  }, []);
+
   const fetchDocuments = useCallback(async () => {
     setIsLoading(true);
     try {
@@ -43,8 +74,32 @@ export const DocumentProvider = ({ children }: { children: ReactNode }) => {
     try {
       const uploadPromises = files.map(file => api.uploadDocument(file));
       const results = await Promise.all(uploadPromises);
-      setDocuments(prevDocs => [...prevDocs, ...results]);
-      toast.success(`${files.length} 個文件已成功上傳並索引。`);
+      // 內容相同的檔案會回傳既有文件的 id，不重複加入列表
+      setDocuments(prevDocs => {
+        const knownIds = new Set(prevDocs.map(doc => doc.id));
+        const newDocs = results.filter(doc => {
+          if (knownIds.has(doc.id)) return false;
+          knownIds.add(doc.id);
+          return true;
+        });
+        return [...prevDocs, ...newDocs];
+      });
+      toast.success(`${files.length} 個文件已上傳，正在背景處理與索引。`);
+
+      // 背景處理完成後更新列表（處理失敗的文件會從列表移除）
+      const pending = results.filter(doc => ACTIVE_STATUSES.includes(doc.status));
+      pending.forEach(doc => {
+        waitForIngestion(doc.id).then(status => {
+          if (status?.status === "ready") {
+            toast.success(`${doc.filename} 已完成索引。`);
+          } else if (status?.status === "failed") {
+            toast.error(`${doc.filename} 處理失敗${status.error ? `：${status.error}` : "。"}`);
+          } else {
+            toast.error(`${doc.filename} 處理逾時，請稍後重新整理列表。`);
+          }
+          return refreshDocuments();
+        }).catch(error => console.error("Failed to refresh documents:", error));
+      });
     } catch (error) {
       console.error("Failed to upload files:", error);
       toast.error("文件上傳過程中發生錯誤。");
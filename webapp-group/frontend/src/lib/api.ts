@@ -2,6 +2,7 @@
 // Updated: Added support for selection-aware notebook editing
 import { 
   UploadResponse, 
+  DocumentStatus, 
   ChatRequest, 
   ChatResponse, 
   SimpleChatRequest, 
@@ -43,6 +44,22 @@ export const uploadDocument = async (file: File): Promise<UploadResponse> => {
   }
 };
 
+/**
+ * 查詢背景處理（解析 / 分塊 / 索引）的進度
+ * @param id - The ID returned by uploadDocument.
+ * @returns A promise that resolves to the job status.
+ */
+export const getDocumentStatus = async (id: string): Promise<DocumentStatus> => {
+  const response = await fetch(`http://localhost:8000/api/document/status/${id}`);
+
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(`Status request failed: ${errorData.detail || response.statusText}`);
+  }
+
+  return await response.json();
+};
+
 /**
  * [已更新] 真實獲取索引文件列表
  * @returns A promise that resolves to an array of UploadResponse.
@@ -7,10 +7,21 @@ export interface UploadResponse {
   id: string;
   filename: string;
   file_type: "pdf" | "txt";
-  status: "indexed" | "processing" | "error";
+  status: "queued" | "processing" | "ready" | "failed";
   created_at: string;
 }
 
+/**
+ * Progress of a background ingestion job (GET /api/document/status/{id}).
+ */
+export interface DocumentStatus {
+  id: string;
+  status: "queued" | "processing" | "ready" | "failed";
+  stage?: string;
+  indexing?: "running" | "done" | "failed" | "skipped";
+  error?: string | null;
+}
+
 /**
  * Represents the request payload for a chat interaction.
  */